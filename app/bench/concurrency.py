@@ -0,0 +1,165 @@
+"""Benchmarks concurrent waits on the k8s thread pools.
+
+Runs the k8s wait helpers in-process against a fake API server with one
+Deployment and measures, for each size:
+
+  waits_s   how long size concurrent waits on a check which blocks for
+            BLOCK seconds take, they overlap in the request pool, see
+            k8s.executor.run_blocking, so they take BLOCK seconds per
+            K8S_REQUEST_THREADS waits
+  cancel_s  how long it takes until the watch pool is free again after
+            size concurrent watches are cancelled, the pool has exactly
+            size threads, see k8s.watch.WatchStop
+
+Results are compared against the "concurrency" entry of the regression
+thresholds.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from datetime import timedelta
+from typing import Dict
+
+from fakeapi import FakeApiServer, FakeCluster
+from run import BENCH_DIR, SRC_DIR, check
+
+sys.path.insert(0, SRC_DIR)
+
+from k8s import clients, executor, wait_for_reconciliation  # noqa: E402
+from k8s.executor import run_blocking, watch_executor  # noqa: E402
+from views.pod import list_pods_for_deployment  # noqa: E402
+
+__author__ = "Noah Hummel"
+
+
+# seconds each check of the waits_s scenario blocks
+BLOCK = 0.5
+# seconds the watches of the cancel_s scenario run before they're cancelled
+WATCHING = 0.5
+TIMEOUT = timedelta(hours=6)
+
+
+def _blocking_check() -> bool:
+    time.sleep(BLOCK)
+    return True
+
+
+async def time_waits(size: int) -> float:
+    """Waits on size blocking checks at once, returns the seconds taken."""
+    start = time.monotonic()
+    await asyncio.gather(*[
+        wait_for_reconciliation(bool, TIMEOUT, _blocking_check)
+        for _ in range(size)])
+    return time.monotonic() - start
+
+
+async def time_cancel(size: int) -> float:
+    """Cancels size watches, returns the seconds until the pool is free.
+
+    The watches wait for a Deployment's Pods to go away, which never
+    happens. The pool is free once it runs size calls at once.
+    """
+    waits = [asyncio.ensure_future(wait_for_reconciliation(
+        lambda pods: not pods, TIMEOUT, list_pods_for_deployment,
+        "app", "bench")) for _ in range(size)]
+    await asyncio.sleep(WATCHING)
+    start = time.monotonic()
+    for wait in waits:
+        wait.cancel()
+    await asyncio.gather(*waits, return_exceptions=True)
+
+    barrier = asyncio.Semaphore(0)
+    loop = asyncio.get_event_loop()
+
+    def _arrive():
+        loop.call_soon_threadsafe(barrier.release)
+        time.sleep(BLOCK)
+
+    calls = [run_blocking(_arrive, executor=watch_executor())
+             for _ in range(size)]
+    arrivals = asyncio.gather(*calls)
+    for _ in range(size):
+        await barrier.acquire()
+    seconds = time.monotonic() - start
+    await arrivals
+    return seconds
+
+
+def run(size: int, workdir: str) -> Dict:
+    """Runs both scenarios with size concurrent waits.
+
+    Args:
+        size: Number of concurrent waits.
+        workdir: Directory for the kubeconfig of the fake API server.
+
+    Returns:
+        The result of the run.
+    """
+    cluster = FakeCluster()
+    cluster.add_deployment("bench", "app")
+    server = FakeApiServer(cluster).start()
+    kubeconfig = os.path.join(workdir, f"concurrency-{size}.kubeconfig")
+    with open(kubeconfig, "w") as f:
+        json.dump(server.kubeconfig(), f)
+    # every cluster gets its own thread pools, sized when first used
+    name = f"concurrency-{size}"
+    clients.load(name, config_file=kubeconfig, pool_maxsize=size, qps=0)
+    executor.WATCH_THREADS = size
+
+    async def _run():
+        with clients.use(name):
+            return await time_waits(size), await time_cancel(size)
+
+    try:
+        waits, cancel = asyncio.run(_run())
+    finally:
+        server.stop()
+    return {
+        "scenario": "concurrency",
+        "deployments": size,
+        "exit_code": 0,
+        "waits_s": round(waits, 3),
+        "cancel_s": round(cancel, 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=lambda s: [int(n) for n in
+                                                   s.split(",")],
+                        default=[10, 50], help="Comma separated numbers of "
+                                               "concurrent waits")
+    parser.add_argument("-o", "--output", default="concurrency-results.json",
+                        help="JSON file to write the results to")
+    parser.add_argument("--thresholds",
+                        default=os.path.join(BENCH_DIR, "thresholds.json"),
+                        help="JSON file with regression thresholds")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            result = run(size, workdir)
+            results.append(result)
+            print(f"{size:6d}: waits {result['waits_s']}s, "
+                  f"cancel {result['cancel_s']}s")
+
+    thresholds = dict()
+    if os.path.exists(args.thresholds):
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+    regressions = check(results, thresholds)
+    with open(args.output, "w") as f:
+        json.dump({"results": results, "regressions": regressions}, f,
+                  indent=2)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print(f"Results written to {args.output}")
+    exit(1 if regressions else 0)
@@ -0,0 +1,704 @@
+import bisect
+import heapq
+import itertools
+import json
+import select
+import socket
+import sys
+import threading
+import time
+import uuid
+
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+__author__ = "Noah Hummel"
+
+
+# resource -> (apiVersion, kind, namespaced)
+KINDS = {
+    "deployments": ("apps/v1", "Deployment", True),
+    "pods": ("v1", "Pod", True),
+    "persistentvolumeclaims": ("v1", "PersistentVolumeClaim", True),
+    "persistentvolumes": ("v1", "PersistentVolume", False),
+    "jobs": ("batch/v1", "Job", True),
+    "volumeattachments": ("storage.k8s.io/v1", "VolumeAttachment", False),
+}
+
+# seconds a watch checks whether its client went away
+_WATCH_CHECK_INTERVAL = 1.0
+
+
+class Timing:
+    """Delays of the controllers simulated by FakeCluster, in seconds.
+
+    Args:
+        reconcile: Until the Deployment controller reacts to a new scale.
+        termination: Until a deleted Pod is gone, its grace period.
+        startup: Until a new Pod is running.
+        job: Until a Job completes.
+        detach: Until the volumes of a deleted Pod are detached.
+    """
+
+    def __init__(self, reconcile: float=0.1, termination: float=0.5,
+                 startup: float=0.2, job: float=0.5, detach: float=0.2):
+        self.reconcile = reconcile
+        self.termination = termination
+        self.startup = startup
+        self.job = job
+        self.detach = detach
+
+    def to_dict(self) -> Dict[str, float]:
+        return dict(vars(self))
+
+
+class ApiError(Exception):
+
+    def __init__(self, code: int, reason: str, message: str):
+        super().__init__(message)
+        self.code = code
+        self.reason = reason
+        self.message = message
+
+    def to_status(self) -> Dict:
+        return {"kind": "Status", "apiVersion": "v1", "metadata": {},
+                "status": "Failure", "message": self.message,
+                "reason": self.reason, "code": self.code}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _parse_selector(text: Optional[str]) -> List[Tuple[str, str]]:
+    """Parses equality-based selectors like "app=web,tier=db"."""
+    if not text:
+        return []
+    pairs = []
+    for requirement in text.split(","):
+        key, _, value = requirement.partition("=")
+        pairs.append((key.strip(), value.lstrip("=").strip()))
+    return pairs
+
+
+def _matches(obj: Dict, labels: List[Tuple[str, str]],
+             fields: List[Tuple[str, str]]) -> bool:
+    metadata = obj["metadata"]
+    obj_labels = metadata.get("labels") or dict()
+    if any(obj_labels.get(k) != v for k, v in labels):
+        return False
+    for key, value in fields:
+        if key == "metadata.name" and metadata["name"] != value:
+            return False
+        if key == "metadata.namespace" and metadata.get("namespace") != value:
+            return False
+    return True
+
+
+class _Stream:
+    """Events of one resource in one namespace, for watches to resume from."""
+
+    def __init__(self, lock: threading.Lock):
+        self.changed = threading.Condition(lock)
+        self.versions: List[int] = []
+        self.events: List[Tuple[str, Dict, str]] = []
+
+    def since(self, resource_version: int) -> List[Tuple[str, Dict, str]]:
+        return self.events[bisect.bisect_right(self.versions,
+                                               resource_version):]
+
+
+class FakeCluster:
+    """Simulates Deployments, Pods, PVCs, Jobs and their controllers.
+
+    Objects are kept as camelCase dicts. Every change gets a new
+    resourceVersion and is recorded for watches. Scaling a Deployment
+    starts or terminates its Pods after the delays of timing, a Pod counts
+    towards status.replicas until it is gone, and Jobs complete after
+    timing.job. The time of each step of a backup is recorded per
+    Deployment in timeline, and every request in requests.
+
+    Args:
+        timing: Delays of the simulated controllers.
+        nodes: Number of nodes Pods are spread across.
+    """
+
+    def __init__(self, timing: Timing=None, nodes: int=3):
+        self.timing = timing if timing else Timing()
+        self.nodes = [f"node-{i}" for i in range(nodes)]
+        self.requests: Counter = Counter()
+        # monotonic time of the first request, set once first_requested is
+        self.first_request: Optional[float] = None
+        self.first_requested = threading.Event()
+        self.timeline: Dict[str, Dict[str, float]] = defaultdict(dict)
+        self._lock = threading.Lock()
+        self._objects: Dict[str, Dict[Tuple[str, str], Dict]] = \
+            defaultdict(dict)
+        self._streams: Dict[Tuple[str, str], _Stream] = dict()
+        self._resource_version = 0
+        self._claims: Dict[Tuple[str, str], str] = dict()
+        self._jobs_running: Counter = Counter()
+        self._names = itertools.count()
+        self._timers: List[Tuple[float, int, Callable]] = []
+        self._timer_added = threading.Condition(self._lock)
+        self._closed = False
+        self._timer_thread = threading.Thread(target=self._run_timers,
+                                              name="fake-controllers",
+                                              daemon=True)
+        self._timer_thread.start()
+
+    # storage
+
+    def _stream(self, resource: str, namespace: str) -> _Stream:
+        key = (resource, namespace)
+        if key not in self._streams:
+            self._streams[key] = _Stream(self._lock)
+        return self._streams[key]
+
+    def _store(self, resource: str, event_type: str, obj: Dict):
+        self._resource_version += 1
+        metadata = obj["metadata"]
+        metadata["resourceVersion"] = str(self._resource_version)
+        namespace = metadata.get("namespace", "")
+        key = (namespace, metadata["name"])
+        if event_type == "DELETED":
+            self._objects[resource].pop(key, None)
+        else:
+            self._objects[resource][key] = obj
+        stream = self._stream(resource, namespace)
+        stream.versions.append(self._resource_version)
+        stream.events.append((event_type, obj, json.dumps(
+            {"type": event_type, "object": obj})))
+        stream.changed.notify_all()
+
+    def _new(self, resource: str, obj: Dict) -> Dict:
+        api_version, kind, _ = KINDS[resource]
+        obj["apiVersion"] = api_version
+        obj["kind"] = kind
+        metadata = obj.setdefault("metadata", dict())
+        metadata["uid"] = str(uuid.uuid4())
+        metadata["creationTimestamp"] = _now()
+        self._store(resource, "ADDED", obj)
+        return obj
+
+    def _update(self, resource: str, obj: Dict):
+        self._store(resource, "MODIFIED", obj)
+
+    def _remove(self, resource: str, obj: Dict):
+        self._store(resource, "DELETED", obj)
+
+    def _get(self, resource: str, namespace: str, name: str) -> Dict:
+        obj = self._objects[resource].get((namespace, name))
+        if obj is None:
+            raise ApiError(404, "NotFound",
+                           f'{resource} "{name}" not found')
+        return obj
+
+    def _list(self, resource: str, namespace: Optional[str],
+              labels: List[Tuple[str, str]],
+              fields: List[Tuple[str, str]]) -> List[Dict]:
+        return [obj for (ns, _), obj in self._objects[resource].items()
+                if (namespace is None or ns == namespace)
+                and _matches(obj, labels, fields)]
+
+    # simulated controllers
+
+    def after(self, delay: float, fn: Callable):
+        """Calls fn with the cluster locked after delay seconds."""
+        with self._lock:
+            heapq.heappush(self._timers, (time.monotonic() + delay,
+                                          next(self._names), fn))
+            self._timer_added.notify()
+
+    def _run_timers(self):
+        with self._lock:
+            while not self._closed:
+                if not self._timers:
+                    self._timer_added.wait()
+                    continue
+                due, _, fn = self._timers[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._timer_added.wait(delay)
+                    continue
+                heapq.heappop(self._timers)
+                fn()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._timer_added.notify()
+            for stream in self._streams.values():
+                stream.changed.notify_all()
+
+    def add_deployment(self, namespace: str, name: str, replicas: int=1,
+                       claims: int=1, size: str="1Gi",
+                       labels: Dict[str, str]=None):
+        """Creates a running Deployment with a bound PVC per claim."""
+        volumes = []
+        with self._lock:
+            for i in range(claims):
+                claim = f"{name}-data-{i}"
+                volume = f"pv-{namespace}-{claim}"
+                self._new("persistentvolumes", {
+                    "metadata": {"name": volume, "labels": {
+                        "topology.kubernetes.io/zone": "zone-a"}},
+                    "spec": {"capacity": {"storage": size},
+                             "accessModes": ["ReadWriteOnce"],
+                             "claimRef": {"namespace": namespace,
+                                          "name": claim}},
+                    "status": {"phase": "Bound"}})
+                self._new("persistentvolumeclaims", {
+                    "metadata": {"name": claim, "namespace": namespace},
+                    "spec": {"accessModes": ["ReadWriteOnce"],
+                             "resources": {"requests": {"storage": size}},
+                             "volumeName": volume,
+                             "storageClassName": "standard"},
+                    "status": {"phase": "Bound",
+                               "capacity": {"storage": size}}})
+                self._claims[(namespace, claim)] = f"{namespace}/{name}"
+                volumes.append({"name": f"data-{i}",
+                                "persistentVolumeClaim": {
+                                    "claimName": claim}})
+            self._new("deployments", {
+                "metadata": {"name": name, "namespace": namespace,
+                             "generation": 1,
+                             "labels": dict(labels or {}, app=name)},
+                "spec": {
+                    "replicas": replicas,
+                    "selector": {"matchLabels": {"app": name}},
+                    "template": {
+                        "metadata": {"labels": {"app": name}},
+                        "spec": {
+                            "containers": [{
+                                "name": "app", "image": "app",
+                                "volumeMounts": [
+                                    {"name": v["name"],
+                                     "mountPath": f"/{v['name']}"}
+                                    for v in volumes]}],
+                            "volumes": volumes}}},
+                "status": {}})
+            for _ in range(replicas):
+                self._start_pod(namespace, name, running=True)
+            self._update_status(namespace, name)
+
+    def _pods(self, namespace: str, name: str) -> List[Dict]:
+        return self._list("pods", namespace, [("app", name)], [])
+
+    def _claim_names(self, pod_spec: Dict) -> List[str]:
+        return [v["persistentVolumeClaim"]["claimName"]
+                for v in pod_spec.get("volumes") or []
+                if v.get("persistentVolumeClaim")]
+
+    def _start_pod(self, namespace: str, name: str, running: bool=False):
+        deployment = self._get("deployments", namespace, name)
+        template = deployment["spec"]["template"]
+        node = self.nodes[next(self._names) % len(self.nodes)]
+        pod = self._new("pods", {
+            "metadata": {"name": f"{name}-{uuid.uuid4().hex[:10]}",
+                         "namespace": namespace,
+                         "labels": dict(template["metadata"]["labels"])},
+            "spec": dict(template["spec"], nodeName=node),
+            "status": {"phase": "Running" if running else "Pending"}})
+        for claim in self._claim_names(pod["spec"]):
+            volume = f"pv-{namespace}-{claim}"
+            self._new("volumeattachments", {
+                "metadata": {"name": f"csi-{uuid.uuid4().hex}"},
+                "spec": {"attacher": "fake", "nodeName": node,
+                         "source": {"persistentVolumeName": volume}},
+                "status": {"attached": True}})
+        if not running:
+            def _running():
+                if (namespace, pod["metadata"]["name"]) in \
+                        self._objects["pods"]:
+                    pod["status"]["phase"] = "Running"
+                    self._update("pods", pod)
+                    self._update_status(namespace, name)
+            self._after_locked(self.timing.startup, _running)
+
+    def _after_locked(self, delay: float, fn: Callable):
+        heapq.heappush(self._timers, (time.monotonic() + delay,
+                                      next(self._names), fn))
+        self._timer_added.notify()
+
+    def _terminate_pod(self, pod: Dict):
+        pod["metadata"]["deletionTimestamp"] = _now()
+        self._update("pods", pod)
+
+        def _gone():
+            namespace = pod["metadata"]["namespace"]
+            self._remove("pods", pod)
+            self._sync(namespace, pod["metadata"]["labels"]["app"])
+            self._after_locked(self.timing.detach,
+                               lambda: self._detach(namespace, pod))
+        self._after_locked(self.timing.termination, _gone)
+
+    def _detach(self, namespace: str, pod: Dict):
+        volumes = {f"pv-{namespace}-{claim}"
+                   for claim in self._claim_names(pod["spec"])}
+        node = pod["spec"]["nodeName"]
+        for attachment in list(self._objects["volumeattachments"].values()):
+            spec = attachment["spec"]
+            if spec["nodeName"] == node and \
+                    spec["source"]["persistentVolumeName"] in volumes:
+                self._remove("volumeattachments", attachment)
+
+    def _update_status(self, namespace: str, name: str):
+        deployment = self._get("deployments", namespace, name)
+        pods = self._pods(namespace, name)
+        replicas = len(pods)
+        status = {"replicas": replicas} if replicas else {}
+        available = sum(1 for p in pods if p["status"]["phase"] == "Running"
+                        and "deletionTimestamp" not in p["metadata"])
+        if available:
+            status["availableReplicas"] = available
+        status["observedGeneration"] = deployment["metadata"]["generation"]
+        if status != deployment["status"]:
+            deployment["status"] = status
+            self._update("deployments", deployment)
+        key = f"{namespace}/{name}"
+        if replicas == 0:
+            self.timeline[key].setdefault("pods_gone", time.monotonic())
+        elif "scale_up" in self.timeline[key] and \
+                replicas == deployment["spec"]["replicas"]:
+            self.timeline[key].setdefault("scaled_up", time.monotonic())
+            if available == replicas:
+                self.timeline[key].setdefault("available",
+                                              time.monotonic())
+
+    def _sync(self, namespace: str, name: str):
+        try:
+            deployment = self._get("deployments", namespace, name)
+        except ApiError:
+            return
+        desired = deployment["spec"]["replicas"]
+        live = [p for p in self._pods(namespace, name)
+                if "deletionTimestamp" not in p["metadata"]]
+        for pod in live[desired:]:
+            self._terminate_pod(pod)
+        for _ in range(desired - len(live)):
+            self._start_pod(namespace, name)
+        self._update_status(namespace, name)
+
+    def _scale(self, namespace: str, name: str, replicas: int):
+        deployment = self._get("deployments", namespace, name)
+        key = f"{namespace}/{name}"
+        phase = "scale_down" if replicas == 0 else "scale_up"
+        self.timeline[key].setdefault(phase, time.monotonic())
+        if deployment["spec"]["replicas"] != replicas:
+            deployment["spec"]["replicas"] = replicas
+            deployment["metadata"]["generation"] += 1
+            self._update("deployments", deployment)
+            self._after_locked(self.timing.reconcile,
+                               lambda: self._sync(namespace, name))
+
+    def _job_deployments(self, namespace: str, job: Dict) -> List[str]:
+        claims = self._claim_names(job["spec"]["template"]["spec"])
+        return sorted({self._claims[(namespace, c)] for c in claims
+                       if (namespace, c) in self._claims})
+
+    def _start_job(self, namespace: str, job: Dict):
+        deployments = self._job_deployments(namespace, job)
+        for key in deployments:
+            self.timeline[key].setdefault("job_created", time.monotonic())
+            self._jobs_running[key] += 1
+        job["status"] = {"active": 1, "startTime": _now()}
+        name = job["metadata"]["name"]
+        pod = self._new("pods", {
+            "metadata": {"name": f"{name}-{uuid.uuid4().hex[:5]}",
+                         "namespace": namespace,
+                         "labels": {"job-name": name}},
+            "spec": dict(job["spec"]["template"]["spec"],
+                         nodeName=self.nodes[0]),
+            "status": {"phase": "Running"}})
+
+        def _complete():
+            if (namespace, pod["metadata"]["name"]) in self._objects["pods"]:
+                pod["status"]["phase"] = "Succeeded"
+                self._update("pods", pod)
+            job["status"] = {
+                "succeeded": 1, "startTime": job["status"]["startTime"],
+                "completionTime": _now(),
+                "conditions": [{"type": "Complete", "status": "True",
+                                "lastProbeTime": _now(),
+                                "lastTransitionTime": _now()}]}
+            for key in deployments:
+                self._jobs_running[key] -= 1
+                if not self._jobs_running[key]:
+                    self.timeline[key]["jobs_done"] = time.monotonic()
+            if (namespace, job["metadata"]["name"]) in self._objects["jobs"]:
+                self._update("jobs", job)
+        self._after_locked(self.timing.job, _complete)
+
+    def _delete_job_pods(self, namespace: str, name: str):
+        # the garbage collector deletes the Pods of a deleted Job
+        for pod in self._list("pods", namespace, [("job-name", name)], []):
+            pod["metadata"]["deletionTimestamp"] = _now()
+            self._update("pods", pod)
+            self._after_locked(self.timing.termination,
+                               lambda pod=pod: self._remove("pods", pod))
+
+    # API
+
+    def _scale_object(self, deployment: Dict) -> Dict:
+        metadata = deployment["metadata"]
+        return {"kind": "Scale", "apiVersion": "autoscaling/v1",
+                "metadata": {"name": metadata["name"],
+                             "namespace": metadata["namespace"],
+                             "resourceVersion": metadata["resourceVersion"]},
+                "spec": {"replicas": deployment["spec"]["replicas"]},
+                "status": {"replicas":
+                           deployment["status"].get("replicas", 0),
+                           "selector": f"app={metadata['name']}"}}
+
+    def _count(self, request: str):
+        self.requests[request] += 1
+        if not self.first_requested.is_set():
+            self.first_request = time.monotonic()
+            self.first_requested.set()
+
+    def handle(self, verb: str, resource: str, namespace: Optional[str],
+               name: Optional[str], subresource: Optional[str],
+               query: Dict[str, str], body: Optional[Dict]) -> Dict:
+        """Handles a request which isn't a watch.
+
+        Raises:
+            ApiError: If the request fails.
+
+        Returns:
+            The response body.
+        """
+        if resource not in KINDS:
+            raise ApiError(404, "NotFound", "the server could not find "
+                                            "the requested resource")
+        self._count(f"{verb} {resource}" +
+                    (f"/{subresource}" if subresource else ""))
+        with self._lock:
+            if name is None and verb == "GET":
+                labels = _parse_selector(query.get("labelSelector"))
+                fields = _parse_selector(query.get("fieldSelector"))
+                api_version, kind, _ = KINDS[resource]
+                return {"kind": f"{kind}List", "apiVersion": api_version,
+                        "metadata": {"resourceVersion":
+                                     str(self._resource_version)},
+                        "items": self._list(resource, namespace, labels,
+                                            fields)}
+            if name is None and verb == "POST":
+                body.setdefault("metadata", dict())["namespace"] = namespace
+                if (namespace, body["metadata"]["name"]) in \
+                        self._objects[resource]:
+                    raise ApiError(409, "AlreadyExists",
+                                   f'{resource} "{body["metadata"]["name"]}"'
+                                   f' already exists')
+                obj = self._new(resource, body)
+                if resource == "jobs":
+                    self._start_job(namespace, obj)
+                return obj
+
+            obj = self._get(resource, namespace or "", name)
+            if subresource == "scale" and resource == "deployments":
+                if verb in ("PATCH", "PUT"):
+                    replicas = body.get("spec", dict()).get("replicas")
+                    if replicas is not None:
+                        self._scale(namespace, name, replicas)
+                return self._scale_object(obj)
+            if subresource == "log" and resource == "pods":
+                return ""
+            if subresource:
+                raise ApiError(404, "NotFound", f"{resource}/{subresource} "
+                                                f"is not simulated")
+            if verb == "GET":
+                return obj
+            if verb == "PATCH" and set(body) == {"metadata"} and \
+                    set(body["metadata"]) == {"annotations"}:
+                obj["metadata"].setdefault("annotations", dict()).update(
+                    body["metadata"]["annotations"])
+                self._update(resource, obj)
+                return obj
+            if verb == "DELETE":
+                self._remove(resource, obj)
+                if resource == "jobs":
+                    self._delete_job_pods(namespace, name)
+                return {"kind": "Status", "apiVersion": "v1",
+                        "metadata": {}, "status": "Success"}
+        raise ApiError(405, "MethodNotAllowed",
+                       f"{verb} {resource} is not simulated")
+
+    def watch(self, resource: str, namespace: Optional[str],
+              query: Dict[str, str], write: Callable[[str], None],
+              closed: Callable[[], bool]):
+        """Streams watch events until timeoutSeconds or the client is gone.
+
+        Raises:
+            ApiError: If the watch can't be started.
+        """
+        if resource not in KINDS or (namespace is None and KINDS[resource][2]):
+            raise ApiError(405, "MethodNotAllowed",
+                           f"watching {resource} across namespaces is not "
+                           f"simulated")
+        self._count(f"WATCH {resource}")
+        labels = _parse_selector(query.get("labelSelector"))
+        fields = _parse_selector(query.get("fieldSelector"))
+        timeout = float(query.get("timeoutSeconds") or 300)
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            since = int(query.get("resourceVersion") or
+                        self._resource_version)
+            # cluster scoped objects are stored without a namespace
+            stream = self._stream(resource, namespace or "")
+        while True:
+            with self._lock:
+                events = stream.since(since)
+                if not events:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or self._closed:
+                        return
+                    stream.changed.wait(min(remaining,
+                                            _WATCH_CHECK_INTERVAL))
+                    events = stream.since(since)
+                if events:
+                    since = int(events[-1][1]["metadata"]["resourceVersion"])
+            if not events and closed():
+                return
+            for _, obj, line in events:
+                if _matches(obj, labels, fields):
+                    write(line + "\n")
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    cluster: FakeCluster = None
+
+    def _route(self) -> Tuple[str, Optional[str], Optional[str],
+                              Optional[str], Dict[str, str]]:
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+        # /api/v1/... or /apis/<group>/<version>/...
+        parts = parts[2:] if parts[0] == "api" else parts[3:]
+        namespace = None
+        if len(parts) >= 3 and parts[0] == "namespaces":
+            namespace, parts = parts[1], parts[2:]
+        resource = parts[0] if parts else ""
+        name = parts[1] if len(parts) > 1 else None
+        subresource = parts[2] if len(parts) > 2 else None
+        return resource, namespace, name, subresource, query
+
+    def _send(self, code: int, body):
+        data = (body if isinstance(body, str) else json.dumps(body)).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _closed(self) -> bool:
+        readable, _, _ = select.select([self.connection], [], [], 0)
+        if not readable:
+            return False
+        try:
+            return self.connection.recv(1, socket.MSG_PEEK) == b""
+        except OSError:
+            return True
+
+    def _watch(self, resource: str, namespace: Optional[str],
+               query: Dict[str, str]):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def _write(line: str):
+            data = line.encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        self.cluster.watch(resource, namespace, query, _write, self._closed)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _handle(self, verb: str):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        resource, namespace, name, subresource, query = self._route()
+        try:
+            if verb == "GET" and query.get("watch") in ("true", "True", "1"):
+                self._watch(resource, namespace, query)
+            else:
+                self._send(200, self.cluster.handle(
+                    verb, resource, namespace, name, subresource, query,
+                    body))
+        except ApiError as e:
+            self._send(e.code, e.to_status())
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def log_message(self, format, *args):  # thousands of requests per run
+        pass
+
+
+class FakeApiServer(ThreadingHTTPServer):
+    """Serves a FakeCluster over HTTP on a local port.
+
+    Args:
+        cluster: The cluster to serve.
+        port: Port to listen on, 0 picks a free port.
+    """
+
+    daemon_threads = True
+    # many informers and watches connect at once
+    request_queue_size = 1024
+
+    def __init__(self, cluster: FakeCluster, port: int=0):
+        handler = type("Handler", (_Handler,), {"cluster": cluster})
+        super().__init__(("127.0.0.1", port), handler)
+        self.cluster = cluster
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        name="fake-api", daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> "FakeApiServer":
+        self._thread.start()
+        return self
+
+    def handle_error(self, request, client_address):
+        # clients killed mid request, e.g. by the startup benchmark
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def stop(self):
+        self.cluster.close()
+        self.shutdown()
+        self.server_close()
+
+    def kubeconfig(self) -> Dict:
+        """Returns a kubeconfig pointing to this server."""
+        return {
+            "apiVersion": "v1", "kind": "Config",
+            "clusters": [{"name": "fake", "cluster": {"server": self.url}}],
+            "users": [{"name": "fake", "user": {"token": "fake"}}],
+            "contexts": [{"name": "fake",
+                          "context": {"cluster": "fake", "user": "fake"}}],
+            "current-context": "fake",
+        }
@@ -0,0 +1,360 @@
+"""Checks and benchmarks the key-case conversion of k8s.resource.
+
+The converters are compared against the recursive, uncached implementation
+they replaced, which is kept here as reference:
+
+  identifiers  snake_case and camel_case of every attribute of the
+               kubernetes client models, and of random identifiers
+  manifests    to_snake_case of API server JSON, and normalize of to_dict()
+               output, with and without camel_case
+
+normalize deliberately differs from the reference strip_null: it also
+strips None values from dicts nested in lists, e.g. from the containers of
+a pod spec, which strip_null kept. The check pins that difference, i.e.
+normalize must equal strip_null applied to every dict at any depth.
+
+The benchmark converts large Deployments, built from the client models
+with many containers, volumes and env vars, with both implementations.
+Results are compared against the "resource" entry of the regression
+thresholds.
+"""
+import argparse
+import inspect
+import json
+import os
+import random
+import string
+import sys
+import time
+
+from enum import IntEnum, auto
+from typing import Callable, Dict, List, Union
+
+from run import BENCH_DIR, SRC_DIR, check
+
+sys.path.insert(0, SRC_DIR)
+
+from kubernetes import client  # noqa: E402
+from k8s.resource import snake_case, camel_case, to_snake_case, \
+    normalize  # noqa: E402
+
+__author__ = "Noah Hummel"
+
+
+# reference implementation, as of before the converters were memoized
+
+
+def reference_strip_null(resource: Union[Dict, List]) -> Union[Dict, List]:
+    if type(resource) is dict:
+        retval = dict()
+        for k, v in resource.items():
+            if type(v) is dict:
+                retval[k] = reference_strip_null(v)
+            elif v is not None:
+                retval[k] = v
+        return retval
+    elif type(resource) is list:
+        return [reference_strip_null(x) for x in resource]
+    else:
+        return resource
+
+
+def reference_snake_case(identifier: str) -> str:
+    class State(IntEnum):
+        Init = auto()
+        Upper = auto()
+        Lower = auto()
+
+    retval = ""
+    state = State.Init
+    next_state = State.Init
+    for char in identifier:
+        # state transition
+        if not char.isalpha():
+            next_state = State.Lower
+        elif char.isupper():
+            next_state = State.Upper
+        else:
+            next_state = State.Lower
+
+        # output
+        if state == State.Lower and next_state == State.Upper:
+            retval += f"_{char.lower()}"
+        else:
+            retval += char.lower()
+
+        state = next_state
+
+    return retval
+
+
+def reference_camel_case(identifier: str) -> str:
+    retval = ""
+
+    class State(IntEnum):
+        Init = auto()
+        Word = auto()
+        Separator = auto()
+
+    state = State.Init
+    next_state = State.Init
+    for char in identifier:
+        if char == "_":
+            next_state = State.Separator
+        else:
+            next_state = State.Word
+
+        # output
+        if state == State.Separator and next_state == State.Word:
+            retval += char.upper() if char.isalpha() else char
+        elif next_state != State.Separator:
+            retval += char
+
+        state = next_state
+
+    return retval
+
+
+def reference_to_snake_case(resource: Union[Dict, List]) \
+        -> Union[Dict, List]:
+    if type(resource) is dict:
+        retval = dict()
+        for k, v in resource.items():
+            new_k = reference_snake_case(k)
+            new_v = reference_to_snake_case(v)
+            retval[new_k] = new_v
+        return retval
+    elif type(resource) is list:
+        return [reference_to_snake_case(x) for x in resource]
+    else:
+        return resource
+
+
+def reference_to_camel_case(resource: Union[Dict, List]) \
+        -> Union[Dict, List]:
+    if type(resource) is dict:
+        retval = dict()
+        for k, v in resource.items():
+            new_k = reference_camel_case(k)
+            new_v = reference_to_camel_case(v)
+            retval[new_k] = new_v
+        return retval
+    elif type(resource) is list:
+        return [reference_to_camel_case(x) for x in resource]
+    else:
+        return resource
+
+
+def strip_null_deep(resource: Union[Dict, List]) -> Union[Dict, List]:
+    """reference_strip_null, applied to dicts nested in lists as well."""
+    if type(resource) is dict:
+        return {k: strip_null_deep(v) for k, v in resource.items()
+                if v is not None}
+    elif type(resource) is list:
+        return [strip_null_deep(x) for x in resource]
+    return resource
+
+
+# inputs
+
+
+def model_identifiers() -> List[str]:
+    """Returns the snake_case and camelCase names of all model attributes."""
+    identifiers = set()
+    for _, model in inspect.getmembers(client.models, inspect.isclass):
+        for snake, camel in getattr(model, "attribute_map", dict()).items():
+            identifiers.update((snake, camel))
+    return sorted(identifiers)
+
+
+def random_identifiers(count: int, seed: int=0) -> List[str]:
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + "_-.$ÄéßÜ"
+    return ["".join(rng.choice(alphabet)
+                    for _ in range(rng.randint(0, 24)))
+            for _ in range(count)]
+
+
+def new_deployment(index: int, containers: int=8, volumes: int=32,
+                   env: int=64) -> client.V1Deployment:
+    """Builds a large Deployment, like a sidecar-heavy production one."""
+    name = f"deployment-{index}"
+    return client.V1Deployment(
+        api_version="apps/v1", kind="Deployment",
+        metadata=client.V1ObjectMeta(
+            name=name, namespace="bench",
+            labels={"app": name, "app.kubernetes.io/part-of": "bench"},
+            annotations={"backup-runner/schedule": "@every 24h"}),
+        spec=client.V1DeploymentSpec(
+            replicas=3,
+            selector=client.V1LabelSelector(match_labels={"app": name}),
+            template=client.V1PodTemplateSpec(
+                metadata=client.V1ObjectMeta(labels={"app": name}),
+                spec=client.V1PodSpec(
+                    containers=[client.V1Container(
+                        name=f"container-{c}", image="app:latest",
+                        args=["--port", str(8080 + c)],
+                        env=[client.V1EnvVar(name=f"VAR_{e}",
+                                             value=str(e))
+                             for e in range(env)],
+                        ports=[client.V1ContainerPort(
+                            container_port=8080 + c, protocol="TCP")],
+                        readiness_probe=client.V1Probe(
+                            http_get=client.V1HTTPGetAction(
+                                path="/healthz", port=8080 + c),
+                            period_seconds=10),
+                        resources=client.V1ResourceRequirements(
+                            limits={"cpu": "1", "memory": "1Gi"},
+                            requests={"cpu": "100m", "memory": "128Mi"}),
+                        volume_mounts=[client.V1VolumeMount(
+                            name=f"volume-{v}", mount_path=f"/data/{v}")
+                            for v in range(volumes)])
+                        for c in range(containers)],
+                    tolerations=[client.V1Toleration(
+                        key="dedicated", operator="Equal", value="bench",
+                        effect="NoSchedule")],
+                    volumes=[client.V1Volume(
+                        name=f"volume-{v}",
+                        persistent_volume_claim=client.
+                        V1PersistentVolumeClaimVolumeSource(
+                            claim_name=f"{name}-data-{v}"))
+                        if v % 2 else client.V1Volume(
+                            name=f"volume-{v}",
+                            config_map=client.V1ConfigMapVolumeSource(
+                                name=f"{name}-config-{v}"))
+                        for v in range(volumes)]))))
+
+
+# checks
+
+
+def check_equivalence(deployments: List[client.V1Deployment],
+                      identifiers: List[str]) -> List[str]:
+    """Compares the converters against the reference implementation.
+
+    Returns:
+        A description of every mismatch.
+    """
+    mismatches = []
+    for identifier in identifiers:
+        for new, reference in ((snake_case, reference_snake_case),
+                               (camel_case, reference_camel_case)):
+            if new(identifier) != reference(identifier):
+                mismatches.append(f"{new.__name__}({identifier!r}) is "
+                                  f"{new(identifier)!r}, expected "
+                                  f"{reference(identifier)!r}")
+
+    api = client.ApiClient()
+    for deployment in deployments:
+        name = deployment.metadata.name
+        as_dict = deployment.to_dict()
+        as_json = api.sanitize_for_serialization(deployment)
+        cases = (
+            ("to_snake_case", to_snake_case(as_json),
+             reference_to_snake_case(as_json)),
+            ("normalize", normalize(as_dict),
+             strip_null_deep(reference_strip_null(as_dict))),
+            ("normalize camel_case", normalize(as_dict, camel_case),
+             reference_to_camel_case(
+                 strip_null_deep(reference_strip_null(as_dict)))),
+        )
+        for case, new, reference in cases:
+            if new != reference:
+                mismatches.append(f"{case} of {name} differs")
+        # the deliberate difference: None values of containers are kept
+        if reference_strip_null(as_dict) == normalize(as_dict):
+            mismatches.append(f"strip_null of {name} dropped None values "
+                              f"in lists, the check is out of date")
+    return mismatches
+
+
+def time_conversion(convert: Callable, resources: List,
+                    repeat: int) -> float:
+    start = time.monotonic()
+    for _ in range(repeat):
+        for resource in resources:
+            convert(resource)
+    return time.monotonic() - start
+
+
+def run(size: int, repeat: int=3, identifiers: int=100000) -> Dict:
+    """Checks and benchmarks the converters on size Deployments.
+
+    Args:
+        size: Number of Deployments to convert.
+        repeat: Number of times each Deployment is converted.
+        identifiers: Number of random identifiers to check.
+
+    Returns:
+        The result of the run, exit_code is 1 if any conversion differs.
+    """
+    deployments = [new_deployment(i) for i in range(size)]
+    mismatches = check_equivalence(
+        deployments, model_identifiers() + random_identifiers(identifiers))
+
+    api = client.ApiClient()
+    as_dicts = [deployment.to_dict() for deployment in deployments]
+    as_json = [api.sanitize_for_serialization(deployment)
+               for deployment in deployments]
+    timings = {
+        "to_snake_case_s": (
+            to_snake_case, reference_to_snake_case, as_json),
+        "normalize_camel_case_s": (
+            lambda r: normalize(r, camel_case),
+            lambda r: reference_to_camel_case(reference_strip_null(r)),
+            as_dicts),
+    }
+    result = {
+        "scenario": "resource",
+        "deployments": size,
+        "exit_code": 1 if mismatches else 0,
+        "mismatches": mismatches[:20],
+        "reference": dict(),
+    }
+    for metric, (new, reference, resources) in timings.items():
+        result[metric] = round(time_conversion(new, resources, repeat), 4)
+        result["reference"][metric] = round(
+            time_conversion(reference, resources, repeat), 4)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=lambda s: [int(n) for n in
+                                                   s.split(",")],
+                        default=[10], help="Comma separated numbers of "
+                                           "Deployments")
+    parser.add_argument("-n", "--repeat", type=int, default=3,
+                        help="Conversions of each Deployment")
+    parser.add_argument("-o", "--output", default="resource-results.json",
+                        help="JSON file to write the results to")
+    parser.add_argument("--thresholds",
+                        default=os.path.join(BENCH_DIR, "thresholds.json"),
+                        help="JSON file with regression thresholds")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        result = run(size, args.repeat)
+        results.append(result)
+        print(f"{size:5d}: to_snake_case {result['to_snake_case_s']:.3f}s "
+              f"(was {result['reference']['to_snake_case_s']:.3f}s), "
+              f"normalize camel_case {result['normalize_camel_case_s']:.3f}s "
+              f"(was {result['reference']['normalize_camel_case_s']:.3f}s)")
+        for mismatch in result["mismatches"]:
+            print(f"MISMATCH {mismatch}")
+
+    thresholds = dict()
+    if os.path.exists(args.thresholds):
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+    regressions = check(results, thresholds)
+    with open(args.output, "w") as f:
+        json.dump({"results": results, "regressions": regressions}, f,
+                  indent=2)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print(f"Results written to {args.output}")
+    exit(1 if regressions else 0)
@@ -0,0 +1,263 @@
+"""Benchmarks backups end to end against a local fake Kubernetes API server.
+
+Every run starts a FakeApiServer with the given number of Deployments and
+runs the backup runner against it in a subprocess:
+
+  backup         main.py backing up all Deployments in batch mode
+  wait           the k8s wait helpers scaling each Deployment down and up
+  wait-informer  the same, with informers enabled like main.py does
+
+Results are written as JSON and compared against regression thresholds.
+"""
+import argparse
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Dict, List, Optional
+
+from fakeapi import FakeApiServer, FakeCluster, Timing
+
+__author__ = "Noah Hummel"
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, "..", "src")
+
+SCENARIOS = ("backup", "wait", "wait-informer")
+# deployments per namespace, so large runs spread across many namespaces
+NAMESPACE_SIZE = 10
+
+_REQUESTS_SAMPLE = re.compile(
+    r'^backup_api_requests_total\{phase="([^"]*)",cluster="[^"]*"\} '
+    r'(\S+)$')
+
+
+def stats(values: List[float]) -> Optional[Dict[str, float]]:
+    """Summarizes values by their median, 95th percentile and maximum."""
+    if not values:
+        return None
+    values = sorted(values)
+
+    def _quantile(q: float) -> float:
+        return values[min(len(values) - 1, math.ceil(q * len(values)) - 1)]
+
+    return {"p50": round(_quantile(0.5), 4), "p95": round(_quantile(0.95), 4),
+            "max": round(values[-1], 4)}
+
+
+def _lags(timeline: Dict[str, Dict[str, float]], since: str, until: str) \
+        -> List[float]:
+    return [t[until] - t[since] for t in timeline.values()
+            if since in t and until in t]
+
+
+def _runner_requests(metrics_file: str) -> Dict[str, float]:
+    """Reads the API requests counted by the runner, by phase."""
+    requests = dict()
+    if not os.path.exists(metrics_file):
+        return requests
+    with open(metrics_file) as f:
+        for line in f:
+            match = _REQUESTS_SAMPLE.match(line.strip())
+            if match:
+                requests[match.group(1)] = float(match.group(2))
+    return requests
+
+
+def _populate(cluster: FakeCluster, deployments: int, claims: int):
+    for i in range(deployments):
+        cluster.add_deployment(f"bench-{i // NAMESPACE_SIZE}", f"app-{i}",
+                               claims=claims)
+
+
+def _run(command: List[str], kubeconfig: str, log_file: str,
+         qps: float) -> int:
+    env = dict(os.environ, KUBECONFIG=kubeconfig, K8S_QPS=str(qps))
+    with open(log_file, "w") as log:
+        return subprocess.call(command, cwd=SRC_DIR, env=env, stdout=log,
+                               stderr=subprocess.STDOUT)
+
+
+def run(scenario: str, deployments: int, timing: Timing, workdir: str,
+        concurrency: int=32, claims: int=1, qps: float=0) -> Dict:
+    """Runs a scenario once against a new fake API server.
+
+    Args:
+        scenario: One of SCENARIOS.
+        deployments: Number of Deployments to back up.
+        timing: Delays of the simulated controllers.
+        workdir: Directory for the kubeconfig, logs and metrics of the run.
+        concurrency: Maximum number of Deployments handled at once.
+        claims: Number of PVCs of each Deployment.
+        qps: K8S_QPS of the runner, 0 disables client side throttling.
+
+    Returns:
+        The results of the run.
+    """
+    cluster = FakeCluster(timing)
+    _populate(cluster, deployments, claims)
+    server = FakeApiServer(cluster).start()
+    prefix = os.path.join(workdir, f"{scenario}-{deployments}")
+    kubeconfig = f"{prefix}.kubeconfig"
+    with open(kubeconfig, "w") as f:
+        json.dump(server.kubeconfig(), f)
+    cluster.requests.clear()
+
+    if scenario == "backup":
+        command = [sys.executable, "main.py", "store", "-A",
+                   "-c", str(concurrency),
+                   "--namespace-concurrency", str(NAMESPACE_SIZE),
+                   "--backup-timeout", "10",
+                   "--metrics-file", f"{prefix}.prom"]
+    else:
+        command = [sys.executable, os.path.join(BENCH_DIR, "wait.py"),
+                   f"{prefix}.json", "-c", str(concurrency)]
+        if scenario == "wait-informer":
+            command.append("--informers")
+
+    start = time.monotonic()
+    exit_code = _run(command, kubeconfig, f"{prefix}.log", qps)
+    wall = time.monotonic() - start
+    server.stop()
+
+    timeline = cluster.timeline
+    requests = sum(cluster.requests.values())
+    result = {
+        "scenario": scenario,
+        "deployments": deployments,
+        "exit_code": exit_code,
+        "wall_s": round(wall, 3),
+        "requests_total": requests,
+        "requests_per_backup": round(requests / deployments, 2),
+        "requests": dict(sorted(cluster.requests.items())),
+    }
+    if scenario == "backup":
+        result.update({
+            "detect_termination_s": stats(
+                _lags(timeline, "pods_gone", "job_created")),
+            "detect_job_s": stats(_lags(timeline, "jobs_done", "scale_up")),
+            "downtime_s": stats(_lags(timeline, "scale_down", "scaled_up")),
+            "runner_requests": _runner_requests(f"{prefix}.prom"),
+        })
+    else:
+        detected = dict()
+        if os.path.exists(f"{prefix}.json"):
+            with open(f"{prefix}.json") as f:
+                detected = json.load(f)
+        for key, times in detected.items():
+            timeline[key]["pods_gone_detected"] = times["pods_gone"]
+            timeline[key]["scaled_up_detected"] = times["scaled_up"]
+        result.update({
+            "detect_termination_s": stats(
+                _lags(timeline, "pods_gone", "pods_gone_detected")),
+            "detect_scale_up_s": stats(
+                _lags(timeline, "scaled_up", "scaled_up_detected")),
+        })
+    return result
+
+
+def _lookup(result: Dict, path: str):
+    value = result
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def check(results: List[Dict], thresholds: Dict) -> List[str]:
+    """Compares results against thresholds.
+
+    Thresholds map scenario names to numbers of Deployments to limits,
+    e.g. {"backup": {"100": {"wall_s": 30, "detect_job_s.p95": 1.5}}}.
+    Limits are upper bounds on the value at their dotted path in a result.
+
+    Returns:
+        A description of every exceeded limit and failed run.
+    """
+    regressions = []
+    for result in results:
+        name = f"{result['scenario']}/{result['deployments']}"
+        if result["exit_code"] != 0:
+            regressions.append(f"{name}: exited with {result['exit_code']}")
+        limits = thresholds.get(result["scenario"], dict()).get(
+            str(result["deployments"]), dict())
+        for path, limit in limits.items():
+            value = _lookup(result, path)
+            if value is None:
+                regressions.append(f"{name}: {path} is missing")
+            elif value > limit:
+                regressions.append(f"{name}: {path} is {value}, "
+                                   f"limit is {limit}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", type=lambda s: s.split(","),
+                        default=list(SCENARIOS),
+                        help="Comma separated scenarios to run")
+    parser.add_argument("--sizes", type=lambda s: [int(n) for n in
+                                                   s.split(",")],
+                        default=[1, 10, 100, 1000],
+                        help="Comma separated numbers of deployments")
+    parser.add_argument("-c", "--concurrency", type=int, default=32)
+    parser.add_argument("--claims", type=int, default=1,
+                        help="PVCs per deployment")
+    parser.add_argument("--qps", type=float, default=0,
+                        help="K8S_QPS of the runner, 0 disables throttling")
+    parser.add_argument("--termination", type=float, default=0.5,
+                        help="Seconds until a deleted pod is gone")
+    parser.add_argument("--reconcile", type=float, default=0.1,
+                        help="Seconds until a new scale is acted on")
+    parser.add_argument("--job", type=float, default=0.5,
+                        help="Seconds until a backup job completes")
+    parser.add_argument("-o", "--output", default="bench-results.json",
+                        help="JSON file to write the results to")
+    parser.add_argument("--thresholds",
+                        default=os.path.join(BENCH_DIR, "thresholds.json"),
+                        help="JSON file with regression thresholds")
+    parser.add_argument("--workdir",
+                        help="Keep kubeconfigs, logs and metrics here")
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    timing = Timing(reconcile=args.reconcile, termination=args.termination,
+                    job=args.job)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="backup-bench-")
+    os.makedirs(workdir, exist_ok=True)
+
+    results = []
+    for scenario in args.scenarios:
+        for size in args.sizes:
+            result = run(scenario, size, timing, workdir, args.concurrency,
+                         args.claims, args.qps)
+            results.append(result)
+            print(f"{scenario:>13} {size:>5}: {result['wall_s']:8.2f}s "
+                  f"{result['requests_per_backup']:7.2f} req/backup "
+                  f"detect p95 "
+                  f"{(result['detect_termination_s'] or {}).get('p95')}s")
+
+    thresholds = dict()
+    if os.path.exists(args.thresholds):
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+    regressions = check(results, thresholds)
+    with open(args.output, "w") as f:
+        json.dump({"timing": timing.to_dict(), "concurrency":
+                   args.concurrency, "results": results,
+                   "regressions": regressions}, f, indent=2)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print(f"Results written to {args.output}, logs in {workdir}")
+    exit(1 if regressions else 0)
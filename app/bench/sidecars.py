@@ -0,0 +1,165 @@
+"""Benchmarks how fast sidecar manifests are generated.
+
+Measures manifests per second, and microseconds per manifest, of:
+
+  load_template  a copy of the backup Job template
+  backup_job     a complete backup Job, see new_backup_sidecar_job
+  sharded_jobs   the backup Jobs of a Deployment with many volumes, see
+                 new_backup_sidecar_jobs_with_volumes
+
+load_template is compared against parsing the template file on every call,
+as sidecar_deploy did before templates were cached, and its output is
+checked to equal the parsed file. Results are compared against the
+"sidecars" entry of the regression thresholds.
+"""
+import argparse
+import json
+import os
+import pkgutil
+import sys
+import time
+
+from typing import Callable, Dict
+
+import yaml
+
+from run import BENCH_DIR, SRC_DIR, check
+
+sys.path.insert(0, SRC_DIR)
+
+from sidecar_deploy import new_backup_sidecar_job, \
+    new_backup_sidecar_jobs_with_volumes  # noqa: E402
+from sidecar_deploy.template import load_template  # noqa: E402
+
+__author__ = "Noah Hummel"
+
+
+TEMPLATE = "backup-job"
+
+
+def parse_template() -> Dict:
+    """Parses the template like sidecar_deploy did before caching it."""
+    return yaml.safe_load(pkgutil.get_data("sidecar_deploy",
+                                           f"{TEMPLATE}.yml"))
+
+
+def new_deployment(volumes: int) -> Dict:
+    """Builds a snake_case Deployment with a PVC per volume."""
+    return {"spec": {"template": {"spec": {"volumes": [
+        {"name": f"data-{i}",
+         "persistent_volume_claim": {"claim_name": f"claim-{i}"}}
+        for i in range(volumes)]}}}}
+
+
+def time_manifests(generate: Callable[[], int], count: int) -> Dict:
+    """Calls generate until it returned count manifests.
+
+    Args:
+        generate: Generates manifests, returns how many.
+        count: Number of manifests to generate.
+
+    Returns:
+        Manifests per second and microseconds per manifest.
+    """
+    generated = 0
+    start = time.monotonic()
+    while generated < count:
+        generated += generate()
+    seconds = time.monotonic() - start
+    return {"per_s": round(generated / seconds),
+            "us": round(seconds / generated * 1e6, 2)}
+
+
+def run(size: int, volumes: int=32, shards: int=4) -> Dict:
+    """Generates size manifests of each kind.
+
+    Args:
+        size: Number of manifests to generate of each kind.
+        volumes: Volumes of the Deployment of sharded_jobs.
+        shards: Jobs the volumes of sharded_jobs are split across.
+
+    Returns:
+        The result of the run, exit_code is 1 if the template differs from
+        the parsed file.
+    """
+    paths = [f"/data-{i}" for i in range(4)]
+    deployment = new_deployment(volumes)
+    claim_sizes = {f"claim-{i}": (i + 1) * 2 ** 30 for i in range(volumes)}
+
+    def _load_template() -> int:
+        load_template(TEMPLATE)
+        return 1
+
+    def _parse_template() -> int:
+        parse_template()
+        return 1
+
+    def _backup_job() -> int:
+        new_backup_sidecar_job(paths, "store")
+        return 1
+
+    def _sharded_jobs() -> int:
+        return len(new_backup_sidecar_jobs_with_volumes(
+            deployment, "store", claim_sizes, shards))
+
+    timings = {
+        "load_template": time_manifests(_load_template, size),
+        "backup_job": time_manifests(_backup_job, size),
+        "sharded_jobs": time_manifests(_sharded_jobs, size),
+    }
+    # parsing is much slower, a fraction of the manifests is enough
+    reference = time_manifests(_parse_template, max(1, size // 10))
+
+    result = {
+        "scenario": "sidecars",
+        "deployments": size,
+        "exit_code": 0 if load_template(TEMPLATE) == parse_template()
+        else 1,
+        "reference": {"load_template_per_s": reference["per_s"],
+                      "load_template_us": reference["us"]},
+    }
+    for kind, timing in timings.items():
+        result[f"{kind}_per_s"] = timing["per_s"]
+        result[f"{kind}_us"] = timing["us"]
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=lambda s: [int(n) for n in
+                                                   s.split(",")],
+                        default=[10000], help="Comma separated numbers of "
+                                              "manifests")
+    parser.add_argument("-o", "--output", default="sidecars-results.json",
+                        help="JSON file to write the results to")
+    parser.add_argument("--thresholds",
+                        default=os.path.join(BENCH_DIR, "thresholds.json"),
+                        help="JSON file with regression thresholds")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        result = run(size)
+        results.append(result)
+        print(f"{size:6d}: load_template {result['load_template_per_s']}/s "
+              f"(parsing {result['reference']['load_template_per_s']}/s), "
+              f"backup_job {result['backup_job_per_s']}/s, "
+              f"sharded_jobs {result['sharded_jobs_per_s']}/s")
+        if result["exit_code"]:
+            print(f"MISMATCH load_template({TEMPLATE!r}) differs from the "
+                  f"parsed template")
+
+    thresholds = dict()
+    if os.path.exists(args.thresholds):
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+    regressions = check(results, thresholds)
+    with open(args.output, "w") as f:
+        json.dump({"results": results, "regressions": regressions}, f,
+                  indent=2)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print(f"Results written to {args.output}")
+    exit(1 if regressions else 0)
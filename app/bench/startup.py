@@ -0,0 +1,155 @@
+"""Benchmarks the startup time of main.py.
+
+Measures, as the median of several runs:
+
+  help_s           main.py --help, i.e. interpreter start and argument parsing
+  first_request_s  main.py backing up a single Deployment until its first
+                   request reaches a local fake Kubernetes API server
+
+The runner is killed after its first request, the backup itself is measured
+by run.py. The modules taking the longest to import are listed from the
+-X importtime profile of the last run. Results are compared against the
+"startup" entry of the regression thresholds.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Dict, List, Tuple
+
+from fakeapi import FakeApiServer, FakeCluster
+from run import BENCH_DIR, SRC_DIR, check
+
+__author__ = "Noah Hummel"
+
+
+_IMPORT_TIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+
+def import_profile(stderr: str, top: int=15) -> List[Tuple[str, float]]:
+    """Lists the top level imports taking the longest, cumulatively.
+
+    Args:
+        stderr: Output of python -X importtime.
+        top: Number of modules to list.
+
+    Returns:
+        (module, seconds) of the slowest imports, slowest first.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        # modules imported by other modules are part of their importer
+        if match and not match.group(3):
+            imports.append((match.group(4), int(match.group(2)) / 1e6))
+    return sorted(imports, key=lambda i: i[1], reverse=True)[:top]
+
+
+def time_help(python: List[str]) -> float:
+    start = time.monotonic()
+    subprocess.run(python + ["main.py", "--help"], cwd=SRC_DIR,
+                   stdout=subprocess.DEVNULL, check=True)
+    return time.monotonic() - start
+
+
+def time_first_request(python: List[str], workdir: str,
+                       timeout: float=30) -> Tuple[float, str]:
+    """Starts a backup and waits for its first API request.
+
+    Returns:
+        Seconds until the first request and the stderr of the runner.
+    """
+    cluster = FakeCluster()
+    cluster.add_deployment("bench-0", "app-0")
+    server = FakeApiServer(cluster).start()
+    kubeconfig = os.path.join(workdir, "startup.kubeconfig")
+    with open(kubeconfig, "w") as f:
+        json.dump(server.kubeconfig(), f)
+    stderr_file = os.path.join(workdir, "startup.log")
+    env = dict(os.environ, KUBECONFIG=kubeconfig)
+    try:
+        with open(stderr_file, "w") as stderr:
+            start = time.monotonic()
+            process = subprocess.Popen(
+                python + ["-X", "importtime", "main.py", "bench-0", "app-0",
+                          "store"],
+                cwd=SRC_DIR, env=env, stdout=subprocess.DEVNULL,
+                stderr=stderr)
+            requested = cluster.first_requested.wait(timeout)
+            process.kill()
+            process.wait()
+    finally:
+        server.stop()
+    with open(stderr_file) as f:
+        output = f.read()
+    if not requested:
+        raise RuntimeError(f"no request within {timeout}s, see {stderr_file}")
+    return cluster.first_request - start, output
+
+
+def run(workdir: str, repeat: int=5) -> Dict:
+    """Measures the startup time of main.py.
+
+    Args:
+        workdir: Directory for the kubeconfig and log of the runs.
+        repeat: Number of runs to take the median of.
+
+    Returns:
+        The results of the runs.
+    """
+    python = [sys.executable]
+    help_times = [time_help(python) for _ in range(repeat)]
+    first_request_times = []
+    output = ""
+    for _ in range(repeat):
+        seconds, output = time_first_request(python, workdir)
+        first_request_times.append(seconds)
+    return {
+        "scenario": "startup",
+        "deployments": 1,
+        "exit_code": 0,
+        "help_s": round(statistics.median(help_times), 4),
+        "first_request_s": round(statistics.median(first_request_times), 4),
+        "imports": [{"module": module, "s": round(seconds, 4)}
+                    for module, seconds in import_profile(output)],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--repeat", type=int, default=5,
+                        help="Runs to take the median of")
+    parser.add_argument("-o", "--output", default="startup-results.json",
+                        help="JSON file to write the results to")
+    parser.add_argument("--thresholds",
+                        default=os.path.join(BENCH_DIR, "thresholds.json"),
+                        help="JSON file with regression thresholds")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="backup-bench-")
+    result = run(workdir, args.repeat)
+    print(f"help: {result['help_s']:.3f}s, first request: "
+          f"{result['first_request_s']:.3f}s")
+    for entry in result["imports"]:
+        print(f"{entry['s']:8.3f}s {entry['module']}")
+
+    thresholds = dict()
+    if os.path.exists(args.thresholds):
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+    regressions = check([result], thresholds)
+    with open(args.output, "w") as f:
+        json.dump({"results": [result], "regressions": regressions}, f,
+                  indent=2)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print(f"Results written to {args.output}, logs in {workdir}")
+    exit(1 if regressions else 0)
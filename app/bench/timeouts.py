@@ -0,0 +1,146 @@
+"""Checks that API requests time out.
+
+The kubernetes client only applies a _request_timeout which is an int or a
+(connect, read) tuple and silently ignores anything else, e.g. a float. A
+request to an API server which accepts connections but never answers would
+then block its thread forever. This checks, against such a server:
+
+  request  a request without an explicit timeout is aborted after
+           K8S_REQUEST_TIMEOUT, see k8s.clients.Cluster
+  watch    a watch is aborted 5s after the time the API server should have
+           ended it, see k8s.watch.stream_events
+
+urllib3 retries a timed out GET up to 3 times, so a request may take up to
+4 times its timeout. Each check fails, and the run exits with status 1, if
+the request isn't aborted within a few seconds of that.
+"""
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+from typing import Callable, List
+
+from run import SRC_DIR
+
+sys.path.insert(0, SRC_DIR)
+
+from kubernetes import client  # noqa: E402
+from k8s.clients import Cluster  # noqa: E402
+from k8s.watch import stream_events  # noqa: E402
+
+__author__ = "Noah Hummel"
+
+
+# seconds a timed out request may take longer than its timeout
+SLACK = 3
+# the first attempt and the retries of urllib3's default Retry
+ATTEMPTS = 4
+
+
+class SilentServer:
+    """Accepts connections, reads requests and never answers them."""
+
+    def __init__(self):
+        self.socket = socket.socket()
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.listen(16)
+        self.connections: List[socket.socket] = []
+        self.port = self.socket.getsockname()[1]
+
+    def start(self) -> "SilentServer":
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self.socket.accept()
+            except OSError:
+                return
+            self.connections.append(connection)
+
+    def stop(self):
+        self.socket.close()
+        for connection in self.connections:
+            connection.close()
+
+
+def new_cluster(port: int, request_timeout: int) -> Cluster:
+    configuration = client.Configuration()
+    configuration.host = f"http://127.0.0.1:{port}"
+    return Cluster("silent", configuration, request_timeout=request_timeout)
+
+
+def time_out(call: Callable[[], object], timeout: float) -> str:
+    """Calls call, which is expected to time out after timeout seconds.
+
+    Each attempt of the call is expected to time out, see ATTEMPTS.
+
+    Returns:
+        A description of the failure, an empty string if it timed out.
+    """
+    outcome = []
+
+    def _call():
+        start = time.monotonic()
+        try:
+            call()
+            outcome.append(("returned", time.monotonic() - start))
+        except Exception as e:
+            outcome.append((repr(e), time.monotonic() - start))
+
+    thread = threading.Thread(target=_call, daemon=True)
+    thread.start()
+    deadline = timeout * ATTEMPTS + SLACK
+    thread.join(deadline)
+    if not outcome:
+        return f"still blocked after {deadline}s"
+    error, seconds = outcome[0]
+    if error == "returned":
+        return f"returned after {seconds:.1f}s instead of timing out"
+    if seconds < timeout - 0.5:
+        return f"failed after {seconds:.1f}s, before its timeout: {error}"
+    return ""
+
+
+def check_request(port: int, timeout: int) -> str:
+    api = new_cluster(port, timeout).api(client.CoreV1Api)
+    return time_out(lambda: api.list_namespaced_pod("default"), timeout)
+
+
+def check_watch(port: int, timeout: int) -> str:
+    # the request timeout must not apply to watches
+    api = new_cluster(port, 1).api(client.CoreV1Api)
+    return time_out(lambda: list(stream_events(
+        api.list_namespaced_pod, ("default",), dict(), "1", timeout)),
+        timeout + 5)
+
+
+CHECKS = {
+    "request": check_request,
+    "watch": check_watch,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--timeout", type=int, default=2,
+                        help="Timeout of the checked requests in seconds")
+    args = parser.parse_args()
+
+    server = SilentServer().start()
+    failures = 0
+    for name, run_check in CHECKS.items():
+        failure = run_check(server.port, args.timeout)
+        print(f"{name:8s}: {'FAILED ' + failure if failure else 'ok'}")
+        failures += bool(failure)
+    server.stop()
+    # failed checks leave threads blocked on the server, which would hold up
+    # or spoil the interpreter's shutdown
+    sys.stdout.flush()
+    os._exit(1 if failures else 0)
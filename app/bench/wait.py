@@ -0,0 +1,73 @@
+"""Scales Deployments down and up again using only the k8s wait helpers.
+
+Run by run.py against a fake API server. Writes when each wait returned,
+as time.monotonic(), which is comparable across processes on Linux, to a
+JSON file.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from k8s import clients, informer, wait_for_reconciliation  # noqa: E402
+from k8s.executor import run_blocking  # noqa: E402
+from k8s.predicate import deployment_has_scale  # noqa: E402
+from k8s.schedule import POD_TERMINATION_WAIT, SCALE_WAIT  # noqa: E402
+from mutations.scale import update_deployment_scale  # noqa: E402
+from views.deployment import get_deployment, list_deployments  # noqa: E402
+from views.pod import list_pods_for_deployment  # noqa: E402
+
+__author__ = "Noah Hummel"
+
+
+TIMEOUT = timedelta(minutes=5)
+
+
+async def _cycle(name: str, namespace: str, replicas: int) -> dict:
+    await run_blocking(update_deployment_scale, name, namespace, 0)
+    await wait_for_reconciliation(lambda xs: len(xs) == 0, TIMEOUT,
+                                  list_pods_for_deployment, name, namespace,
+                                  schedule=POD_TERMINATION_WAIT)
+    pods_gone = time.monotonic()
+    await run_blocking(update_deployment_scale, name, namespace, replicas)
+    await wait_for_reconciliation(deployment_has_scale(replicas), TIMEOUT,
+                                  get_deployment, name, namespace,
+                                  schedule=SCALE_WAIT)
+    return {"pods_gone": pods_gone, "scaled_up": time.monotonic()}
+
+
+async def _cycle_all(concurrency: int) -> dict:
+    slots = asyncio.Semaphore(concurrency)
+    deployments = list_deployments()
+
+    async def _bounded(deployment):
+        async with slots:
+            return await _cycle(deployment.metadata.name,
+                                deployment.metadata.namespace,
+                                deployment.spec.replicas)
+
+    detected = await asyncio.gather(*[_bounded(d) for d in deployments])
+    return {f"{d.metadata.namespace}/{d.metadata.name}": t
+            for d, t in zip(deployments, detected)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("output", help="JSON file to write the times to")
+    parser.add_argument("-c", "--concurrency", type=int, default=32)
+    parser.add_argument("--informers", action="store_true",
+                        help="Wait on informers instead of watches")
+    args = parser.parse_args()
+
+    clients.load(config_file=os.environ["KUBECONFIG"])
+    if args.informers:
+        informer.enable()
+    times = asyncio.run(_cycle_all(args.concurrency))
+    with open(args.output, "w") as f:
+        json.dump(times, f)
@@ -1,9 +1,8 @@
 import sentry_sdk
+import heapq
 import os
 from typing import Dict, Union, List
 
-from k8s.resource import to_camel_case
-
 __author__ = "Noah Hummel"
 
 
@@ -88,4 +87,30 @@ def new_volume_mounts_with_canonical_mount_path(
         return [{**vm, "subPath": sub_path_map[vm["name"]]}
                 if vm["name"] in sub_path_map else vm
                 for vm in volume_mounts]
-    return [to_camel_case(vm) for vm in volume_mounts]
+    return volume_mounts
+
+
+def shard_by_size(sizes: Dict[str, int], shards: int) -> List[List[str]]:
+    """Splits items into shards of about equal total size.
+
+    Items are assigned largest first to the shard with the smallest total
+    size so far, which keeps the largest shard within 4/3 of the optimum.
+    Fewer shards are returned if there are fewer items than shards.
+
+    Args:
+        sizes: Dict mapping items to their size.
+        shards: Maximum number of shards.
+
+    Returns:
+        List of shards, each a list of items, largest shard first.
+    """
+    shards = max(1, min(shards, len(sizes)))
+    totals = [(0, i) for i in range(shards)]
+    assigned: List[List[str]] = [[] for _ in range(shards)]
+    for item in sorted(sizes, key=lambda k: sizes[k], reverse=True):
+        total, i = heapq.heappop(totals)
+        assigned[i].append(item)
+        heapq.heappush(totals, (total + sizes[item], i))
+
+    by_size = sorted(totals, reverse=True)
+    return [assigned[i] for _, i in by_size if assigned[i]]
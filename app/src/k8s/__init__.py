@@ -1,11 +1,17 @@
 import asyncio
-import random
+import time
 
 from datetime import timedelta
 
 from typing import Callable, Tuple, List, Dict, Coroutine, Union
 
 import logger
+import metrics
+from k8s import informer
+from k8s.executor import run_blocking, watch_executor
+from k8s.schedule import PollSchedule, DEFAULT_WAIT
+from k8s.watch import get_watch_source, watch_until, WatchSource, \
+    WatchStop
 from mutations.exceptions import ReconciliationError
 
 __author__ = "Noah Hummel"
@@ -32,41 +38,145 @@ def check_resource(predicate: Predicate, fn: Callable, *args, **kwargs) -> bool:
     result = fn(*args, **kwargs)
     retval = predicate(result)
     try:
-        log.debug(f"Checking {result.kind} "
-                  f"{result.metadata.namespace}/{result.metadata.name}: "
-                  f"{predicate.__name__}? {retval}")
+        log.debug("Checking %s %s/%s: %s? %s", result.kind,
+                  result.metadata.namespace, result.metadata.name,
+                  predicate.__name__, retval)
     except AttributeError:  # debug print only works for k8s resources
         pass
     return retval
 
 
-def _poll_resource(predicate: Predicate, fn: Callable, *args, **kwargs) \
+def _poll_resource(predicate: Predicate, schedule: PollSchedule,
+                   deadline: float, fn: Callable, *args, **kwargs) \
         -> Coroutine:
-    """Polls fn in random intervals until fn's return satisfies a predicate.
+    """Polls fn according to a schedule until its return satisfies predicate.
 
     Args:
         predicate: Function Any -> bool
+        schedule: Delays between polls, the first poll is immediate.
+        deadline: Value of time.monotonic() at which to give up.
         fn: Any function.
         *args: Positional args for fn.
         **kwargs: Key word args for fn.
 
     Returns:
-        Coroutine which polls fn in random intervals and sleeps in between.
-        The Coroutine halts if predicate is satisfied by fn's return.
+        Coroutine which polls fn and sleeps in between. The Coroutine halts
+        if predicate is satisfied by fn's return and raises
+        ReconciliationError if it isn't satisfied before deadline.
     """
     async def _reconciled():
-        done = False
-        while not done:
-            done = check_resource(predicate, fn, *args, **kwargs)
-            await asyncio.sleep(random.uniform(3, 6))
+        for delay in schedule.delays(deadline):
+            await asyncio.sleep(delay)
+            if await run_blocking(check_resource, predicate, fn, *args,
+                                  **kwargs):
+                return
+            metrics.API_RETRIES.inc(phase=metrics.current_phase(),
+                                    reason="poll",
+                                    cluster=metrics.current_cluster())
+        raise ReconciliationError()
+    return _reconciled()
+
+
+def _watch_resource(predicate: Predicate, source: WatchSource,
+                    schedule: PollSchedule, deadline: float) -> Coroutine:
+    """Watches a WatchSource until its objects satisfy a predicate.
+
+    The blocking watch runs in the watch thread pool, so several watches can
+    be awaited concurrently. Cancelling the Coroutine shuts down the open
+    watch, which frees its thread right away.
+
+    Args:
+        predicate: Function Any -> bool
+        source: The objects to watch.
+        schedule: Delays between relists after failed watches.
+        deadline: Value of time.monotonic() at which to give up.
+
+    Returns:
+        Coroutine which halts once predicate is satisfied and raises
+        ReconciliationError if it isn't satisfied before deadline.
+    """
+    async def _reconciled():
+        stop = WatchStop()
+        try:
+            reconciled = await run_blocking(watch_until, predicate, source,
+                                            deadline, stop, schedule,
+                                            executor=watch_executor())
+        finally:
+            stop.set()
+        if not reconciled:
+            raise ReconciliationError()
+    return _reconciled()
+
+
+def _await_informers(predicate: Predicate, deadline: float, fn: Callable,
+                     *args, **kwargs) -> Coroutine:
+    """Re-checks fn's return against predicate whenever an informer changed.
+
+    Args:
+        predicate: Function Any -> bool
+        deadline: Value of time.monotonic() at which to give up.
+        fn: View function reading from informers.
+        *args: Positional args for fn.
+        **kwargs: Key word args for fn.
+
+    Returns:
+        Coroutine which halts once predicate is satisfied and raises
+        ReconciliationError if it isn't satisfied before deadline.
+    """
+    async def _reconciled():
+        loop = asyncio.get_event_loop()
+        changed = asyncio.Event()
+
+        def _on_change():
+            try:
+                loop.call_soon_threadsafe(changed.set)
+            except RuntimeError:  # event loop closed
+                pass
+
+        informer.add_listener(_on_change)
+        try:
+            while True:
+                changed.clear()
+                if await run_blocking(check_resource, predicate, fn, *args,
+                                      **kwargs):
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ReconciliationError()
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            informer.remove_listener(_on_change)
     return _reconciled()
 
 
+def _reconcile(predicate: Predicate, schedule: PollSchedule, deadline: float,
+               fn: Callable, *args, **kwargs) -> Coroutine:
+    """Returns a Coroutine waiting until fn's return satisfies predicate.
+
+    Functions marked as k8s.informer.cached are re-checked on every informer
+    update if informers are enabled, functions marked as k8s.watch.watchable
+    are watched and any other function is polled.
+    """
+    if informer.enabled() and getattr(fn, "cached", False):
+        return _await_informers(predicate, deadline, fn, *args, **kwargs)
+
+    source = get_watch_source(fn, *args, **kwargs)
+    if source is None:
+        return _poll_resource(predicate, schedule, deadline, fn, *args,
+                              **kwargs)
+    return _watch_resource(predicate, source, schedule, deadline)
+
+
 def wait_for_reconciliation_blocking(predicate: Predicate, timeout: timedelta,
-                                     fn: Callable, *args, **kwargs):
+                                     fn: Callable, *args,
+                                     schedule: PollSchedule=DEFAULT_WAIT,
+                                     **kwargs):
     """Wait until fn's return satisfies predicate or timeout is reached.
 
-    Fn is polled by executing it with *args and **kwargs in random intervals
+    Fn is polled by executing it with *args and **kwargs according to schedule
     and testing its return with predicate. Blocks until either the predicate is
     satisfied or the operation is cancelled by a timeout.
 
@@ -75,6 +185,7 @@ def wait_for_reconciliation_blocking(predicate: Predicate, timeout: timedelta,
         predicate: Function Any -> bool
         fn: Any function.
         *args: Positional args for fn.
+        schedule: Delays between polls of fn.
         **kwargs: Key word args for fn.
 
     Raises:
@@ -82,22 +193,27 @@ def wait_for_reconciliation_blocking(predicate: Predicate, timeout: timedelta,
             If the predicate was not satisfied within timeout.
     """
     asyncio.run(wait_for_reconciliation(predicate, timeout, fn, *args,
-                                        **kwargs))
+                                        schedule=schedule, **kwargs))
 
 
 async def wait_for_reconciliation(predicate: Callable, timeout: timedelta,
-                                  fn: Callable, *args, **kwargs):
+                                  fn: Callable, *args,
+                                  schedule: PollSchedule=DEFAULT_WAIT,
+                                  **kwargs):
     """Wait until fn's return satisfies predicate or timeout is reached.
 
-    Fn is polled by executing it with *args and **kwargs in random intervals
-    and testing its return with predicate. Waits until either the predicate is
-    satisfied or the operation is cancelled by a timeout.
+    If fn is marked as k8s.watch.watchable, the resources backing fn are
+    watched and predicate is tested on every change. Otherwise, fn is polled
+    by executing it with *args and **kwargs according to schedule and testing
+    its return with predicate. Waits until either the predicate is satisfied
+    or the operation is cancelled by a timeout.
 
     Args:
         timeout: Time to wait for predicate to be satisfied.
         predicate: Function Any -> bool
         fn: Any function.
         *args: Positional args for fn.
+        schedule: Delays between polls of fn.
         **kwargs: Key word args for fn.
 
     Raises:
@@ -105,12 +221,15 @@ async def wait_for_reconciliation(predicate: Callable, timeout: timedelta,
             If the predicate was not satisfied within timeout.
     """
     try:
-        log.debug(f"Waiting for cluster state to reconcile "
-                  f"({timeout.seconds}s)...")
-        await asyncio.wait_for(_poll_resource(predicate, fn, *args, **kwargs),
-                               timeout=timeout.seconds)
+        log.debug("Waiting for cluster state to reconcile (%ds)...",
+                  timeout.seconds)
+        deadline = time.monotonic() + timeout.total_seconds()
+        await asyncio.wait_for(_reconcile(predicate, schedule, deadline, fn,
+                                          *args, **kwargs),
+                               timeout=timeout.total_seconds())
     except asyncio.TimeoutError:
-        log.debug(f"Cluster state not reconciled after {timeout.seconds}s.")
+        log.debug("Cluster state not reconciled after %ds.",
+                  timeout.seconds)
         raise ReconciliationError()
 
 
@@ -121,21 +240,26 @@ def wait_for_total_reconciliation_blocking(timeout: timedelta,
                                                Tuple[Predicate, Callable, Dict],
                                                Tuple[Predicate, Callable, List,
                                                      Dict]
-                                           ]):
+                                           ],
+                                           schedule: PollSchedule=
+                                           DEFAULT_WAIT):
     """Waits until multiple fns satisfy some predicates.
 
     Takes a list of parameters for wait_for_reconciliation as Tuples and waits
-    until wither all of them reconcile or a timeout is reached.
+    until wither all of them reconcile or a timeout is reached. Once one of
+    them fails, the others are cancelled.
 
     Args:
         timeout: Time to wait for predicate to be satisfied.
         *args: List of parameters for wait_for_reconciliation as Tuples.
+        schedule: Delays between polls.
 
     Raises:
         ReconciliationError:
             If the predicates were not satisfied within timeout.
     """
-    asyncio.run(wait_for_total_reconciliation(timeout, *args))
+    asyncio.run(wait_for_total_reconciliation(timeout, *args,
+                                              schedule=schedule))
 
 
 async def wait_for_total_reconciliation(timeout: timedelta,
@@ -145,20 +269,24 @@ async def wait_for_total_reconciliation(timeout: timedelta,
                                             Tuple[Predicate, Callable, Dict],
                                             Tuple[Predicate, Callable, List,
                                                   Dict]
-                                        ]):
+                                        ],
+                                        schedule: PollSchedule=DEFAULT_WAIT):
     """Waits until multiple fns satisfy some predicates.
 
     Takes a list of parameters for wait_for_reconciliation as Tuples and waits
-    until wither all of them reconcile or a timeout is reached.
+    until wither all of them reconcile or a timeout is reached. Once one of
+    them fails, the others are cancelled.
 
     Args:
         timeout: Time to wait for predicate to be satisfied.
         *args: List of parameters for wait_for_reconciliation as Tuples.
+        schedule: Delays between polls.
 
     Raises:
         ReconciliationError:
             If the predicates were not satisfied within timeout.
     """
+    deadline = time.monotonic() + timeout.total_seconds()
     tasks = []
     for poll_args in args:
         poll_args = list(poll_args)  # tuples are immutable
@@ -171,11 +299,23 @@ async def wait_for_total_reconciliation(timeout: timedelta,
             elif type(poll_args[2]) is list:
                 list_arg = poll_args[2]
 
-        tasks.append(_poll_resource(poll_args[0], poll_args[1], *list_arg,
-                                    **kw_arg))
+        tasks.append(_reconcile(poll_args[0], schedule, deadline,
+                                poll_args[1], *list_arg, **kw_arg))
 
-    poll_all = asyncio.gather(*tasks)
+    if not tasks:
+        return
+    tasks = [asyncio.ensure_future(task) for task in tasks]
     try:
-        await asyncio.wait_for(poll_all, timeout=timeout.seconds)
-    except TimeoutError:
+        done, pending = await asyncio.wait(
+            tasks, timeout=timeout.total_seconds(),
+            return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        # the remaining waits would keep polling or holding watch threads
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    for task in done:
+        if task.exception() is not None:
+            raise task.exception()
+    if pending:
         raise ReconciliationError
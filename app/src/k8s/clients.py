@@ -0,0 +1,235 @@
+import contextlib
+import contextvars
+import os
+import socket
+import threading
+
+from typing import Dict, Optional, Tuple, Type, TypeVar
+
+from kubernetes import client, config
+from urllib3.connection import HTTPConnection
+
+import logger
+import metrics
+from k8s.schedule import TokenBucket
+
+__author__ = "Noah Hummel"
+log = logger.get(__name__)
+
+
+DEFAULT_CLUSTER = "default"
+
+# maximum number of connections kept open per cluster
+POOL_MAXSIZE = int(os.environ.get("K8S_POOL_MAXSIZE", 32))
+# seconds before a request without an explicit timeout is aborted, the
+# client ignores timeouts which are neither an int nor a (connect, read) tuple
+REQUEST_TIMEOUT = int(os.environ.get("K8S_REQUEST_TIMEOUT", 30))
+# seconds a connection is idle before TCP keep-alive probes are sent
+KEEPALIVE_IDLE = int(os.environ.get("K8S_KEEPALIVE_IDLE", 60))
+# sustained API requests per second, 0 disables the limit
+QPS = float(os.environ.get("K8S_QPS", 20))
+# API requests which may be sent at once before QPS applies
+BURST = int(os.environ.get("K8S_BURST", 40))
+
+Api = TypeVar("Api")
+
+_current: contextvars.ContextVar = contextvars.ContextVar(
+    "cluster", default=DEFAULT_CLUSTER)
+
+
+def _keepalive_options(idle: int) -> list:
+    options = HTTPConnection.default_socket_options + [
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    ]
+    if hasattr(socket, "TCP_KEEPIDLE"):  # not available on macOS
+        options += [
+            (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle),
+            (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, idle // 4)),
+            (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 4),
+        ]
+    return options
+
+
+class Cluster:
+    """API objects for one cluster sharing one pooled ApiClient.
+
+    All API objects of a cluster reuse the connections of a single urllib3
+    pool, which keeps up to pool_maxsize connections alive, so concurrent
+    requests don't repeat TLS handshakes. Requests which don't specify a
+    _request_timeout are aborted after request_timeout seconds. All requests,
+    from pollers, watches and mutations alike, pass through one token bucket
+    limiting them to qps requests per second with bursts of up to burst.
+
+    Args:
+        name: Name to refer to the cluster by.
+        configuration: Client configuration, e.g. from a kubeconfig context.
+        pool_maxsize: Maximum number of connections kept open.
+        request_timeout: Default timeout of each request in seconds.
+        keepalive_idle: Seconds before idle connections are probed.
+        qps: Sustained requests per second, 0 disables the limit.
+        burst: Requests which may be sent at once.
+    """
+
+    def __init__(self, name: str, configuration: client.Configuration,
+                 pool_maxsize: int=POOL_MAXSIZE,
+                 request_timeout: int=REQUEST_TIMEOUT,
+                 keepalive_idle: int=KEEPALIVE_IDLE,
+                 qps: float=QPS, burst: int=BURST):
+        self.name = name
+        self.request_timeout = request_timeout
+        self.rate_limiter = TokenBucket(qps, burst)
+        configuration.connection_pool_maxsize = pool_maxsize
+        self.api_client = client.ApiClient(configuration)
+        self._apis: Dict[type, object] = dict()
+        self._lock = threading.Lock()
+
+        rest_client = self.api_client.rest_client
+        rest_client.pool_manager.connection_pool_kw["socket_options"] = \
+            _keepalive_options(keepalive_idle)
+        request = rest_client.request
+
+        def _request(*args, _request_timeout=None, **kwargs):
+            if _request_timeout is None:
+                _request_timeout = self.request_timeout
+            self.rate_limiter.acquire()
+            metrics.API_REQUESTS.inc(phase=metrics.current_phase(),
+                                     cluster=self.name)
+            return request(*args, _request_timeout=_request_timeout,
+                           **kwargs)
+        rest_client.request = _request
+
+    def __repr__(self):
+        return f"Cluster({self.name})"
+
+    def api(self, api_cls: Type[Api]) -> Api:
+        """Returns the shared instance of an API class, e.g. CoreV1Api."""
+        with self._lock:
+            if api_cls not in self._apis:
+                self._apis[api_cls] = api_cls(self.api_client)
+            return self._apis[api_cls]
+
+    def stats(self) -> Dict[str, int]:
+        """Counts connections opened and requests sent by this cluster.
+
+        Every opened connection costs a TCP and TLS handshake, so under load
+        "connections" should stay flat while "requests" grows.
+        """
+        pools = self.api_client.rest_client.pool_manager.pools
+        connections = requests = 0
+        with pools.lock:
+            for pool in list(pools._container.values()):
+                connections += pool.num_connections
+                requests += pool.num_requests
+        return {"connections": connections, "requests": requests}
+
+
+_clusters: Dict[str, Cluster] = dict()
+_clusters_lock = threading.Lock()
+
+
+def load(name: str=DEFAULT_CLUSTER, config_file: str=None,
+         context: str=None, in_cluster: bool=False, **settings) -> Cluster:
+    """Loads a cluster's configuration and registers its clients.
+
+    Args:
+        name: Name to refer to the cluster by.
+        config_file: Path of a kubeconfig file.
+        context: Context of the kubeconfig, defaults to its current context.
+        in_cluster: Use the ServiceAccount the runner is running as instead.
+        **settings: Keyword args for Cluster, e.g. pool_maxsize.
+
+    Returns:
+        The registered cluster.
+    """
+    if in_cluster:
+        config.load_incluster_config()
+        configuration = client.Configuration()
+    else:
+        configuration = client.Configuration()
+        config.load_kube_config(config_file, context,
+                                client_configuration=configuration)
+
+    cluster = Cluster(name, configuration, **settings)
+    with _clusters_lock:
+        _clusters[name] = cluster
+    return cluster
+
+
+def parse_cluster_spec(text: str) -> Tuple[str, Optional[str], Optional[str]]:
+    """Parses "CONTEXT" or "NAME=KUBECONFIG".
+
+    A context is looked up in the default kubeconfig and names the cluster,
+    a kubeconfig file is loaded with its current context.
+
+    Returns:
+        The name, kubeconfig file and context of the cluster, None for the
+        default kubeconfig and its current context respectively.
+    """
+    name, separator, config_file = text.partition("=")
+    if separator:
+        return name, config_file, None
+    return text, None, text
+
+
+def current() -> str:
+    """Returns the name of the cluster the caller runs against, see use."""
+    return _current.get()
+
+
+@contextlib.contextmanager
+def use(name: str):
+    """Sends all API requests made within to a registered cluster.
+
+    Like metrics phases, the cluster is inherited by run_blocking, so views
+    and mutations called within use its clients, thread pools and
+    informers. Metrics and log records are labeled with its name.
+
+    Raises:
+        KeyError: If the cluster wasn't loaded.
+    """
+    get(name)
+    token = _current.set(name)
+    try:
+        with metrics.cluster(name), logger.context(cluster=name):
+            yield
+    finally:
+        _current.reset(token)
+
+
+def get(name: str=None) -> Cluster:
+    """Returns a registered cluster, by default the current one.
+
+    If the default cluster wasn't loaded, it is registered with the global
+    kubernetes client configuration.
+    """
+    if name is None:
+        name = _current.get()
+    with _clusters_lock:
+        if name not in _clusters:
+            if name != DEFAULT_CLUSTER:
+                raise KeyError(f"Cluster {name} was not loaded.")
+            _clusters[name] = Cluster(name, client.Configuration())
+        return _clusters[name]
+
+
+def apps(cluster: str=None) -> client.AppsV1Api:
+    return get(cluster).api(client.AppsV1Api)
+
+
+def core(cluster: str=None) -> client.CoreV1Api:
+    return get(cluster).api(client.CoreV1Api)
+
+
+def batch(cluster: str=None) -> client.BatchV1Api:
+    return get(cluster).api(client.BatchV1Api)
+
+
+def custom(cluster: str=None) -> client.CustomObjectsApi:
+    return get(cluster).api(client.CustomObjectsApi)
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    """Connection reuse stats of all registered clusters, see Cluster.stats."""
+    with _clusters_lock:
+        clusters = list(_clusters.values())
+    return {cluster.name: cluster.stats() for cluster in clusters}
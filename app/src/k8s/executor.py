@@ -0,0 +1,69 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Any
+
+from k8s import clients
+
+__author__ = "Noah Hummel"
+
+
+# threads running blocking API requests, per cluster
+REQUEST_THREADS = int(os.environ.get("K8S_REQUEST_THREADS", 16))
+# threads holding open watches per cluster, each watch occupies a thread
+# until it ends
+WATCH_THREADS = int(os.environ.get("K8S_WATCH_THREADS", 64))
+
+_executors = dict()
+_executors_lock = threading.Lock()
+
+
+def _executor(name: str, max_workers: int) -> ThreadPoolExecutor:
+    # every cluster gets its own threads, so requests to a slow cluster
+    # can't occupy all of them
+    key = (clients.current(), name)
+    with _executors_lock:
+        if key not in _executors:
+            _executors[key] = ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix=f"k8s-{key[0]}-{name}")
+        return _executors[key]
+
+
+def request_executor() -> ThreadPoolExecutor:
+    """Thread pool for API requests to the current cluster."""
+    return _executor("request", REQUEST_THREADS)
+
+
+def watch_executor() -> ThreadPoolExecutor:
+    """Thread pool for watches of the current cluster."""
+    return _executor("watch", WATCH_THREADS)
+
+
+async def run_blocking(fn: Callable, *args,
+                       executor: ThreadPoolExecutor=None, **kwargs) -> Any:
+    """Runs a blocking function, e.g. an API request, off the event loop.
+
+    The function runs in a bounded thread pool, so awaiting several calls
+    concurrently overlaps their network I/O instead of blocking the event
+    loop for each round trip. Context variables of the caller are visible
+    to the function.
+
+    Args:
+        fn: Blocking function.
+        *args: Positional args for fn.
+        executor: Thread pool to run fn in, defaults to request_executor().
+        **kwargs: Keyword args for fn.
+
+    Returns:
+        The return of fn.
+    """
+    loop = asyncio.get_event_loop()
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, fn, *args, **kwargs)
+    return await loop.run_in_executor(
+        executor if executor else request_executor(), call)
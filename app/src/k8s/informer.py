@@ -0,0 +1,323 @@
+import threading
+import time
+
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Set, Tuple, Any
+
+import sentry_sdk
+
+import logger
+from k8s import clients
+from k8s.resource.volumeAttachment import GROUP, VERSION, PLURAL, \
+    get_persistent_volume_name
+from k8s.watch import stream_events, WatchExpired
+
+__author__ = "Noah Hummel"
+log = logger.get(__name__)
+
+
+# seconds after which the API server ends a watch and the informer resumes it
+WATCH_TIMEOUT = 300
+# seconds to wait for the initial list before views fall back to the API
+SYNC_TIMEOUT = 30
+# seconds to wait before relisting after a failed list or watch
+RETRY_INTERVAL = 5
+
+Indexer = Callable[[Any], List[str]]
+
+
+def index_labels(obj) -> List[str]:
+    """Indexes objects by each of their labels as "key=value"."""
+    labels = obj.metadata.labels or {}
+    return [f"{k}={v}" for k, v in labels.items()]
+
+
+def _claim_names(volumes) -> List[str]:
+    return [v.persistent_volume_claim.claim_name for v in volumes or []
+            if v.persistent_volume_claim is not None]
+
+
+def index_pod_claims(pod) -> List[str]:
+    """Indexes Pods by the names of the PVCs they mount."""
+    return _claim_names(pod.spec.volumes)
+
+
+def index_deployment_claims(deployment) -> List[str]:
+    """Indexes Deployments by the names of the PVCs their Pods mount."""
+    return _claim_names(deployment.spec.template.spec.volumes)
+
+
+def index_attachment_volumes(attachment: Dict) -> List[str]:
+    """Indexes VolumeAttachments by the name of their PersistentVolume."""
+    name = get_persistent_volume_name(attachment)
+    return [name] if name else []
+
+
+# custom objects, e.g. VolumeAttachments, are Dicts instead of models
+
+def _name(obj) -> str:
+    if isinstance(obj, dict):
+        return obj["metadata"]["name"]
+    return obj.metadata.name
+
+
+def _resource_version(obj) -> str:
+    if isinstance(obj, dict):
+        return obj["metadata"]["resourceVersion"]
+    return obj.metadata.resource_version
+
+
+def _items(result) -> List[Any]:
+    return result["items"] if isinstance(result, dict) else result.items
+
+
+class Informer:
+    """Local cache of all objects of one kind in a namespace or cluster.
+
+    The cache is filled by a single list and kept up to date by a watch
+    running in a background thread, which resumes from the last seen
+    resourceVersion and relists when the watch expires. Objects are indexed
+    by name and by every indexer given.
+
+    Args:
+        list_fn: Kubernetes API list function.
+        namespace:
+            Namespace to cache objects of, None for cluster scoped
+            resources, whose list_fn takes no namespace.
+        indexers: Functions mapping an object to its keys in each index.
+        on_change: Called without arguments whenever the cache changed.
+    """
+
+    def __init__(self, list_fn: Callable, namespace: Optional[str],
+                 indexers: Dict[str, Indexer]=None,
+                 on_change: Callable[[], None]=None):
+        self.list_fn = list_fn
+        self.namespace = namespace
+        self.indexers = indexers if indexers else dict()
+        self.on_change = on_change
+        self._lock = threading.RLock()
+        self._objects: Dict[str, Any] = dict()
+        self._indices: Dict[str, Dict[str, Set[str]]] = {
+            index: defaultdict(set) for index in self.indexers
+        }
+        self._synced = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, daemon=True,
+            name=f"informer-{list_fn.__name__}-{namespace}")
+
+    def __repr__(self):
+        return f"Informer({self.list_fn.__name__}, {self.namespace})"
+
+    def start(self):
+        self._thread.start()
+
+    def wait_for_sync(self, timeout: float) -> bool:
+        return self._synced.wait(timeout)
+
+    def get(self, name: str) -> Optional[Any]:
+        with self._lock:
+            return self._objects.get(name)
+
+    def list(self) -> List[Any]:
+        with self._lock:
+            return list(self._objects.values())
+
+    def by_index(self, index: str, *keys: str) -> List[Any]:
+        """Returns the objects which have all of the keys in an index.
+
+        Args:
+            index: Name of the indexer.
+            *keys: Keys the objects must have, e.g. "app=web" for labels.
+
+        Returns:
+            Matching objects, ordered by name.
+        """
+        with self._lock:
+            names = None
+            for key in keys:
+                matches = self._indices[index].get(key, set())
+                names = set(matches) if names is None else names & matches
+            if names is None:
+                names = self._objects.keys()
+            return [self._objects[name] for name in sorted(names)]
+
+    def _unindex(self, name: str):
+        obj = self._objects.pop(name, None)
+        if obj is None:
+            return
+        for index, indexer in self.indexers.items():
+            for key in indexer(obj):
+                self._indices[index][key].discard(name)
+                if not self._indices[index][key]:
+                    del self._indices[index][key]
+
+    def _index(self, obj):
+        name = _name(obj)
+        self._unindex(name)
+        self._objects[name] = obj
+        for index, indexer in self.indexers.items():
+            for key in indexer(obj):
+                self._indices[index][key].add(name)
+
+    def _replace(self, objects: List[Any]):
+        with self._lock:
+            for name in list(self._objects):
+                self._unindex(name)
+            for obj in objects:
+                self._index(obj)
+        self._changed()
+
+    def _update(self, event_type: str, obj):
+        with self._lock:
+            if event_type == "DELETED":
+                self._unindex(_name(obj))
+            else:
+                self._index(obj)
+        self._changed()
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
+
+    def _run(self):
+        args = () if self.namespace is None else (self.namespace,)
+        resource_version = None
+        while True:
+            try:
+                if resource_version is None:
+                    result = self.list_fn(*args)
+                    resource_version = _resource_version(result)
+                    self._replace(_items(result))
+                    self._synced.set()
+
+                for event_type, obj in stream_events(
+                        self.list_fn, args, dict(),
+                        resource_version, WATCH_TIMEOUT):
+                    resource_version = _resource_version(obj)
+                    self._update(event_type, obj)
+            except WatchExpired:
+                log.debug("Watch of %s expired, relisting.", self)
+                resource_version = None
+            except Exception as e:
+                sentry_sdk.capture_exception(e)
+                log.warning(f"{self} failed, relisting in "
+                            f"{RETRY_INTERVAL}s: {e!r}")
+                resource_version = None
+                time.sleep(RETRY_INTERVAL)
+
+
+_enabled = False
+_informers: Dict[Tuple[str, str, str], Informer] = dict()
+_informers_lock = threading.Lock()
+_listeners: Set[Callable[[], None]] = set()
+_listeners_lock = threading.Lock()
+
+
+def _notify():
+    with _listeners_lock:
+        listeners = list(_listeners)
+    for listener in listeners:
+        listener()
+
+
+def add_listener(listener: Callable[[], None]):
+    """Calls listener from informer threads whenever any informer changed."""
+    with _listeners_lock:
+        _listeners.add(listener)
+
+
+def remove_listener(listener: Callable[[], None]):
+    with _listeners_lock:
+        _listeners.discard(listener)
+
+
+def _kinds(cluster: str) -> Dict[str, Tuple[Callable, Dict[str, Indexer]]]:
+    apps = clients.apps(cluster)
+    core = clients.core(cluster)
+    custom = clients.custom(cluster)
+
+    def list_volume_attachment(resource_version: str=None,
+                               timeout_seconds: int=None, watch: bool=None,
+                               **kwargs) -> Dict:
+        # the pinned client's list_cluster_custom_object doesn't take
+        # timeout_seconds, the API server would never end the watch
+        query = [(key, value) for key, value in (
+            ("resourceVersion", resource_version),
+            ("timeoutSeconds", timeout_seconds),
+            ("watch", watch)) if value is not None]
+        return custom.api_client.call_api(
+            f"/apis/{GROUP}/{VERSION}/{PLURAL}", "GET", query_params=query,
+            header_params={"Accept": "application/json"},
+            response_type="object", auth_settings=["BearerToken"],
+            _return_http_data_only=True, **kwargs)
+
+    return {
+        "deployment": (apps.list_namespaced_deployment, {
+            "label": index_labels,
+            "claim": index_deployment_claims,
+        }),
+        "pod": (core.list_namespaced_pod, {
+            "label": index_labels,
+            "claim": index_pod_claims,
+        }),
+        "persistentvolumeclaim": (core.list_namespaced_persistent_volume_claim,
+                                  {"label": index_labels}),
+        "volumeattachment": (list_volume_attachment, {
+            "volume": index_attachment_volumes,
+        }),
+    }
+
+
+def enable():
+    """Makes views read from informers instead of the API server."""
+    global _enabled
+    _enabled = True
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def get(kind: str, namespace: Optional[str]) -> Optional[Informer]:
+    """Returns the synced informer for a kind of resource in a namespace.
+
+    Informers are started on first use and shared by all callers running
+    against the same cluster, see clients.use.
+
+    Args:
+        kind:
+            One of "deployment", "pod", "persistentvolumeclaim" and the
+            cluster scoped "volumeattachment".
+        namespace: Namespace of the resources, None if cluster scoped.
+
+    Returns:
+        The informer, or None if informers are disabled or the informer
+        did not sync within SYNC_TIMEOUT, in which case callers should
+        fall back to reading from the API server.
+    """
+    if not _enabled:
+        return None
+
+    key = (clients.current(), kind, namespace)
+    with _informers_lock:
+        informer = _informers.get(key)
+        if informer is None:
+            list_fn, indexers = _kinds(key[0])[kind]
+            informer = Informer(list_fn, namespace, indexers, _notify)
+            informer.start()
+            _informers[key] = informer
+
+    if not informer.wait_for_sync(SYNC_TIMEOUT):
+        log.warning(f"{informer} did not sync within {SYNC_TIMEOUT}s.")
+        return None
+    return informer
+
+
+def cached(fn: Callable) -> Callable:
+    """Marks a view function as reading from informers when enabled.
+
+    Reconciliation waits on such functions are driven by informer updates
+    instead of watching or polling the API server themselves.
+    """
+    fn.cached = True
+    return fn
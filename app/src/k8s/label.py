@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Dict, List
 
 import logger
 
@@ -6,9 +6,12 @@ __author__ = "Noah Hummel"
 log = logger.get(__name__)
 
 
-def label_selector(*labels: Dict[str, str]) -> str:
-    selectors = []
+def label_keys(*labels: Dict[str, str]) -> List[str]:
+    keys = []
     for label in labels:
-        key = next(label.keys().__iter__())
-        selectors.append(f"{key}={label[key]}")
-    return ",".join(selectors)
+        keys.extend(f"{key}={value}" for key, value in label.items())
+    return keys
+
+
+def label_selector(*labels: Dict[str, str]) -> str:
+    return ",".join(label_keys(*labels))
@@ -1,7 +1,8 @@
-from kubernetes.client import V1Deployment, V1PersistentVolumeClaim
-from typing import Callable
+from kubernetes.client import V1Deployment, V1PersistentVolumeClaim, V1Job
+from typing import Callable, Dict, List
 
 import logger
+from k8s.resource.volumeSnapshot import get_error
 
 __author__ = "Noah Hummel"
 log = logger.get(__name__)
@@ -18,5 +19,49 @@ def deployment_has_scale(replicas: int) -> Callable:
     return _deployment_has_scale
 
 
+def deployment_is_available(deployment: V1Deployment) -> bool:
+    """Whether all desired replicas of a Deployment are available."""
+    return deployment is not None and \
+        (deployment.status.available_replicas or 0) >= \
+        (deployment.spec.replicas or 0)
+
+
 def pvc_is_unbound(pvc: V1PersistentVolumeClaim) -> bool:
     return pvc.status.phase == "Unbound"
+
+
+def _job_condition(job: V1Job, condition_type: str) -> bool:
+    conditions = job.status.conditions if job and job.status else None
+    return any(c.type == condition_type and c.status == "True"
+               for c in conditions or [])
+
+
+def job_has_succeeded(job: V1Job) -> bool:
+    return _job_condition(job, "Complete")
+
+
+def job_has_failed(job: V1Job) -> bool:
+    return _job_condition(job, "Failed")
+
+
+def job_is_finished(job: V1Job) -> bool:
+    return job_has_succeeded(job) or job_has_failed(job)
+
+
+def volume_snapshot_is_ready(snapshot: Dict) -> bool:
+    status = snapshot.get("status") if snapshot else None
+    return bool(status and status.get("readyToUse"))
+
+
+def volume_snapshot_has_failed(snapshot: Dict) -> bool:
+    return get_error(snapshot) is not None
+
+
+def volume_snapshot_is_settled(snapshot: Dict) -> bool:
+    return volume_snapshot_is_ready(snapshot) or \
+        volume_snapshot_has_failed(snapshot)
+
+
+def volumes_are_detached(attachments: List[Dict]) -> bool:
+    return attachments is not None and not any(
+        (a.get("status") or dict()).get("attached") for a in attachments)
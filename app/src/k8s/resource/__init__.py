@@ -1,5 +1,5 @@
-from enum import IntEnum, auto
-from typing import Dict, Union, List
+from functools import lru_cache
+from typing import Callable, Dict, Union, List
 
 import logger
 
@@ -7,100 +7,165 @@ __author__ = "Noah Hummel"
 log = logger.get(__name__)
 
 
-def strip_null(resource: Union[Dict, List]) -> Union[Dict, List]:
-    if type(resource) is dict:
-        retval = dict()
-        for k, v in resource.items():
-            if type(v) is dict:
-                retval[k] = strip_null(v)
-            elif v is not None:
-                retval[k] = v
-        return retval
-    elif type(resource) is list:
-        return [strip_null(x) for x in resource]
-    else:
-        return resource
+# number of distinct keys whose converted case is remembered, k8s resources
+# only use a few hundred distinct keys
+KEY_CACHE_SIZE = 4096
 
 
+@lru_cache(maxsize=KEY_CACHE_SIZE)
 def snake_case(identifier: str) -> str:
-    class State(IntEnum):
-        Init = auto()
-        Upper = auto()
-        Lower = auto()
-
-    retval = ""
-    state = State.Init
-    next_state = State.Init
+    chars = []
+    previous_lower = False
     for char in identifier:
-        # state transition
-        if not char.isalpha():
-            next_state = State.Lower
-        elif char.isupper():
-            next_state = State.Upper
-        else:
-            next_state = State.Lower
+        upper = char.isalpha() and char.isupper()
+        if previous_lower and upper:
+            chars.append("_")
+        chars.append(char.lower())
+        previous_lower = not upper
+    return "".join(chars)
+
 
-        # output
-        if state == State.Lower and next_state == State.Upper:
-            retval += f"_{char.lower()}"
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def camel_case(identifier: str) -> str:
+    chars = []
+    after_separator = False
+    for char in identifier:
+        if char == "_":
+            after_separator = True
+            continue
+        if after_separator and char.isalpha():
+            chars.append(char.upper())
         else:
-            retval += char.lower()
+            chars.append(char)
+        after_separator = False
+    return "".join(chars)
 
-        state = next_state
 
-    return retval
+def _convert_keys(resource: Union[Dict, List],
+                  convert: Callable[[str], str]) -> Union[Dict, List]:
+    """Copies nested dicts and lists, converting every dict key.
 
+    The resource is traversed iteratively, so arbitrarily deep resources
+    don't hit the recursion limit. Values other than dicts and lists are
+    shared with the original resource.
+    """
+    if type(resource) is dict:
+        root = dict()
+    elif type(resource) is list:
+        root = []
+    else:
+        return resource
 
-def camel_case(identifier: str) -> str:
-    retval = ""
+    stack = [(resource, root)]
+    while stack:
+        original, copy = stack.pop()
+        if type(original) is dict:
+            for k, v in original.items():
+                if type(v) is dict:
+                    copy[convert(k)] = child = dict()
+                    stack.append((v, child))
+                elif type(v) is list:
+                    copy[convert(k)] = child = []
+                    stack.append((v, child))
+                else:
+                    copy[convert(k)] = v
+        else:
+            for v in original:
+                if type(v) is dict:
+                    child = dict()
+                    stack.append((v, child))
+                elif type(v) is list:
+                    child = []
+                    stack.append((v, child))
+                else:
+                    child = v
+                copy.append(child)
+    return root
 
-    class State(IntEnum):
-        Init = auto()
-        Word = auto()
-        Separator = auto()
 
-    state = State.Init
-    next_state = State.Init
-    for char in identifier:
-        if char == "_":
-            next_state = State.Separator
-        else:
-            next_state = State.Word
+def _keep(key: str) -> str:
+    return key
 
-        # output
-        if state == State.Separator and next_state == State.Word:
-            retval += char.upper() if char.isalpha() else char
-        elif next_state != State.Separator:
-            retval += char
 
-        state = next_state
+def copy_resource(resource: Union[Dict, List]) -> Union[Dict, List]:
+    """Copies nested dicts and lists, sharing all other values.
 
-    return retval
+    Much cheaper than copy.deepcopy for parsed YAML or JSON, whose scalar
+    values are immutable anyway.
+    """
+    return _convert_keys(resource, _keep)
 
 
 def to_snake_case(resource: Union[Dict, List]) -> Union[Dict, List]:
-    if type(resource) is dict:
-        retval = dict()
-        for k, v in resource.items():
-            new_k = snake_case(k)
-            new_v = to_snake_case(v)
-            retval[new_k] = new_v
-        return retval
-    elif type(resource) is list:
-        return [to_snake_case(x) for x in resource]
-    else:
-        return resource
+    return _convert_keys(resource, snake_case)
 
 
-def to_camel_case(resource: Union[Dict, List]) -> Union[Dict, List]:
-    if type(resource) is dict:
-        retval = dict()
-        for k, v in resource.items():
-            new_k = camel_case(k)
-            new_v = to_camel_case(v)
-            retval[new_k] = new_v
-        return retval
-    elif type(resource) is list:
-        return [to_camel_case(x) for x in resource]
-    else:
-        return resource
\ No newline at end of file
+def normalize(resource: Union[Dict, List],
+              convert: Callable[[str], str]=None) -> Union[Dict, List]:
+    """Strips None values and converts keys in a single traversal.
+
+    Dict entries whose value is None are removed at any depth, including in
+    dicts nested in lists, and every dict key is passed through convert.
+    Subtrees which are left unchanged by this are shared with the original
+    resource instead of being copied, so the result must not be mutated in
+    place if the original is still in use.
+
+    Args:
+        resource: Nested dicts and lists, e.g. the output of to_dict().
+        convert: Key conversion such as camel_case, None keeps keys as is.
+
+    Returns:
+        The normalized resource.
+    """
+    if type(resource) is not dict and type(resource) is not list:
+        return resource
+
+    def _frame(original):
+        items = iter(original.items()) if type(original) is dict \
+            else iter(original)
+        # original, remaining items, normalized entries, changed, child key
+        return [original, items, [], False, None]
+
+    stack = [_frame(resource)]
+    while True:
+        frame = stack[-1]
+        original, items, entries = frame[0], frame[1], frame[2]
+        is_dict = type(original) is dict
+        descended = False
+        for item in items:
+            if is_dict:
+                k, v = item
+                if v is None:
+                    frame[3] = True
+                    continue
+                if convert is not None:
+                    new_k = convert(k)
+                    if new_k != k:
+                        frame[3] = True
+                    k = new_k
+            else:
+                k, v = None, item
+
+            if type(v) is dict or type(v) is list:
+                frame[4] = k
+                stack.append(_frame(v))
+                descended = True
+                break
+            entries.append((k, v))
+        if descended:
+            continue
+
+        stack.pop()
+        if not frame[3]:
+            normalized = original
+        elif is_dict:
+            normalized = dict(entries)
+        else:
+            normalized = [v for _, v in entries]
+
+        if not stack:
+            return normalized
+        parent = stack[-1]
+        parent[2].append((parent[4], normalized))
+        if normalized is not original:
+            parent[3] = True
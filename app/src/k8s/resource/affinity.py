@@ -0,0 +1,143 @@
+from typing import Dict, Iterable, List
+
+from kubernetes.client import V1PersistentVolume
+
+from k8s.resource import normalize, camel_case
+
+__author__ = "Noah Hummel"
+
+
+# labels put on PVs by in-tree provisioners and the PV label admission
+# controller, newer CSI drivers use nodeAffinity instead
+TOPOLOGY_LABELS = (
+    "topology.kubernetes.io/zone",
+    "topology.kubernetes.io/region",
+    "failure-domain.beta.kubernetes.io/zone",
+    "failure-domain.beta.kubernetes.io/region",
+)
+
+# regional volumes list all of their zones in one label value
+_ZONE_SEPARATOR = "__"
+
+_TERM_KEYS = ("matchExpressions", "matchFields")
+
+
+def _required_terms(pod_spec: Dict) -> List[Dict]:
+    affinity = pod_spec.setdefault("affinity", dict())
+    node_affinity = affinity.setdefault("nodeAffinity", dict())
+    required = node_affinity.setdefault(
+        "requiredDuringSchedulingIgnoredDuringExecution",
+        {"nodeSelectorTerms": [dict()]})
+    return required["nodeSelectorTerms"]
+
+
+def require_node(pod_spec: Dict, node_name: str) -> Dict:
+    """Restricts a camelCase pod spec to a single node.
+
+    Unlike setting nodeName, the Pod still passes through the scheduler, so
+    it waits for resources on the node instead of failing.
+
+    Returns:
+        The pod spec.
+    """
+    # terms are ORed, so the node has to be required by every one of them
+    for term in _required_terms(pod_spec):
+        term.setdefault("matchFields", []).append({
+            "key": "metadata.name",
+            "operator": "In",
+            "values": [node_name]
+        })
+    return pod_spec
+
+
+def require_terms(pod_spec: Dict, terms: List[Dict]) -> Dict:
+    """Restricts a camelCase pod spec to nodes matching any of terms.
+
+    The terms are combined with the node affinity the pod spec already
+    requires, so the Pod is only scheduled on nodes matching both.
+
+    Args:
+        pod_spec: The pod spec, modified in place.
+        terms: camelCase nodeSelectorTerms, empty to allow any node.
+
+    Returns:
+        The pod spec.
+    """
+    if not terms:
+        return pod_spec
+    existing = _required_terms(pod_spec)
+    # (a1 or a2) and (b1 or b2) == (a1 and b1) or (a1 and b2) or ...
+    combined = []
+    for a in existing:
+        for b in terms:
+            combined.append({key: a.get(key, []) + b.get(key, [])
+                             for key in _TERM_KEYS
+                             if a.get(key) or b.get(key)})
+    existing[:] = combined
+    return pod_spec
+
+
+def prefer_nodes(pod_spec: Dict, node_names: Iterable[str],
+                 weight: int=100) -> Dict:
+    """Makes the scheduler prefer some nodes for a camelCase pod spec.
+
+    Args:
+        pod_spec: The pod spec, modified in place.
+        node_names: Names of the preferred nodes.
+        weight: Weight of the preference, between 1 and 100.
+
+    Returns:
+        The pod spec.
+    """
+    node_names = sorted(set(node_names))
+    if not node_names:
+        return pod_spec
+    affinity = pod_spec.setdefault("affinity", dict())
+    node_affinity = affinity.setdefault("nodeAffinity", dict())
+    node_affinity.setdefault(
+        "preferredDuringSchedulingIgnoredDuringExecution", []).append({
+            "weight": weight,
+            "preference": {"matchFields": [{
+                "key": "metadata.name",
+                "operator": "In",
+                "values": node_names
+            }]}
+        })
+    return pod_spec
+
+
+def tolerate(pod_spec: Dict, tolerations: List[Dict]) -> Dict:
+    """Adds camelCase tolerations to a camelCase pod spec, skipping copies.
+
+    Returns:
+        The pod spec.
+    """
+    existing = pod_spec.setdefault("tolerations", [])
+    for toleration in tolerations:
+        if toleration not in existing:
+            existing.append(toleration)
+    return pod_spec
+
+
+def get_volume_node_selector_terms(pv: V1PersistentVolume) -> List[Dict]:
+    """Returns the nodes a PersistentVolume can be used on.
+
+    The PV's required nodeAffinity is used if it has one, otherwise its
+    zone and region labels.
+
+    Returns:
+        camelCase nodeSelectorTerms, an empty list if the PV can be used on
+        any node.
+    """
+    affinity = pv.spec.node_affinity
+    if affinity and affinity.required and \
+            affinity.required.node_selector_terms:
+        return normalize([term.to_dict() for term in
+                          affinity.required.node_selector_terms], camel_case)
+
+    labels = pv.metadata.labels or dict()
+    expressions = [{"key": key,
+                    "operator": "In",
+                    "values": labels[key].split(_ZONE_SEPARATOR)}
+                   for key in TOPOLOGY_LABELS if labels.get(key)]
+    return [{"matchExpressions": expressions}] if expressions else []
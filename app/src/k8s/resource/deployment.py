@@ -1,52 +1,119 @@
-from typing import List, Dict
+from typing import Callable, Collection, List, Dict
 
 import logger
-from k8s.resource import strip_null
+from k8s.resource import normalize, copy_resource
 
 __author__ = "Noah Hummel"
 log = logger.get(__name__)
 
 
-def copy_volumes(from_deployment: Dict, to_deployment: Dict) -> Dict:
-    """Copies volumes from Deployment to Deployment.
+def get_volumes(deployment: Dict, exclude_secrets: bool=False,
+                convert: Callable[[str], str]=None) -> List[Dict]:
+    """Returns all volumes defined in a k8s Deployment.
 
-    Does not copy volumes for mounted secrets.
+    Volumes can either be defined in Deployment.spec or
+    Deployment.spec.template.spec. Secret volumes are filtered out before
+    the remaining volumes are normalized in a single traversal.
 
     Args:
-        from_deployment:
-            Deployment whose volumes are copied.
-        to_deployment:
-            Deployment who will receive from_deployments' volumes.
+        deployment:
+            Deployment whose volumes to get, as dict.
+        exclude_secrets:
+            If True, volumes for mounted secrets will be excluded.
+        convert:
+            Key conversion applied to the volumes, e.g. camel_case.
 
     Returns:
-        The resulting Deployment.
+        List of volumes for Deployment as dict, without None values. The
+        volumes may share unchanged subtrees with deployment.
     """
 
-    # attaching the volumes of the original deployment to this one
-    volumes: List[Dict] = get_volumes(from_deployment, exclude_secrets=True)
-    to_deployment["spec"]["template"]["spec"]["volumes"].extend(volumes)
-    return to_deployment
+    volumes = deployment["spec"]["template"]["spec"]["volumes"] or []
+    if exclude_secrets:
+        volumes = [v for v in volumes if v.get("secret") is None]
+    return normalize(volumes, convert)
 
 
-def get_volumes(deployment: Dict, exclude_secrets: bool=False) -> List[Dict]:
-    """Returns all volumes defined in a k8s Deployment.
-
-    Volumes can either be defined in Deployment.spec or
-    Deployment.spec.template.spec.
+def get_tolerations(deployment: Dict,
+                    convert: Callable[[str], str]=None) -> List[Dict]:
+    """Returns the tolerations of the Pods of a k8s Deployment.
 
     Args:
         deployment:
-            Deployment whose volumes to get, as dict.
-        exclude_secrets:
-            If True, volumes for mounted secrets will be excluded.
+            Deployment whose tolerations to get, as dict.
+        convert:
+            Key conversion applied to the tolerations, e.g. camel_case.
 
     Returns:
-        List of volumes for Deployment as dict.
+        List of tolerations as dict, without None values.
     """
+    tolerations = deployment["spec"]["template"]["spec"].get("tolerations")
+    return normalize(tolerations or [], convert)
 
-    volumes = [strip_null(v) for v in
-               deployment["spec"]["template"]["spec"]["volumes"]]
 
-    if exclude_secrets:
-        return [v for v in volumes if "secret" not in v]
-    return volumes
\ No newline at end of file
+def get_claim_names(deployment: Dict) -> List[str]:
+    """Returns the names of the PVCs mounted by a Deployment.
+
+    Args:
+        deployment: Deployment as snake_case dict.
+    """
+    volumes = deployment["spec"]["template"]["spec"]["volumes"] or []
+    return [volume["persistent_volume_claim"]["claim_name"]
+            for volume in volumes if volume.get("persistent_volume_claim")]
+
+
+def replace_claims(deployment: Dict, claims: Dict[str, str]) -> Dict:
+    """Points the PVC volumes of a Deployment to other PVCs.
+
+    Args:
+        deployment: Deployment as snake_case dict, it is not modified.
+        claims: Dict mapping PVC names to the names replacing them.
+
+    Returns:
+        A copy of deployment with the claims replaced.
+    """
+    deployment = copy_resource(deployment)
+    for volume in deployment["spec"]["template"]["spec"]["volumes"] or []:
+        claim = volume.get("persistent_volume_claim")
+        if claim and claim["claim_name"] in claims:
+            claim["claim_name"] = claims[claim["claim_name"]]
+    return deployment
+
+
+def remove_claims(deployment: Dict, claims: Collection[str]) -> Dict:
+    """Removes the volumes of some PVCs from a Deployment.
+
+    Args:
+        deployment: Deployment as snake_case dict, it is not modified.
+        claims: Names of the PVCs whose volumes to remove.
+
+    Returns:
+        A copy of deployment without the volumes of claims.
+    """
+    deployment = copy_resource(deployment)
+    pod_spec = deployment["spec"]["template"]["spec"]
+    pod_spec["volumes"] = [
+        volume for volume in pod_spec["volumes"] or []
+        if not volume.get("persistent_volume_claim")
+        or volume["persistent_volume_claim"]["claim_name"] not in claims]
+    return deployment
+
+
+def mount_claims(deployment: Dict, claims: List[str]) -> Dict:
+    """Replaces the volumes of a Deployment with one volume per PVC.
+
+    Each volume is named like its PVC, so it has the same canonical
+    mountPath regardless of the Deployments mounting the PVC.
+
+    Args:
+        deployment: Deployment as snake_case dict, it is not modified.
+        claims: Names of the PVCs to mount.
+
+    Returns:
+        A copy of deployment mounting only claims.
+    """
+    deployment = copy_resource(deployment)
+    deployment["spec"]["template"]["spec"]["volumes"] = [
+        {"name": claim, "persistent_volume_claim": {"claim_name": claim}}
+        for claim in claims]
+    return deployment
@@ -0,0 +1,62 @@
+from decimal import Decimal
+from typing import Optional
+
+from kubernetes.client import V1PersistentVolumeClaim
+
+__author__ = "Noah Hummel"
+
+
+_SUFFIXES = {
+    "Ki": 2 ** 10, "Mi": 2 ** 20, "Gi": 2 ** 30,
+    "Ti": 2 ** 40, "Pi": 2 ** 50, "Ei": 2 ** 60,
+    "m": Decimal("0.001"), "": 1, "k": 10 ** 3, "M": 10 ** 6,
+    "G": 10 ** 9, "T": 10 ** 12, "P": 10 ** 15, "E": 10 ** 18,
+}
+
+
+def parse_quantity(quantity: str) -> int:
+    """Converts a k8s resource quantity, e.g. "10Gi", to a number of units.
+
+    Raises:
+        ValueError: If quantity is not a valid quantity.
+    """
+    quantity = str(quantity).strip()
+    number = quantity.rstrip("KMGTPEimk")
+    suffix = quantity[len(number):]
+    if suffix not in _SUFFIXES or not number:
+        raise ValueError(f"Invalid quantity {quantity!r}")
+    try:
+        return int(Decimal(number) * _SUFFIXES[suffix])
+    except ArithmeticError:
+        raise ValueError(f"Invalid quantity {quantity!r}")
+
+
+def get_capacity(pvc: V1PersistentVolumeClaim) -> Optional[int]:
+    """Returns the storage capacity of a PVC in bytes.
+
+    The capacity of the bound volume is preferred over the requested
+    capacity, since volumes may be larger than requested.
+
+    Returns:
+        The capacity in bytes, None if it's unknown.
+    """
+    for resources in (pvc.status and pvc.status.capacity,
+                      pvc.spec.resources and pvc.spec.resources.requests):
+        if resources and "storage" in resources:
+            try:
+                return parse_quantity(resources["storage"])
+            except ValueError:
+                pass
+    return None
+
+
+def is_single_node(pvc: V1PersistentVolumeClaim) -> bool:
+    """Returns whether a PVC can only be attached to one node at a time.
+
+    That's the case if it's ReadWriteOnce or ReadWriteOncePod, even if it
+    has other access modes as well. The access modes of the bound volume
+    are preferred over the requested ones.
+    """
+    access_modes = (pvc.status and pvc.status.access_modes) or \
+        pvc.spec.access_modes or []
+    return bool({"ReadWriteOnce", "ReadWriteOncePod"} & set(access_modes))
@@ -0,0 +1,27 @@
+import os
+
+from typing import Dict, Optional
+
+__author__ = "Noah Hummel"
+
+
+GROUP = "storage.k8s.io"
+# the pinned client only knows v1beta1, which was removed in kubernetes 1.22
+VERSION = os.environ.get("VOLUME_ATTACHMENT_API_VERSION", "v1")
+PLURAL = "volumeattachments"
+
+
+def get_persistent_volume_name(attachment: Dict) -> Optional[str]:
+    source = attachment.get("spec", dict()).get("source") or dict()
+    return source.get("persistentVolumeName")
+
+
+def get_node_name(attachment: Dict) -> str:
+    return attachment["spec"]["nodeName"]
+
+
+def is_attached(attachment: Dict) -> bool:
+    """Whether a volume is attached to its node and not being detached."""
+    status = attachment.get("status") or dict()
+    deleting = attachment["metadata"].get("deletionTimestamp") is not None
+    return bool(status.get("attached")) and not deleting
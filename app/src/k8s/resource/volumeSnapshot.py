@@ -0,0 +1,87 @@
+import os
+
+from typing import Dict, Optional
+
+from kubernetes.client import V1PersistentVolumeClaim
+
+__author__ = "Noah Hummel"
+
+
+GROUP = "snapshot.storage.k8s.io"
+# version of the VolumeSnapshot API served by the cluster's snapshot CRDs
+VERSION = os.environ.get("VOLUME_SNAPSHOT_API_VERSION", "v1")
+PLURAL = "volumesnapshots"
+
+MANAGED_BY = {"app.kubernetes.io/managed-by": "backup-runner"}
+
+
+def new_volume_snapshot(name: str, pvc: V1PersistentVolumeClaim,
+                        snapshot_class: str=None) -> Dict:
+    """Generates a VolumeSnapshot of a PVC.
+
+    Args:
+        name: Name of the VolumeSnapshot.
+        pvc: The PVC to snapshot.
+        snapshot_class:
+            Name of the VolumeSnapshotClass, defaults to the cluster's default
+            class for the PVC's driver.
+
+    Returns:
+        The VolumeSnapshot as Dict.
+    """
+    spec = {"source": {"persistentVolumeClaimName": pvc.metadata.name}}
+    if snapshot_class:
+        spec["volumeSnapshotClassName"] = snapshot_class
+    return {
+        "apiVersion": f"{GROUP}/{VERSION}",
+        "kind": "VolumeSnapshot",
+        "metadata": {"name": name, "labels": dict(MANAGED_BY)},
+        "spec": spec
+    }
+
+
+def new_pvc_from_snapshot(name: str, pvc: V1PersistentVolumeClaim,
+                          snapshot_name: str) -> Dict:
+    """Generates a PVC provisioned from a VolumeSnapshot of another PVC.
+
+    The clone uses the storage class, access modes and volume mode of the
+    original PVC and requests its full capacity, which is at least the
+    snapshot's restoreSize.
+
+    Args:
+        name: Name of the clone.
+        pvc: The PVC the snapshot was taken of.
+        snapshot_name: Name of the VolumeSnapshot.
+
+    Returns:
+        The PVC as Dict.
+    """
+    capacity = (pvc.status and pvc.status.capacity or dict()).get("storage")
+    if capacity is None:
+        capacity = pvc.spec.resources.requests["storage"]
+    spec = {
+        "accessModes": pvc.spec.access_modes,
+        "resources": {"requests": {"storage": capacity}},
+        "dataSource": {
+            "apiGroup": GROUP,
+            "kind": "VolumeSnapshot",
+            "name": snapshot_name
+        }
+    }
+    if pvc.spec.storage_class_name:
+        spec["storageClassName"] = pvc.spec.storage_class_name
+    if pvc.spec.volume_mode:
+        spec["volumeMode"] = pvc.spec.volume_mode
+    return {
+        "apiVersion": "v1",
+        "kind": "PersistentVolumeClaim",
+        "metadata": {"name": name, "labels": dict(MANAGED_BY)},
+        "spec": spec
+    }
+
+
+def get_error(snapshot: Optional[Dict]) -> Optional[str]:
+    """Returns the error message of a failed VolumeSnapshot, if any."""
+    status = snapshot.get("status") if snapshot else None
+    error = status.get("error") if status else None
+    return error.get("message", "unknown error") if error else None
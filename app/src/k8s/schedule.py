@@ -0,0 +1,108 @@
+import random
+import threading
+import time
+
+from typing import Iterator
+
+__author__ = "Noah Hummel"
+
+
+class PollSchedule:
+    """Delays between the polls of a reconciliation wait.
+
+    The first probe happens immediately. After that, delays grow
+    exponentially with decorrelated jitter, i.e. each delay is drawn
+    uniformly between base and three times the previous delay, so pollers
+    started together spread out. Delays are capped by cap and by the time
+    remaining until the deadline, so the last probe happens right at the
+    deadline instead of after it.
+
+    Args:
+        base: Smallest delay in seconds.
+        cap: Largest delay in seconds.
+    """
+
+    def __init__(self, base: float=0.5, cap: float=6.0):
+        self.base = base
+        self.cap = cap
+
+    def __repr__(self):
+        return f"PollSchedule(base={self.base}, cap={self.cap})"
+
+    def delays(self, deadline: float) -> Iterator[float]:
+        """Yields the delay before each probe until the deadline is reached.
+
+        Args:
+            deadline: Value of time.monotonic() at which to stop.
+
+        Returns:
+            Iterator over delays in seconds, starting with 0.
+        """
+        yield 0.0
+        delay = self.base
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            delay = min(self.cap, random.uniform(self.base, delay * 3))
+            yield min(delay, remaining)
+
+
+# polls of a Deployment's scale, which usually reconciles within seconds
+SCALE_WAIT = PollSchedule(base=0.5, cap=5.0)
+# polls of a Deployment's available replicas, which wait for readiness
+AVAILABLE_WAIT = PollSchedule(base=1.0, cap=10.0)
+# polls of terminating Pods, which take at least their grace period
+POD_TERMINATION_WAIT = PollSchedule(base=1.0, cap=10.0)
+# polls of VolumeAttachments, detaching takes seconds up to minutes
+DETACH_WAIT = PollSchedule(base=1.0, cap=10.0)
+# polls of VolumeSnapshots, which usually become ready within seconds
+SNAPSHOT_WAIT = PollSchedule(base=1.0, cap=10.0)
+# polls of backup Jobs, which run for minutes to hours
+JOB_WAIT = PollSchedule(base=5.0, cap=60.0)
+DEFAULT_WAIT = PollSchedule()
+
+
+class TokenBucket:
+    """Limits the rate of API requests across threads.
+
+    The bucket holds up to burst tokens and is refilled with rate tokens per
+    second. Each request takes a token, waiting for one if the bucket is
+    empty. Waiting requests reserve their tokens in order, so none of them
+    starves.
+
+    Args:
+        rate: Tokens added per second, 0 disables the limit.
+        burst: Maximum number of tokens held.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"TokenBucket(rate={self.rate}, burst={self.burst})"
+
+    def acquire(self) -> float:
+        """Takes a token, blocking until one is available.
+
+        Returns:
+            Seconds spent waiting for the token.
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
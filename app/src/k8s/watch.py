@@ -0,0 +1,292 @@
+import socket
+import threading
+import time
+
+from typing import Callable, Dict, Optional, Any, Iterator, Tuple
+
+from kubernetes import watch
+from kubernetes.watch.watch import iter_resp_lines
+from kubernetes.client.rest import ApiException
+from urllib3.exceptions import HTTPError
+
+import logger
+import metrics
+from k8s.schedule import PollSchedule, DEFAULT_WAIT
+
+__author__ = "Noah Hummel"
+log = logger.get(__name__)
+
+
+# HTTP status the API server uses when a resourceVersion is too old to watch
+GONE = 410
+# HTTP statuses after which a list or watch is worth retrying
+TRANSIENT = {429, 500, 502, 503, 504}
+
+
+def _identity(objects: list) -> Any:
+    return objects
+
+
+def first_or_none(objects: list) -> Any:
+    """Projection for watch sources which select at most one object."""
+    return objects[0] if objects else None
+
+
+class WatchSource:
+    """Describes how to list and watch the objects backing a view function.
+
+    A WatchSource wraps a kubernetes list function (e.g.
+    CoreV1Api.list_namespaced_pod) together with its arguments. The objects
+    returned by the list function are kept up to date through a watch and
+    passed through `project` before a predicate is applied to them, so that
+    predicates see the same value the corresponding view function returns.
+
+    Args:
+        list_fn: Kubernetes API list function supporting watch=True.
+        *args: Positional args for list_fn.
+        project:
+            Function mapping the current list of objects to the value
+            predicates are applied to. Defaults to the list itself.
+        **kwargs: Keyword args for list_fn, e.g. label_selector.
+    """
+
+    def __init__(self, list_fn: Callable, *args,
+                 project: Callable[[list], Any]=None, **kwargs):
+        self.list_fn = list_fn
+        self.args = args
+        self.kwargs = kwargs
+        self.project = project if project else _identity
+
+    def __repr__(self):
+        return f"WatchSource({self.list_fn.__name__}, {self.args}, " \
+               f"{self.kwargs})"
+
+
+def watchable(source_factory: Callable[..., Optional[WatchSource]]) \
+        -> Callable:
+    """Marks a view function as backed by a watchable list of resources.
+
+    The source factory is called with the same arguments as the view function
+    and should return a WatchSource yielding the same value as the view
+    function, or None if the resource can't be watched.
+
+    Args:
+        source_factory: Function returning a WatchSource.
+
+    Returns:
+        Decorator attaching source_factory to a view function.
+    """
+    def _decorator(fn: Callable) -> Callable:
+        fn.watch_source = source_factory
+        return fn
+    return _decorator
+
+
+def get_watch_source(fn: Callable, *args, **kwargs) -> Optional[WatchSource]:
+    """Returns the WatchSource for a view function call, if there is one."""
+    source_factory = getattr(fn, "watch_source", None)
+    if source_factory is None:
+        return None
+    try:
+        return source_factory(*args, **kwargs)
+    except ApiException as e:
+        log.debug("Can't watch %s%s: %s %s", fn.__name__, args, e.status,
+                  e.reason)
+        return None
+
+
+def _key(obj) -> str:
+    return obj.metadata.uid or f"{obj.metadata.namespace}/{obj.metadata.name}"
+
+
+class WatchExpired(Exception):
+    """The resourceVersion a watch resumed from is gone (410 Gone)."""
+    pass
+
+
+class WatchStop(threading.Event):
+    """Event which cancels a watch when set.
+
+    Setting it also shuts down the connection of the watch's open response,
+    so the thread streaming the watch returns right away instead of at the
+    next event or when the API server ends the watch.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._response = None
+
+    def attach(self, response):
+        """Registers the open response of a watch, see stream_events."""
+        with self._lock:
+            self._response = response
+            if self.is_set():
+                _shutdown(response)
+
+    def detach(self):
+        """Unregisters the response before it's released to the pool."""
+        with self._lock:
+            self._response = None
+
+    def set(self):
+        super().set()
+        with self._lock:
+            if self._response is not None:
+                _shutdown(self._response)
+
+
+def _shutdown(response):
+    # closing the response waits for the pending read, shutting down the
+    # socket makes the read fail immediately
+    connection = getattr(response, "_connection", None)
+    sock = getattr(connection, "sock", None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:  # already closed
+        pass
+
+
+def stream_events(list_fn: Callable, args: tuple, kwargs: dict,
+                  resource_version: str, timeout: float,
+                  stop: WatchStop=None) -> Iterator[Tuple[str, Any]]:
+    """Streams watch events for a list function from a resourceVersion.
+
+    Args:
+        list_fn: Kubernetes API list function supporting watch=True.
+        args: Positional args for list_fn.
+        kwargs: Keyword args for list_fn.
+        resource_version: resourceVersion to resume from.
+        timeout: Seconds after which the API server ends the watch.
+        stop:
+            Event which, when set, shuts down the open watch. The iterator
+            then raises an HTTPError.
+
+    Raises:
+        WatchExpired: If resource_version is too old to be watched.
+        ApiException: If the API server reported any other error.
+
+    Returns:
+        Iterator over (event type, object) tuples.
+    """
+    seconds = max(1, int(timeout))
+    w = watch.Watch()
+    return_type = w.get_return_type(list_fn)
+    response = None
+    try:
+        # the client ignores a float _request_timeout, a half-open watch
+        # connection would then block forever
+        response = list_fn(*args, resource_version=resource_version,
+                           timeout_seconds=seconds,
+                           _request_timeout=seconds + 5, watch=True,
+                           _preload_content=False, **kwargs)
+        if stop is not None:
+            stop.attach(response)
+        for line in iter_resp_lines(response):
+            event = w.unmarshal_event(line, return_type)
+            if event["type"] == "ERROR":
+                status = event["raw_object"]
+                if status.get("code") == GONE:
+                    raise WatchExpired()
+                raise ApiException(status=status.get("code"),
+                                   reason=status.get("message"))
+            yield event["type"], event["object"]
+    except ApiException as e:
+        if e.status == GONE:
+            raise WatchExpired()
+        raise
+    finally:
+        if response is not None:
+            if stop is not None:
+                stop.detach()
+            response.close()
+            response.release_conn()
+
+
+def watch_until(predicate: Callable, source: WatchSource, deadline: float,
+                stop: WatchStop=None,
+                schedule: PollSchedule=DEFAULT_WAIT) -> bool:
+    """Blocks until the objects of a WatchSource satisfy predicate.
+
+    The objects are listed once and then kept up to date through a watch
+    which resumes from the last seen resourceVersion. The predicate is
+    checked after the initial list and after every watch event. If the
+    watch expires (410 Gone), the objects are listed again, which is the
+    only time the API server is polled. Transient errors are retried after
+    the delays of schedule.
+
+    Args:
+        predicate: Function Any -> bool, applied to the projected objects.
+        source: The objects to watch.
+        deadline: Value of time.monotonic() at which to give up.
+        stop: Event which cancels the watch when set.
+        schedule: Delays between retries after transient errors.
+
+    Returns:
+        Whether the predicate was satisfied before the deadline.
+    """
+    stop = stop if stop else WatchStop()
+    objects: Dict[str, Any] = dict()
+    resource_version = None
+    retries = schedule.delays(deadline)
+    next(retries)  # the first delay is 0
+
+    def _satisfied() -> bool:
+        retval = predicate(source.project(list(objects.values())))
+        log.debug("Checking %s: %s? %s", source, predicate.__name__,
+                  retval)
+        return retval
+
+    while not stop.is_set():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+
+        try:
+            if resource_version is None:
+                result = source.list_fn(*source.args, **source.kwargs)
+                objects = {_key(obj): obj for obj in result.items}
+                resource_version = result.metadata.resource_version
+                if _satisfied():
+                    return True
+                continue
+
+            for event_type, obj in stream_events(
+                    source.list_fn, source.args, source.kwargs,
+                    resource_version, remaining, stop):
+                if stop.is_set():
+                    return False
+
+                resource_version = obj.metadata.resource_version
+                if event_type == "DELETED":
+                    objects.pop(_key(obj), None)
+                else:
+                    objects[_key(obj)] = obj
+
+                if _satisfied():
+                    return True
+        except WatchExpired:
+            log.debug("Watch on %s expired, relisting.", source)
+            metrics.API_RETRIES.inc(phase=metrics.current_phase(),
+                                    reason="expired",
+                                    cluster=metrics.current_cluster())
+            resource_version = None
+        except (ApiException, HTTPError) as e:
+            if stop.is_set():  # stop shut down the watch
+                return False
+            if isinstance(e, ApiException) and e.status not in TRANSIENT:
+                raise
+            delay = next(retries, None)
+            if delay is None:
+                return False
+            log.debug("Watch on %s failed, relisting in %.1fs: %r", source,
+                      delay, e)
+            metrics.API_RETRIES.inc(phase=metrics.current_phase(),
+                                    reason="error",
+                                    cluster=metrics.current_cluster())
+            resource_version = None
+            stop.wait(delay)
+
+    return False
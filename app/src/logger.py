@@ -1,10 +1,14 @@
-import sys
-
-import os
-
+import atexit
+import contextlib
+import contextvars
+import json
 import logging
-import sentry_sdk
-from sentry_sdk.integrations.logging import LoggingIntegration
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
 
 __author__ = "Noah Hummel"
 
@@ -12,25 +16,150 @@ __author__ = "Noah Hummel"
 loggers = dict()
 
 _sentry_dsn = os.environ.get("SENTRY_DSN")
-if _sentry_dsn:
+# share of backups sent as performance transactions, needs sentry-sdk>=0.11
+_sentry_traces_sample_rate = os.environ.get("SENTRY_TRACES_SAMPLE_RATE")
+
+LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# "text" for humans, "json" for log collectors
+FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+# characters after which debug messages, e.g. manifest dumps, are cut off
+MAX_LENGTH = int(os.environ.get("LOG_MAX_LENGTH", 2000))
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# identifies the log records of one run of the runner
+RUN_ID = os.urandom(4).hex()
+
+_context: contextvars.ContextVar = contextvars.ContextVar("log_context",
+                                                          default=dict())
+
+
+@contextlib.contextmanager
+def context(**fields):
+    """Adds fields to every record logged within, e.g. a deployment's name.
+
+    Like metrics phases, the fields are inherited by run_blocking, so
+    records logged by API calls in other threads carry them as well.
+    """
+    token = _context.set(dict(_context.get(), **fields))
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def truncate(message: str, max_length: int=MAX_LENGTH) -> str:
+    """Cuts off a message after max_length characters, 0 to never cut."""
+    if not max_length or len(message) <= max_length:
+        return message
+    return f"{message[:max_length]}... " \
+           f"({len(message) - max_length} characters truncated)"
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "run": RUN_ID,
+        }
+        entry.update(getattr(record, "context", dict()))
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+    def formatTime(self, record: logging.LogRecord, datefmt=None) -> str:
+        return time.strftime("%Y-%m-%dT%H:%M:%S",
+                             time.gmtime(record.created)) + \
+            f".{int(record.msecs):03d}Z"
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread, formatting them first.
+
+    The message is formatted in the logging thread, since the arguments may
+    be changed once the call returned, while the records are written to
+    stdout by the listener thread. Debug messages are truncated, results
+    like the summary of a batch run are always logged in full.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.context = _context.get()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+        message = record.getMessage()
+        record.msg = truncate(message) if record.levelno <= logging.DEBUG \
+            else message
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+def _init_sentry():
+    import sentry_sdk
+    from sentry_sdk.integrations.logging import LoggingIntegration
+
     sentry_logging = LoggingIntegration(
         level=logging.DEBUG,
         event_level=logging.WARNING
     )
+    sentry_options = dict()
+    if _sentry_traces_sample_rate:
+        sentry_options["traces_sample_rate"] = \
+            float(_sentry_traces_sample_rate)
     sentry_sdk.init(
         dsn=_sentry_dsn,
-        integrations=[sentry_logging]
+        integrations=[sentry_logging],
+        **sentry_options
     )
 
 
+def _configure() -> logging.handlers.QueueListener:
+    if _sentry_dsn:
+        _init_sentry()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if FORMAT == "json"
+                         else logging.Formatter(TEXT_FORMAT))
+    records = queue.Queue()
+    listener = logging.handlers.QueueListener(records, handler)
+    # loggers of libraries like urllib3 propagate here as well, but only
+    # loggers created by get are set to LEVEL
+    root = logging.getLogger()
+    root.addHandler(_QueueHandler(records))
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+# configured by the first call to get, so importing this module is cheap
+_listener = None
+_configure_lock = threading.Lock()
+
+
 def get(name):
+    """Returns the logger of a module, logging at LOG_LEVEL.
+
+    Records are written to stdout by a background thread, so logging never
+    blocks on I/O. Messages should pass their arguments separately, e.g.
+    log.debug("Created %s", name), so they are only formatted if the record
+    is logged at all. The first call starts the listener and initializes
+    Sentry if SENTRY_DSN is set.
+    """
+    global _listener
+    if _listener is None:
+        with _configure_lock:
+            if _listener is None:
+                _listener = _configure()
     if not loggers.get(name):
         logger = logging.getLogger(name)
-        handler = logging.StreamHandler(sys.stdout)
-        handler.setLevel(logging.DEBUG)
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-        logger.setLevel(logging.DEBUG)
+        try:
+            logger.setLevel(LEVEL)
+        except ValueError:
+            logger.setLevel(logging.INFO)
         loggers[name] = logger
     return loggers.get(name)
@@ -1,24 +1,14 @@
-import sentry_sdk
-import yaml
-from datetime import timedelta
-
 import os
 import argparse
-
-from kubernetes import config, client
-from kubernetes.client import V1Deployment
-from kubernetes.client.rest import ApiException
-
-import logger
-from k8s import wait_for_reconciliation_blocking
-from mutations.deployment import create_deployment
-from mutations.scale import update_deployment_scale
-from sidecar_deploy import new_backup_sidecar_deployment_with_volumes
-from views.persistentVolumeClaim import list_pvcs_for_deployment
-from views.pod import list_pods_for_deployment
+import signal
+from datetime import timedelta
 
 __author__ = "Noah Hummel"
 
+# Only the modules needed by the selected operation are imported, once the
+# arguments are valid. Importing kubernetes alone takes most of the startup
+# time, which matters for short-lived CronJob pods.
+
 
 parser = argparse.ArgumentParser(
     description="Perform an offline backup of a kubernetes deployment."
@@ -26,11 +16,13 @@ parser = argparse.ArgumentParser(
 parser.add_argument(
     "namespace",
     type=str,
+    nargs="?",
     help="Kubernetes namespace of the deployment"
 )
 parser.add_argument(
     "deployment",
     type=str,
+    nargs="?",
     help="Name of the deployment"
 )
 parser.add_argument(
@@ -40,73 +32,230 @@ parser.add_argument(
 )
 operations = parser.add_mutually_exclusive_group()
 operations.add_argument("-b", "--backup", action="store_true",
-                        help="Perform a backup of all attached volumes")
-operations.add_argument("-r", "--snapshot", type=str, nargs="+",
-                        help="Perform a restore of the given snapshots")
+                        help="Perform a backup of all attached volumes "
+                             "(default)")
+operations.add_argument("-r", "--snapshot", type=str,
+                        nargs="+", metavar="SNAPSHOT[:VOLUME,...]",
+                        help="Perform a restore of the given snapshots, "
+                             "restoring only the given volumes from each if "
+                             "there are several snapshots")
+parser.add_argument("--backup-timeout", type=int, default=360,
+                    help="Minutes to wait for a backup or the restore of "
+                         "a volume to finish")
+parser.add_argument("--restore-concurrency", type=int, default=4,
+                    help="Maximum number of volumes restored at the same "
+                         "time")
+parser.add_argument("-s", "--shards", type=int, default=1,
+                    help="Split the volumes of a deployment across up to this "
+                         "many parallel backup jobs, balanced by PVC size")
+parser.add_argument("--no-pin", dest="pin_to_attached_node",
+                    action="store_false",
+                    help="Wait for volumes to be detached from their node "
+                         "instead of running the backup or restore on that "
+                         "node")
+parser.add_argument("--volume-snapshots", action="store_true",
+                    help="Back up from CSI VolumeSnapshots, so deployments "
+                         "are only scaled down until the snapshots are ready")
+parser.add_argument("--snapshot-class", type=str,
+                    help="VolumeSnapshotClass of the snapshots, defaults to "
+                         "the cluster's default class")
+monitoring = parser.add_argument_group(
+    "metrics",
+    "Export Prometheus metrics about the duration of each backup phase."
+)
+monitoring.add_argument("--metrics-file", type=str,
+                        help="Write metrics to this file when done, e.g. for "
+                             "node_exporter's textfile collector")
+monitoring.add_argument("--pushgateway", type=str,
+                        help="Push metrics to this Pushgateway URL when done")
+monitoring.add_argument("--metrics-port", type=int,
+                        help="Serve metrics on this port at /metrics")
+batch = parser.add_argument_group(
+    "batch mode",
+    "Back up every deployment matching the given namespaces and selector "
+    "instead of a single deployment."
+)
+batch.add_argument("-l", "--selector", type=str,
+                   help="Label selector for the deployments to back up, "
+                        "matches all namespaces unless --namespaces is given")
+batch.add_argument("-n", "--namespaces", type=str, action="append",
+                   help="Namespace of the deployments to back up, can be "
+                        "given multiple times")
+batch.add_argument("-A", "--all-namespaces", action="store_true",
+                   help="Back up deployments in all namespaces")
+batch.add_argument("-c", "--concurrency", type=int, default=4,
+                   help="Maximum number of backups running at the same time")
+batch.add_argument("--namespace-concurrency", type=int, default=1,
+                   help="Maximum number of backups running at the same time "
+                        "within one namespace")
+batch.add_argument("--rolling", type=str, metavar="LABEL",
+                   help="Back up deployments of a namespace with the same "
+                        "value of this label, e.g. the shards of a "
+                        "database, one after another, each once the "
+                        "previous one is available again")
+batch.add_argument("--max-unavailable", type=int, default=1,
+                   help="Maximum number of deployments with the same "
+                        "--rolling label backed up at the same time")
+clusters = parser.add_argument_group(
+    "clusters",
+    "Back up in several clusters at the same time. Each cluster gets its "
+    "own API clients and rate limit, and the concurrency limits apply to "
+    "each cluster separately."
+)
+clusters.add_argument("--clusters", type=str, nargs="+",
+                      metavar="CONTEXT|NAME=KUBECONFIG",
+                      help="Contexts of the kubeconfig, or other kubeconfig "
+                           "files to use with their current context")
+daemon = parser.add_argument_group(
+    "daemon mode",
+    "Keep running and back up every deployment annotated with a "
+    "backup-runner/schedule on its schedule. store is used for deployments "
+    "without a backup-runner/store annotation. --namespaces, --selector and "
+    "the concurrency limits of batch mode apply."
+)
+daemon.add_argument("-d", "--daemon", action="store_true",
+                    help="Run as a scheduler daemon")
+daemon.add_argument("--node-concurrency", type=int, default=1,
+                    help="Maximum number of backups running at the same time "
+                         "of deployments with pods on the same node")
 
-if __name__ == "__main__":
-    args = parser.parse_args()
-    log = logger.get(__name__)
 
-    log.debug("Backup runner started.")
+def _load_clients(log, cluster_specs: list) -> list:
+    from k8s import clients, informer
+
+    kubeconfig = os.environ.get("KUBECONFIG", "/kube/config")
+    if cluster_specs:
+        names = []
+        for spec in cluster_specs:
+            name, config_file, context = clients.parse_cluster_spec(spec)
+            if name in names:
+                parser.error(f"cluster {name} is given twice")
+            log.debug("Loading cluster %s", name)
+            clients.load(name, config_file=config_file or kubeconfig,
+                         context=context)
+            names.append(name)
+        informer.enable()
+        return names
 
     if os.environ.get("KUBERNETES_PORT"):
         log.debug("Running inside cluster")
-        config.load_incluster_config()
+        clients.load(in_cluster=True)
 
-        with open("/var/run/secrets/kubernetes.io/serviceaccount/token") as f:
+        with open("/var/run/secrets/kubernetes.io/serviceaccount/token") \
+                as f:
             token = f.read()
-            log.debug(f"Using ServiceAccount token {token[:8]}...{token[-8:]}")
+            log.debug("Using ServiceAccount token %s...%s", token[:8],
+                      token[-8:])
     else:
         log.debug("Running outside of cluster")
-        config.load_kube_config("/kube/config")
-
-    api = client.AppsV1Api()
-    try:
-        deployment: V1Deployment = api.read_namespaced_deployment(
-            args.deployment, args.namespace)
-    except ApiException as e:
-        sentry_sdk.capture_exception(e)
-        log.debug(f"Deployment {args.namespace}/{args.deployment} does not "
-                  f"exist or can't be fetched.")
-        exit(1)
+        clients.load(config_file=kubeconfig)
 
-    pvcs = list_pvcs_for_deployment(args.deployment, args.namespace)
-    for pvc in pvcs:
-        log.debug(f"Deployment has PVC {pvc.metadata.name} "
-                  f"provided by {pvc.spec.storage_class_name} "
-                  f"in phase {pvc.status.phase}")
-
-    pods = list_pods_for_deployment(args.deployment, args.namespace)
-    for pod in pods:
-        log.debug(f"Deployment has Pod {pod.metadata.name}")
-
-    update_deployment_scale(args.deployment, args.namespace, 0)
-    wait_for_reconciliation_blocking(
-        lambda xs: len(xs) == 0,
-        timedelta(minutes=1),
-        list_pods_for_deployment,
-        args.deployment,
-        args.namespace
-    )
-    pods = list_pods_for_deployment(args.deployment, args.namespace)
-    log.debug(f"Deployment has {len(pods)} Pods remaining.")
-
-    if args.backup:
-        sidecar_deployment = new_backup_sidecar_deployment_with_volumes(
-            deployment.to_dict(), args.store)
-        sidecar = create_deployment(sidecar_deployment, args.namespace)
-        log.debug(sidecar)
-
-    elif args.snapshot:
-        log.warning("Restore operation is not yet implemented.")
-        pass
-
-    update_deployment_scale(args.deployment, args.namespace, deployment.spec.replicas)
-    wait_for_reconciliation_blocking(
-        lambda xs: len(xs) == 0,
-        timedelta(minutes=1),
-        list_pods_for_deployment,
-        args.deployment,
-        args.namespace
+    informer.enable()
+    return [clients.DEFAULT_CLUSTER]
+
+
+def main():
+    args = parser.parse_args()
+    batch_mode = args.selector or args.namespaces or args.all_namespaces
+    if not (args.daemon or batch_mode) and \
+            not (args.namespace and args.deployment):
+        parser.error("either namespace and deployment or one of --selector, "
+                     "--namespaces and --all-namespaces are required")
+    if args.snapshot and (args.daemon or batch_mode):
+        parser.error("restores need a single namespace and deployment")
+    if args.snapshot and args.clusters and len(args.clusters) > 1:
+        parser.error("restores need a single cluster")
+    if args.rolling and (args.daemon or not batch_mode):
+        parser.error("--rolling needs batch mode without --daemon")
+    if args.max_unavailable < 1:
+        parser.error("--max-unavailable must be at least 1")
+
+    import logger
+    import metrics
+    from k8s import clients
+
+    log = logger.get(__name__)
+    log.debug("Backup runner started.")
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+
+    with metrics.phase("client_init"):
+        cluster_names = _load_clients(log, args.clusters)
+
+    options = dict(
+        backup_timeout=timedelta(minutes=args.backup_timeout),
+        shards=args.shards,
+        volume_snapshots=args.volume_snapshots,
+        snapshot_class=args.snapshot_class,
+        pin_to_attached_node=args.pin_to_attached_node
     )
+    if args.snapshot:
+        from runner.restore import restore_deployment_blocking, \
+            parse_snapshot_spec
+
+        with clients.use(cluster_names[0]):
+            results = [restore_deployment_blocking(
+                args.deployment, args.namespace, args.store,
+                [parse_snapshot_spec(s) for s in args.snapshot],
+                concurrency=args.restore_concurrency,
+                restore_timeout=timedelta(minutes=args.backup_timeout),
+                pin_to_attached_node=args.pin_to_attached_node
+            )]
+        log.info("Restore of %s", results[0])
+    elif args.daemon:
+        from scheduler import Scheduler, run_daemon
+
+        schedulers = [Scheduler(
+            args.store,
+            cluster=cluster,
+            namespaces=None if args.all_namespaces else args.namespaces,
+            selector=args.selector,
+            concurrency=args.concurrency,
+            namespace_concurrency=args.namespace_concurrency,
+            node_concurrency=args.node_concurrency,
+            **options
+        ) for cluster in cluster_names]
+        run_daemon(schedulers, [signal.SIGTERM, signal.SIGINT])
+        exit(0)
+    elif batch_mode or len(cluster_names) > 1:
+        from runner.batch import backup_clusters_blocking, summary
+        from views.deployment import list_deployments
+
+        namespaces = None if args.all_namespaces else args.namespaces
+
+        def _targets():
+            if not batch_mode:  # the same deployment in every cluster
+                return [(args.namespace, args.deployment)]
+            return [(d.metadata.namespace, d.metadata.name)
+                    for d in list_deployments(namespaces, args.selector)]
+
+        results = backup_clusters_blocking(
+            cluster_names, _targets, args.store,
+            concurrency=args.concurrency,
+            namespace_concurrency=args.namespace_concurrency,
+            rolling=args.rolling,
+            max_unavailable=args.max_unavailable,
+            **options
+        )
+        log.info(summary(results))
+    else:
+        from runner import backup_deployment_blocking
+
+        with clients.use(cluster_names[0]):
+            results = [backup_deployment_blocking(
+                args.deployment, args.namespace, args.store, **options)]
+
+    log.debug("API connection stats: %s", clients.stats())
+    if args.metrics_file:
+        metrics.write_textfile(args.metrics_file)
+    if args.pushgateway:
+        try:
+            metrics.push(args.pushgateway)
+        except OSError as e:
+            log.warning(f"Can't push metrics to {args.pushgateway}: {e!r}")
+    if not all(r.succeeded for r in results):
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
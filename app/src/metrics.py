@@ -0,0 +1,316 @@
+import contextlib
+import contextvars
+import math
+import os
+import threading
+import time
+import urllib.request
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import sentry_sdk
+
+__author__ = "Noah Hummel"
+
+
+# seconds, from API round trips up to uploads of large volumes
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+                   120.0, 300.0, 600.0, 1800.0, 3600.0, math.inf)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_phase: contextvars.ContextVar = contextvars.ContextVar("phase",
+                                                        default="none")
+# set by k8s.clients.use, like clients, metrics default to the one cluster
+_cluster: contextvars.ContextVar = contextvars.ContextVar("cluster",
+                                                          default="default")
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n")\
+        .replace('"', r'\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    """A named metric with a fixed set of label names."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str,
+                 labels: Sequence[str]=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], object] = dict()
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name})"
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} has labels {self.labels}, "
+                             f"got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labels)
+
+    def _samples(self) -> Iterator[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, key)} " \
+                  f"{_format_value(value)}"
+
+    def render(self) -> str:
+        with self._lock:
+            samples = list(self._samples())
+        return "\n".join([f"# HELP {self.name} {self.documentation}",
+                          f"# TYPE {self.name} {self.kind}"] + samples)
+
+
+class Counter(_Metric):
+    """A value which only goes up, e.g. the number of API requests."""
+
+    kind = "counter"
+
+    def inc(self, amount: float=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value which goes up and down, e.g. the length of a queue."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Counts observations, e.g. durations, in cumulative buckets.
+
+    Args:
+        name: Name of the metric.
+        documentation: Help text of the metric.
+        labels: Names of the labels each observation is made with.
+        buckets: Upper bounds of the buckets, ending with math.inf.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str,
+                 labels: Sequence[str]=(),
+                 buckets: Sequence[float]=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        if self.buckets[-1] != math.inf:
+            self.buckets += (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def _samples(self) -> Iterator[str]:
+        names = self.labels + ("le",)
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(names, key + (_format_value(bound),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+_registry: List[_Metric] = []
+
+
+PHASE_DURATION = Histogram(
+    "backup_phase_duration_seconds",
+    "Duration of each phase of a backup.",
+    ["phase", "namespace", "cluster"])
+API_REQUESTS = Counter(
+    "backup_api_requests_total",
+    "Requests sent to the Kubernetes API, by the phase sending them.",
+    ["phase", "cluster"])
+API_RETRIES = Counter(
+    "backup_api_retries_total",
+    "Lists, watches and polls repeated while waiting for reconciliation.",
+    ["phase", "reason", "cluster"])
+BACKUP_DURATION = Histogram(
+    "backup_duration_seconds",
+    "Duration of each backup of a deployment.",
+    ["namespace", "result", "cluster"])
+BACKUP_DOWNTIME = Histogram(
+    "backup_downtime_seconds",
+    "Time each deployment was scaled down for its backup.",
+    ["namespace", "cluster"])
+RESTORED_BYTES = Counter(
+    "backup_restored_bytes_total",
+    "Bytes restored from snapshots.",
+    ["namespace", "cluster"])
+SCHEDULER_QUEUE_DEPTH = Gauge(
+    "backup_scheduler_queue_depth",
+    "Backups which are due but wait for a free slot.",
+    ["cluster"])
+SCHEDULER_RUNNING = Gauge(
+    "backup_scheduler_running",
+    "Backups currently running in daemon mode.",
+    ["cluster"])
+SCHEDULER_MAX_LAG = Gauge(
+    "backup_scheduler_max_lag_seconds",
+    "Time the longest waiting due backup has been waiting for a slot.",
+    ["cluster"])
+SCHEDULER_LAG = Histogram(
+    "backup_scheduler_lag_seconds",
+    "Time between a backup being due and being started.",
+    ["namespace", "cluster"])
+
+
+def current_phase() -> str:
+    """Returns the phase the caller runs in, "none" outside of phases."""
+    return _phase.get()
+
+
+def current_cluster() -> str:
+    """Returns the cluster the caller runs against, see cluster."""
+    return _cluster.get()
+
+
+@contextlib.contextmanager
+def cluster(name: str):
+    """Labels the metrics recorded within with the name of a cluster.
+
+    Like phases, the cluster is inherited by run_blocking.
+    """
+    token = _cluster.set(name)
+    try:
+        yield
+    finally:
+        _cluster.reset(token)
+
+
+@contextlib.contextmanager
+def phase(name: str, namespace: str=""):
+    """Times a phase of a backup.
+
+    The duration is observed in PHASE_DURATION even if the phase fails. API
+    requests and retries made within the phase, including those made by
+    run_blocking in other threads, are counted with its name. If Sentry
+    performance monitoring is available, the phase is also recorded as a
+    span of the current transaction.
+
+    Args:
+        name: Name of the phase, e.g. "scale_down".
+        namespace: Namespace of the resources the phase operates on.
+    """
+    token = _phase.set(name)
+    span = sentry_sdk.start_span(op=name) \
+        if hasattr(sentry_sdk, "start_span") else contextlib.nullcontext()
+    start = time.monotonic()
+    try:
+        with span:
+            yield
+    finally:
+        PHASE_DURATION.observe(time.monotonic() - start, phase=name,
+                               namespace=namespace, cluster=_cluster.get())
+        _phase.reset(token)
+
+
+def transaction(name: str):
+    """Groups the phases of a backup into a Sentry transaction.
+
+    Returns:
+        Context manager, which does nothing if the installed sentry_sdk
+        doesn't support performance monitoring.
+    """
+    if hasattr(sentry_sdk, "start_transaction"):
+        return sentry_sdk.start_transaction(op="backup", name=name)
+    return contextlib.nullcontext()
+
+
+def render() -> str:
+    """Renders all metrics in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+def write_textfile(path: str):
+    """Writes all metrics to a file for node_exporter's textfile collector.
+
+    The file is replaced atomically, so the collector never reads a
+    partially written file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(render())
+    os.replace(tmp_path, path)
+
+
+def push(gateway: str, job: str="backup-runner", timeout: float=10.0):
+    """Replaces the metrics of job on a Prometheus Pushgateway.
+
+    Args:
+        gateway: URL of the Pushgateway, e.g. http://pushgateway:9091.
+        job: Job label to group the metrics by.
+        timeout: Seconds before the push is aborted.
+    """
+    request = urllib.request.Request(
+        f"{gateway.rstrip('/')}/metrics/job/{job}",
+        data=render().encode(), method="PUT",
+        headers={"Content-Type": CONTENT_TYPE})
+    with urllib.request.urlopen(request, timeout=timeout):
+        pass
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # scrapes aren't worth logging
+        pass
+
+
+def serve(port: int, address: str="") -> ThreadingHTTPServer:
+    """Serves all metrics on /metrics from a daemon thread.
+
+    Returns:
+        The running server.
+    """
+    server = ThreadingHTTPServer((address, port), _Handler)
+    thread = threading.Thread(target=server.serve_forever,
+                              name="metrics", daemon=True)
+    thread.start()
+    return server
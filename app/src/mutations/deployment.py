@@ -1,16 +1,29 @@
-from kubernetes import client
-from kubernetes.client import V1Deployment
+import sentry_sdk
+from kubernetes.client.rest import ApiException
 
 from typing import Dict
 
 import logger
+from k8s import clients
 
 __author__ = "Noah Hummel"
 log = logger.get(__name__)
 
 
-def create_deployment(body: Dict, namespace: str) -> V1Deployment:
-    log.debug(f"Creating Deployment {namespace}/{body['metadata']['name']}: "
-              f"{body}")
-    api = client.AppsV1Api()
-    return api.create_namespaced_deployment(namespace, body)
+def annotate_deployment(name: str, namespace: str,
+                        annotations: Dict[str, str]):
+    """Sets annotations of a Deployment, keeping its other annotations.
+
+    Args:
+        name: Name of the Deployment.
+        namespace: Namespace of the Deployment.
+        annotations: Annotations to set.
+    """
+    try:
+        api = clients.apps()
+        api.patch_namespaced_deployment(
+            name, namespace, {"metadata": {"annotations": annotations}})
+        log.debug("Annotated Deployment %s/%s with %s",
+                  namespace, name, annotations)
+    except ApiException as e:
+        sentry_sdk.capture_exception(e)
@@ -0,0 +1,29 @@
+import sentry_sdk
+from kubernetes.client import V1Job, V1DeleteOptions
+from kubernetes.client.rest import ApiException
+
+from typing import Dict
+
+import logger
+from k8s import clients
+
+__author__ = "Noah Hummel"
+log = logger.get(__name__)
+
+
+def create_job(body: Dict, namespace: str) -> V1Job:
+    log.debug("Creating Job %s/%s", namespace, body["metadata"]["name"])
+    api = clients.batch()
+    return api.create_namespaced_job(namespace, body)
+
+
+def delete_job(name: str, namespace: str):
+    """Deletes a Job together with its Pods."""
+    try:
+        api = clients.batch()
+        api.delete_namespaced_job(
+            name, namespace,
+            V1DeleteOptions(propagation_policy="Background"))
+        log.debug("Deleted Job %s/%s", namespace, name)
+    except ApiException as e:
+        sentry_sdk.capture_exception(e)
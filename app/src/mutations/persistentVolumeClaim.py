@@ -0,0 +1,28 @@
+import sentry_sdk
+from kubernetes.client import V1PersistentVolumeClaim, V1DeleteOptions
+from kubernetes.client.rest import ApiException
+
+from typing import Dict
+
+import logger
+from k8s import clients
+
+__author__ = "Noah Hummel"
+log = logger.get(__name__)
+
+
+def create_pvc(body: Dict, namespace: str) -> V1PersistentVolumeClaim:
+    log.debug("Creating PVC %s/%s", namespace, body["metadata"]["name"])
+    api = clients.core()
+    return api.create_namespaced_persistent_volume_claim(namespace, body)
+
+
+def delete_pvc(name: str, namespace: str):
+    try:
+        api = clients.core()
+        api.delete_namespaced_persistent_volume_claim(name, namespace,
+                                                      V1DeleteOptions())
+        log.debug("Deleted PVC %s/%s", namespace, name)
+    except ApiException as e:
+        if e.status != 404:
+            sentry_sdk.capture_exception(e)
@@ -3,13 +3,15 @@ import asyncio
 from datetime import timedelta
 
 import sentry_sdk
-from kubernetes import client
 from kubernetes.client.rest import ApiException
 
 import logger
-from k8s import wait_for_reconciliation
+from k8s import clients, wait_for_reconciliation
+from k8s.executor import run_blocking
 from k8s.predicate import deployment_has_scale
+from k8s.schedule import SCALE_WAIT
 from mutations.exceptions import ReconciliationError
+from views.deployment import get_deployment
 from views.scale import get_scale_for_deployment
 
 __author__ = "Noah Hummel"
@@ -27,13 +29,13 @@ def update_deployment_scale(name: str, namespace: str, replicas: int):
         replicas: Desired number of replicas.
     """
     try:
-        api = client.AppsV1Api()
+        api = clients.apps()
         current_scale = api.read_namespaced_deployment_scale(name, namespace)
         current_scale.spec.replicas = replicas
         new_scale = api.patch_namespaced_deployment_scale(name, namespace,
                                                           current_scale)
-        log.debug(f"Updated deployment {namespace}/{name} spec to "
-                  f"{new_scale.spec.replicas} replicas")
+        log.debug("Updated deployment %s/%s spec to %s replicas",
+                  namespace, name, new_scale.spec.replicas)
     except ApiException as e:
         sentry_sdk.capture_exception(e)
 
@@ -52,23 +54,25 @@ async def scale_deployment(name: str, namespace: str, replicas: int,
         ReconciliationError:
             The cluster state did not reconcile within timeout.
     """
-    previous_replicas = get_scale_for_deployment(name, namespace)
-    update_deployment_scale(name, namespace, replicas)
+    previous_replicas = await run_blocking(get_scale_for_deployment, name,
+                                           namespace)
+    await run_blocking(update_deployment_scale, name, namespace, replicas)
 
     try:
-        api = client.AppsV1Api()
         predicate = deployment_has_scale(replicas)
         await wait_for_reconciliation(
             predicate,
             timeout,
-            api.read_namespaced_deployment,
+            get_deployment,
             name,
-            namespace
+            namespace,
+            schedule=SCALE_WAIT
         )
     except ReconciliationError:
         log.warning(f"Deployment {namespace}/{name} could not be scaled to "
                     f"{replicas}, reverting to {previous_replicas}.")
-        update_deployment_scale(name, namespace, previous_replicas)
+        await run_blocking(update_deployment_scale, name, namespace,
+                           previous_replicas)
 
 
 def scale_deployment_blocking(name: str, namespace: str, replicas: int,
@@ -0,0 +1,31 @@
+import sentry_sdk
+from kubernetes.client import V1DeleteOptions
+from kubernetes.client.rest import ApiException
+
+from typing import Dict
+
+import logger
+from k8s import clients
+from k8s.resource.volumeSnapshot import GROUP, VERSION, PLURAL
+
+__author__ = "Noah Hummel"
+log = logger.get(__name__)
+
+
+def create_volume_snapshot(body: Dict, namespace: str) -> Dict:
+    log.debug("Creating VolumeSnapshot %s/%s", namespace,
+              body["metadata"]["name"])
+    api = clients.custom()
+    return api.create_namespaced_custom_object(GROUP, VERSION, namespace,
+                                               PLURAL, body)
+
+
+def delete_volume_snapshot(name: str, namespace: str):
+    try:
+        api = clients.custom()
+        api.delete_namespaced_custom_object(GROUP, VERSION, namespace, PLURAL,
+                                            name, V1DeleteOptions())
+        log.debug("Deleted VolumeSnapshot %s/%s", namespace, name)
+    except ApiException as e:
+        if e.status != 404:
+            sentry_sdk.capture_exception(e)
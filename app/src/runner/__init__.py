@@ -0,0 +1,504 @@
+import asyncio
+import time
+
+from collections import Counter
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+import sentry_sdk
+from kubernetes.client import V1Deployment
+
+import logger
+import metrics
+from k8s import clients, wait_for_reconciliation
+from k8s.executor import run_blocking
+from k8s.predicate import deployment_has_scale, job_is_finished, \
+    job_has_succeeded, job_has_failed
+from k8s.resource.deployment import replace_claims, remove_claims, \
+    mount_claims, get_claim_names
+from k8s.resource.persistentVolumeClaim import get_capacity
+from k8s.schedule import SCALE_WAIT, POD_TERMINATION_WAIT, JOB_WAIT
+from mutations.exceptions import ReconciliationError
+from mutations.job import create_job, delete_job
+from mutations.scale import update_deployment_scale
+from runner.attachment import release_volumes
+from runner.placement import place_sidecars
+from runner.snapshot import ClaimSnapshots, SnapshotError, SNAPSHOT_TIMEOUT
+from sidecar_deploy import new_backup_sidecar_jobs_with_volumes, \
+    get_restic_host, list_sidecar_claims
+from views.deployment import get_deployment
+from views.job import get_job
+from views.persistentVolumeClaim import list_pvcs_for_deployment
+from views.pod import list_pods_for_deployment, list_pods_for_job
+
+__author__ = "Noah Hummel"
+log = logger.get(__name__)
+
+
+SCALE_TIMEOUT = timedelta(minutes=1)
+BACKUP_TIMEOUT = timedelta(hours=6)
+# time the Pods of a timed out Job may take to terminate once it's deleted
+JOB_DELETION_TIMEOUT = timedelta(minutes=2)
+
+
+class BackupError(Exception):
+    pass
+
+
+class BackupResult:
+    """Outcome of backing up a single Deployment.
+
+    Attributes:
+        namespace: Namespace of the Deployment.
+        name: Name of the Deployment.
+        error: The error which aborted the backup, None if it succeeded.
+        duration: Wall time of the backup in seconds.
+        cluster: Name of the cluster of the Deployment.
+        skipped:
+            Why the Deployment wasn't backed up, e.g. because it has no
+            volumes, None if it was. Skipped backups count as succeeded.
+    """
+
+    def __init__(self, namespace: str, name: str,
+                 error: Optional[Exception]=None, duration: float=0.0,
+                 cluster: str=clients.DEFAULT_CLUSTER,
+                 skipped: Optional[str]=None):
+        self.namespace = namespace
+        self.name = name
+        self.error = error
+        self.duration = duration
+        self.cluster = cluster
+        self.skipped = skipped
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+    def __str__(self):
+        if not self.succeeded:
+            status = f"failed ({self.error!r})"
+        elif self.skipped:
+            status = f"skipped ({self.skipped})"
+        else:
+            status = "ok"
+        cluster = "" if self.cluster == clients.DEFAULT_CLUSTER \
+            else f"{self.cluster}:"
+        return f"{cluster}{self.namespace}/{self.name}: {status} " \
+               f"after {self.duration:.1f}s"
+
+
+async def run_backup_job(job: Dict, namespace: str,
+                         timeout: timedelta=BACKUP_TIMEOUT,
+                         phase: str="backup", delete: bool=True):
+    """Creates a backup Job and waits until it finished.
+
+    Successful Jobs are deleted unless delete is False, failed Jobs are kept
+    for inspection. A Job which doesn't finish within timeout is deleted,
+    and this waits until its Pods are gone, so restic doesn't keep using
+    the volumes once the Deployment is scaled back up.
+
+    Args:
+        job: The Job as Dict.
+        namespace: Namespace to run the Job in.
+        timeout: Time to wait for the Job to finish.
+        phase: Name of the metrics phase the wait is timed as.
+        delete: Whether to delete the Job if it succeeded.
+
+    Raises:
+        BackupError: If the Job failed.
+        ReconciliationError: If the Job didn't finish within timeout.
+    """
+    name = job["metadata"]["name"]
+    with metrics.phase("create_sidecar", namespace):
+        await run_blocking(create_job, job, namespace)
+    with metrics.phase(phase, namespace):
+        try:
+            await wait_for_reconciliation(
+                job_is_finished,
+                timeout,
+                get_job,
+                name,
+                namespace,
+                schedule=JOB_WAIT
+            )
+        except ReconciliationError:
+            log.warning(f"Job {namespace}/{name} didn't finish within "
+                        f"{timeout}, deleting it.")
+            await stop_job(name, namespace)
+            raise
+        finished = await run_blocking(get_job, name, namespace)
+    if not job_has_succeeded(finished):
+        raise BackupError(f"Job {namespace}/{name} failed.")
+    if delete:
+        with metrics.phase("delete_sidecar", namespace):
+            await run_blocking(delete_job, name, namespace)
+
+
+async def stop_job(name: str, namespace: str,
+                   timeout: timedelta=JOB_DELETION_TIMEOUT):
+    """Deletes a Job and waits until its Pods are gone.
+
+    Errors are logged instead of raised, the caller is already failing.
+    """
+    with metrics.phase("delete_sidecar", namespace):
+        await run_blocking(delete_job, name, namespace)
+        try:
+            await wait_for_reconciliation(
+                lambda xs: xs is not None and len(xs) == 0,
+                timeout,
+                list_pods_for_job,
+                name,
+                namespace,
+                schedule=POD_TERMINATION_WAIT
+            )
+        except ReconciliationError as e:
+            log.error(f"Pods of Job {namespace}/{name} are still running "
+                      f"after {timeout}: {e!r}")
+
+
+async def run_backup_jobs(jobs: List[Dict], namespace: str,
+                          timeout: timedelta=BACKUP_TIMEOUT):
+    """Runs backup Jobs in parallel and waits until all of them finished.
+
+    Args:
+        jobs: The Jobs as Dict.
+        namespace: Namespace to run the Jobs in.
+        timeout: Time to wait for each Job to finish.
+
+    Raises:
+        BackupError: If any Job failed.
+        ReconciliationError: If any Job didn't finish within timeout.
+    """
+    # every Job is waited for before raising and timed out Jobs are stopped,
+    # so no Job is still mounting the volumes once the Deployment is scaled
+    # back up
+    results = await asyncio.gather(
+        *[run_backup_job(job, namespace, timeout) for job in jobs],
+        return_exceptions=True)
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        if len(errors) > 1:
+            log.warning(f"{len(errors)}/{len(jobs)} backup Jobs in "
+                        f"{namespace} failed: {errors!r}")
+        raise errors[0]
+
+
+async def backup_deployment(name: str, namespace: str, store: str,
+                            timeout: timedelta=SCALE_TIMEOUT,
+                            backup_timeout: timedelta=BACKUP_TIMEOUT,
+                            shards: int=1, volume_snapshots: bool=False,
+                            snapshot_class: str=None,
+                            snapshot_timeout: timedelta=SNAPSHOT_TIMEOUT,
+                            pin_to_attached_node: bool=True) -> BackupResult:
+    """Performs an offline backup of a Deployment.
+
+    The Deployment is scaled to 0, backup Jobs mounting its volumes are
+    created once all of its Pods are gone and the Deployment is scaled back
+    to its previous replicas as soon as the Jobs finished, even if the backup
+    failed. With more than one shard, the volumes are split across up to
+    shards Jobs of about equal PVC capacity, which back up in parallel.
+
+    With volume_snapshots, the Deployment is only scaled to 0 until a CSI
+    VolumeSnapshot of each of its PVCs is ready to use. The Jobs then back up
+    PVCs cloned from the snapshots while the Deployment is running again.
+    Clones and snapshots are deleted afterwards.
+
+    Otherwise, the Jobs are only created once the volumes of the Deployment
+    were detached from their nodes, or pinned to the node their volumes are
+    still attached to, see runner.attachment.release_volumes.
+
+    Jobs are scheduled close to the volumes they back up and prefer the
+    nodes the Deployment ran on, see runner.placement.place_sidecars.
+    They keep restic's cache between runs if SIDECAR_CACHE is set, see
+    sidecar_deploy.cache.add_cache, and tag their snapshots with a hostname
+    derived from the Deployment, see sidecar_deploy.get_restic_host.
+
+    Args:
+        name: Name of the Deployment.
+        namespace: Namespace of the Deployment.
+        store: Name of the secret with information about the backup location.
+        timeout: Time to wait for each scale operation to reconcile.
+        backup_timeout: Time to wait for the backup Jobs to finish.
+        shards: Maximum number of parallel backup Jobs.
+        volume_snapshots: Back up from CSI VolumeSnapshots of the PVCs.
+        snapshot_class: Name of the VolumeSnapshotClass to use.
+        snapshot_timeout: Time to wait for the VolumeSnapshots to be ready.
+        pin_to_attached_node:
+            Whether backup Jobs may be pinned to the node their volumes are
+            still attached to.
+
+    Returns:
+        The outcome of the backup, errors are reported instead of raised.
+    """
+    results = await backup_group([name], namespace, store, timeout,
+                                 backup_timeout, shards, volume_snapshots,
+                                 snapshot_class, snapshot_timeout,
+                                 pin_to_attached_node)
+    return results[0]
+
+
+async def backup_group(names: List[str], namespace: str, store: str,
+                       timeout: timedelta=SCALE_TIMEOUT,
+                       backup_timeout: timedelta=BACKUP_TIMEOUT,
+                       shards: int=1, volume_snapshots: bool=False,
+                       snapshot_class: str=None,
+                       snapshot_timeout: timedelta=SNAPSHOT_TIMEOUT,
+                       pin_to_attached_node: bool=True) -> List[BackupResult]:
+    """Performs an offline backup of Deployments in a single downtime.
+
+    Like backup_deployment, but all Deployments are scaled to 0 together
+    and only scaled back up once the backup of all of them finished. PVCs
+    mounted by more than one of the Deployments, e.g. a shared
+    ReadWriteMany volume, are backed up once, by Jobs of their own: each
+    PVC is mounted at the canonical mountPath of the PVC's name and the
+    snapshots are tagged with the namespace as hostname, so they don't
+    depend on which Deployments share the PVC. See runner.shared for how
+    Deployments are grouped.
+
+    Args:
+        names: Names of the Deployments.
+        namespace: Namespace of the Deployments.
+        store: Name of the secret with information about the backup location.
+        timeout: Time to wait for each scale operation to reconcile.
+        backup_timeout: Time to wait for the backup Jobs to finish.
+        shards:
+            Maximum number of parallel backup Jobs of each Deployment, and
+            of the shared PVCs.
+        volume_snapshots: Back up from CSI VolumeSnapshots of the PVCs.
+        snapshot_class: Name of the VolumeSnapshotClass to use.
+        snapshot_timeout: Time to wait for the VolumeSnapshots to be ready.
+        pin_to_attached_node:
+            Whether backup Jobs may be pinned to the node their volumes are
+            still attached to.
+
+    Returns:
+        The outcome of the backup of each Deployment, in the order of names.
+        All of them share the same error, errors are reported instead of
+        raised. Deployments without volumes to back up are skipped.
+    """
+    start = time.monotonic()
+    label = f"{namespace}/{'+'.join(names)}"
+    error = None
+    skipped = None
+    with metrics.transaction(f"backup {label}"), \
+            logger.context(namespace=namespace, deployment=",".join(names)):
+        try:
+            skipped = await _backup_group(
+                names, namespace, store, timeout, backup_timeout, shards,
+                volume_snapshots, snapshot_class, snapshot_timeout,
+                pin_to_attached_node)
+        except (BackupError, SnapshotError, ReconciliationError) as e:
+            log.warning(f"Backup of {label} failed: {e!r}")
+            error = e
+        except Exception as e:
+            sentry_sdk.capture_exception(e)
+            log.warning(f"Backup of {label} failed: {e!r}")
+            error = e
+
+    duration = time.monotonic() - start
+    results = [BackupResult(namespace, name, error, duration,
+                            cluster=clients.current(), skipped=skipped)
+               for name in names]
+    for result in results:
+        if not result.succeeded:
+            outcome = "failed"
+        else:
+            outcome = "skipped" if result.skipped else "succeeded"
+        metrics.BACKUP_DURATION.observe(
+            result.duration, namespace=namespace, result=outcome,
+            cluster=result.cluster)
+    return results
+
+
+async def _scale_up(deployments: List[V1Deployment], namespace: str,
+                    timeout: timedelta):
+    """Scales Deployments back to their previous replicas.
+
+    Every Deployment is scaled up, even if scaling up another one failed.
+
+    Raises:
+        ReconciliationError:
+            If any Deployment didn't reach its scale within timeout.
+    """
+    async def _scale(name: str, replicas: int):
+        await run_blocking(update_deployment_scale, name, namespace,
+                           replicas)
+        await wait_for_reconciliation(
+            deployment_has_scale(replicas),
+            timeout,
+            get_deployment,
+            name,
+            namespace,
+            schedule=SCALE_WAIT
+        )
+
+    await _gather(*[_scale(deployment.metadata.name, deployment.spec.replicas)
+                    for deployment in deployments])
+
+
+async def _gather(*awaitables) -> List:
+    """Awaits all awaitables, then raises the first error, if any."""
+    results = await asyncio.gather(*awaitables, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+async def _backup_group(names: List[str], namespace: str, store: str,
+                        timeout: timedelta, backup_timeout: timedelta,
+                        shards: int, volume_snapshots: bool,
+                        snapshot_class: Optional[str],
+                        snapshot_timeout: timedelta,
+                        pin_to_attached_node: bool) -> Optional[str]:
+    """Backs up a group of Deployments, see backup_group.
+
+    Returns:
+        Why the Deployments were skipped, None if they were backed up.
+    """
+    with metrics.phase("read_deployment", namespace):
+        deployments: List[V1Deployment] = await asyncio.gather(
+            *[run_blocking(get_deployment, name, namespace)
+              for name in names])
+    for name, deployment in zip(names, deployments):
+        if deployment is None:
+            raise BackupError(f"Deployment {namespace}/{name} does not "
+                              f"exist or can't be fetched.")
+
+    with metrics.phase("resolve_pvcs", namespace):
+        deployment_pvcs = await asyncio.gather(
+            *[run_blocking(list_pvcs_for_deployment, name, namespace)
+              for name in names])
+    pvcs = dict()
+    mounts = Counter()
+    for pvc in [pvc for each in deployment_pvcs for pvc in each or []]:
+        log.debug("Deployment has PVC %s provided by %s in phase %s",
+                  pvc.metadata.name, pvc.spec.storage_class_name,
+                  pvc.status.phase)
+        pvcs[pvc.metadata.name] = pvc
+        mounts[pvc.metadata.name] += 1
+    claim_sizes = {claim: get_capacity(pvc) or 0
+                   for claim, pvc in pvcs.items()}
+    shared = [claim for claim in pvcs if mounts[claim] > 1]
+
+    # (volumes to back up, Deployment to place by, restic host) of the Jobs
+    # of each Deployment and of the shared PVCs, if any
+    sources = [deployment.to_dict() for deployment in deployments]
+    parts = [(remove_claims(source, shared), source,
+              get_restic_host(namespace, name))
+             for name, source in zip(names, sources)]
+    if shared:
+        log.debug("PVCs shared by %s: %s", names, shared)
+        parts.append((mount_claims(sources[0], shared), sources[0],
+                      get_restic_host(namespace)))
+    if volume_snapshots:
+        # a PVC which couldn't be resolved has no clone, its Job would back
+        # up the live PVC while the Deployment is running again
+        missing = sorted({claim for source in sources
+                          for claim in get_claim_names(source)} - set(pvcs))
+        if missing:
+            raise BackupError(f"PVCs {', '.join(missing)} of Deployment "
+                              f"{namespace}/{'+'.join(names)} can't be "
+                              f"fetched, they can't be snapshotted.")
+        snapshots = ClaimSnapshots(list(pvcs.values()), namespace,
+                                   snapshot_class)
+        parts = [(replace_claims(volumes, snapshots.names), source, host)
+                 for volumes, source, host in parts]
+        claim_sizes = {snapshots.names[claim]: size
+                       for claim, size in claim_sizes.items()}
+    part_jobs = [new_backup_sidecar_jobs_with_volumes(
+        volumes, store, claim_sizes, shards, host=host)
+        for volumes, _, host in parts]
+    jobs = [job for each in part_jobs for job in each]
+    if not jobs:
+        # e.g. a stateless Deployment matched by a label selector
+        log.info("Skipping %s/%s, it has no volumes to back up.",
+                 namespace, "+".join(names))
+        return "no volumes to back up"
+
+    with metrics.phase("placement", namespace):
+        pods = await asyncio.gather(
+            *[run_blocking(list_pods_for_deployment, name, namespace)
+              for name in names])
+        nodes = [{pod.spec.node_name for pod in each or []
+                  if pod.spec.node_name} for each in pods]
+        # the shared PVCs were attached to the nodes of any of them
+        nodes.append(set().union(*nodes))
+        for (_, source, _), each_jobs, part_nodes in zip(
+                parts, part_jobs, nodes):
+            # clones of the snapshots don't have volumes to be placed near
+            await place_sidecars(
+                each_jobs, source,
+                [] if volume_snapshots else list(pvcs.values()), part_nodes)
+
+    kept_clones = []
+    try:
+        with metrics.phase("scale_down", namespace):
+            await asyncio.gather(
+                *[run_blocking(update_deployment_scale, name, namespace, 0)
+                  for name in names])
+        scaled_down = time.monotonic()
+        try:
+            with metrics.phase("pod_termination", namespace):
+                await _gather(*[wait_for_reconciliation(
+                    lambda xs: len(xs) == 0,
+                    timeout,
+                    list_pods_for_deployment,
+                    name,
+                    namespace,
+                    schedule=POD_TERMINATION_WAIT
+                ) for name in names])
+            if volume_snapshots:
+                with metrics.phase("snapshot", namespace):
+                    await snapshots.snapshot(snapshot_timeout)
+            else:
+                with metrics.phase("volume_release", namespace):
+                    await release_volumes(jobs, list(pvcs.values()),
+                                          pin_to_attached_node)
+                await run_backup_jobs(jobs, namespace, backup_timeout)
+        finally:
+            with metrics.phase("scale_up", namespace):
+                await _scale_up(deployments, namespace, timeout)
+            downtime = time.monotonic() - scaled_down
+            for _ in names:
+                metrics.BACKUP_DOWNTIME.observe(
+                    downtime, namespace=namespace,
+                    cluster=metrics.current_cluster())
+
+        if volume_snapshots:
+            with metrics.phase("clone", namespace):
+                await snapshots.clone()
+            try:
+                await run_backup_jobs(jobs, namespace, backup_timeout)
+            except BackupError:
+                # failed Jobs are kept for inspection, so are their clones
+                kept_clones = await _list_failed_job_claims(jobs, namespace)
+                if kept_clones:
+                    log.warning(f"Keeping PVCs {', '.join(kept_clones)} "
+                                f"mounted by failed backup Jobs in "
+                                f"{namespace}, delete them along with the "
+                                f"Jobs.")
+                raise
+    finally:
+        if volume_snapshots:
+            with metrics.phase("cleanup", namespace):
+                await snapshots.delete(keep=kept_clones)
+
+
+async def _list_failed_job_claims(jobs: List[Dict],
+                                  namespace: str) -> List[str]:
+    """Returns the PVCs mounted by those of jobs which failed."""
+    finished = await asyncio.gather(
+        *[run_blocking(get_job, job["metadata"]["name"], namespace)
+          for job in jobs])
+    return [claim for job, each in zip(jobs, finished)
+            if each is not None and job_has_failed(each)
+            for claim in list_sidecar_claims(job)]
+
+
+def backup_deployment_blocking(name: str, namespace: str, store: str,
+                               timeout: timedelta=SCALE_TIMEOUT,
+                               **options) -> BackupResult:
+    """Performs an offline backup of a Deployment, see backup_deployment."""
+    return asyncio.run(backup_deployment(name, namespace, store, timeout,
+                                         **options))
@@ -0,0 +1,99 @@
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, List
+
+from kubernetes.client import V1PersistentVolumeClaim
+
+import logger
+from k8s import wait_for_reconciliation
+from k8s.executor import run_blocking
+from k8s.predicate import volumes_are_detached
+from k8s.resource.affinity import require_node
+from k8s.resource.persistentVolumeClaim import is_single_node
+from k8s.resource.volumeAttachment import get_persistent_volume_name, \
+    get_node_name, is_attached
+from k8s.schedule import DETACH_WAIT
+from mutations.exceptions import ReconciliationError
+from sidecar_deploy import list_sidecar_claims
+from views.volumeAttachment import list_volume_attachments
+
+__author__ = "Noah Hummel"
+log = logger.get(__name__)
+
+
+# the attach/detach controller force detaches volumes after 6 minutes
+RELEASE_TIMEOUT = timedelta(minutes=6)
+
+
+async def release_volumes(jobs: List[Dict],
+                          pvcs: List[V1PersistentVolumeClaim],
+                          pin: bool=True,
+                          timeout: timedelta=RELEASE_TIMEOUT):
+    """Waits until the volumes of each Job can be attached to its Pod.
+
+    Once the Pods of a Deployment are gone, their volumes still have to be
+    detached from the old node, and a Pod using a ReadWriteOnce volume on
+    another node waits with Multi-Attach errors until then. If pin is True
+    and all volumes of a Job still attached are attached to the same node,
+    the Job is pinned to that node instead, where it can use them right
+    away.
+    Otherwise this waits until the volumes of the Job are detached. If they
+    aren't detached within timeout, the Jobs are started anyway.
+    ReadWriteMany and ReadOnlyMany volumes can be attached to several nodes
+    at once, so they are neither waited for nor pinned to.
+
+    Args:
+        jobs: The Jobs as Dict, pinned Jobs are modified in place.
+        pvcs: The PVCs mounted by the Jobs.
+        pin: Whether Jobs may be pinned to the node of their volumes.
+        timeout: Time to wait for the volumes to be detached.
+    """
+    volume_names = {pvc.metadata.name: pvc.spec.volume_name for pvc in pvcs
+                    if pvc.spec.volume_name and is_single_node(pvc)}
+    if not volume_names:
+        return
+    attachments = await run_blocking(list_volume_attachments,
+                                     list(volume_names.values()))
+    if attachments is None:
+        log.warning("Can't list VolumeAttachments, starting Jobs without "
+                    "waiting for their volumes to be detached.")
+        return
+
+    by_volume = defaultdict(list)
+    for attachment in attachments:
+        by_volume[get_persistent_volume_name(attachment)].append(attachment)
+
+    detaching = []
+    for job in jobs:
+        job_volumes = [volume_names[claim]
+                       for claim in list_sidecar_claims(job)
+                       if claim in volume_names]
+        job_attachments = [a for volume in job_volumes
+                           for a in by_volume[volume]]
+        if not job_attachments:
+            continue
+
+        # volumes being detached can be attached to any node afterwards
+        nodes = {get_node_name(a) for a in job_attachments if is_attached(a)}
+        if pin and len(nodes) == 1:
+            node = nodes.pop()
+            log.debug("Pinning %s to %s, where its volumes are still "
+                      "attached", job["metadata"]["name"], node)
+            require_node(job["spec"]["template"]["spec"], node)
+        else:
+            detaching.extend(job_volumes)
+
+    if not detaching:
+        return
+    log.debug("Waiting for volumes to be detached: %s", detaching)
+    try:
+        await wait_for_reconciliation(
+            volumes_are_detached,
+            timeout,
+            list_volume_attachments,
+            detaching,
+            schedule=DETACH_WAIT
+        )
+    except ReconciliationError:
+        log.warning(f"Volumes weren't detached within {timeout}, starting "
+                    f"Jobs anyway: {detaching}")
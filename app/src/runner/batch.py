@@ -0,0 +1,212 @@
+import asyncio
+
+from collections import defaultdict
+from datetime import timedelta
+from typing import Callable, List, Tuple, Dict
+
+import logger
+from k8s import clients
+from k8s.executor import run_blocking
+from mutations.exceptions import ReconciliationError
+from runner import backup_group, BackupError, BackupResult
+from runner.rolling import list_rolling_groups, wait_until_available, \
+    AVAILABLE_TIMEOUT
+from runner.shared import list_claim_groups
+
+__author__ = "Noah Hummel"
+log = logger.get(__name__)
+
+
+async def backup_deployments(targets: List[Tuple[str, str]], store: str,
+                             concurrency: int=4,
+                             namespace_concurrency: int=1,
+                             rolling: str=None, max_unavailable: int=1,
+                             available_timeout: timedelta=AVAILABLE_TIMEOUT,
+                             **options) -> List[BackupResult]:
+    """Backs up many Deployments with bounded concurrency.
+
+    Every Deployment goes through the steps of runner.backup_deployment on
+    its own, so a slow Deployment only holds up its own slot. Deployments
+    mounting the same PVCs are backed up together by runner.backup_group
+    instead, in a single downtime and a single slot, so every PVC is only
+    backed up once per run, see runner.shared.
+
+    With rolling, Deployments in the same namespace with the same value of
+    the rolling label, e.g. the shards of a database, are backed up as a
+    rolling group: at most max_unavailable of them are taken offline at a
+    time, and the next one is only started once a finished one is available
+    again. After a failure, the rest of its group is skipped, so a group
+    never has more than max_unavailable Deployments down. Deployments
+    sharing PVCs count as one Deployment of the rolling group of the first
+    of them.
+
+    Args:
+        targets: (namespace, name) of each Deployment to back up.
+        store: Name of the secret with information about the backup location.
+        concurrency: Maximum number of backups running at the same time.
+        namespace_concurrency:
+            Maximum number of backups running at the same time in any single
+            namespace.
+        rolling: Label grouping the Deployments into rolling groups.
+        max_unavailable:
+            Maximum number of Deployments of a rolling group backed up at
+            the same time.
+        available_timeout:
+            Time to wait for a Deployment of a rolling group to become
+            available again after its backup.
+        **options:
+            Keyword args for runner.backup_deployment, e.g. backup_timeout.
+
+    Returns:
+        The outcome of each backup, in the order of targets.
+    """
+    slots = asyncio.Semaphore(concurrency)
+    namespace_slots: Dict[str, asyncio.Semaphore] = defaultdict(
+        lambda: asyncio.Semaphore(namespace_concurrency))
+    claim_groups = await run_blocking(list_claim_groups, targets)
+
+    async def _backup(namespace: str, names: List[str]) \
+            -> List[BackupResult]:
+        async with namespace_slots[namespace]:
+            async with slots:
+                log.debug("Starting backup of %s/%s", namespace,
+                          "+".join(names))
+                return await backup_group(names, namespace, store, **options)
+
+    if not rolling:
+        outcomes = await asyncio.gather(
+            *[_backup(group[0][0], [name for _, name in group])
+              for group in claim_groups])
+        return _in_order(outcomes, targets)
+
+    groups = await run_blocking(list_rolling_groups, targets, rolling)
+    group_slots: Dict[Tuple[str, str], asyncio.Semaphore] = defaultdict(
+        lambda: asyncio.Semaphore(max_unavailable))
+    # the Deployment whose failure halted each group
+    halted: Dict[Tuple[str, str], str] = dict()
+
+    async def _backup_rolling(namespace: str, names: List[str]) \
+            -> List[BackupResult]:
+        group = groups[(namespace, names[0])]
+        async with group_slots[group]:
+            if group in halted:
+                return [BackupResult(namespace, name, BackupError(
+                    f"Skipped, the rolling backup of {group[1]} halted "
+                    f"after {halted[group]} failed."),
+                    cluster=clients.current()) for name in names]
+            results = await _backup(namespace, names)
+            for result in results:
+                # skipped Deployments weren't scaled down
+                if not result.succeeded or result.skipped:
+                    continue
+                try:
+                    await wait_until_available(result.name, namespace,
+                                               available_timeout)
+                except ReconciliationError as e:
+                    log.warning(f"Deployment {namespace}/{result.name} did "
+                                f"not become available within "
+                                f"{available_timeout}: {e!r}")
+                    result.error = e
+            for result in results:
+                if not result.succeeded:
+                    halted.setdefault(group, f"{namespace}/{result.name}")
+            return results
+
+    outcomes = await asyncio.gather(
+        *[_backup_rolling(group[0][0], [name for _, name in group])
+          for group in claim_groups])
+    return _in_order(outcomes, targets)
+
+
+def _in_order(outcomes: List[List[BackupResult]],
+              targets: List[Tuple[str, str]]) -> List[BackupResult]:
+    # the results of each group of Deployments sharing PVCs, by target
+    results = {(result.namespace, result.name): result
+               for group_results in outcomes for result in group_results}
+    return [results[target] for target in targets]
+
+
+def backup_deployments_blocking(targets: List[Tuple[str, str]], store: str,
+                                concurrency: int=4,
+                                namespace_concurrency: int=1,
+                                **options) -> List[BackupResult]:
+    """Backs up many Deployments, see backup_deployments."""
+    return asyncio.run(backup_deployments(targets, store, concurrency,
+                                          namespace_concurrency, **options))
+
+
+async def backup_clusters(clusters: List[str],
+                          list_targets: Callable[[], List[Tuple[str, str]]],
+                          store: str, concurrency: int=4,
+                          namespace_concurrency: int=1,
+                          **options) -> List[BackupResult]:
+    """Backs up Deployments in several clusters at the same time.
+
+    Each cluster is backed up by backup_deployments with its own concurrency
+    limits, on top of its own clients, thread pools and rate limit, so a
+    slow cluster only holds up its own backups.
+
+    Args:
+        clusters: Names of the loaded clusters to back up.
+        list_targets:
+            Blocking function returning the (namespace, name) of each
+            Deployment to back up in the current cluster, see clients.use.
+        store: Name of the secret with information about the backup location.
+        concurrency:
+            Maximum number of backups running at the same time in any single
+            cluster.
+        namespace_concurrency:
+            Maximum number of backups running at the same time in any single
+            namespace.
+        **options:
+            Keyword args for runner.backup_deployment, e.g. backup_timeout.
+
+    Returns:
+        The outcome of each backup, grouped by cluster in the order of
+        clusters.
+    """
+    async def _backup_cluster(cluster: str) -> List[BackupResult]:
+        with clients.use(cluster):
+            targets = await run_blocking(list_targets)
+            log.debug("Backing up %d deployments in %s.", len(targets),
+                      cluster)
+            return await backup_deployments(targets, store, concurrency,
+                                            namespace_concurrency, **options)
+
+    results = await asyncio.gather(*[_backup_cluster(cluster)
+                                     for cluster in clusters])
+    return [result for cluster_results in results
+            for result in cluster_results]
+
+
+def backup_clusters_blocking(clusters: List[str],
+                             list_targets: Callable[[],
+                                                    List[Tuple[str, str]]],
+                             store: str, concurrency: int=4,
+                             namespace_concurrency: int=1,
+                             **options) -> List[BackupResult]:
+    """Backs up Deployments in several clusters, see backup_clusters."""
+    return asyncio.run(backup_clusters(clusters, list_targets, store,
+                                       concurrency, namespace_concurrency,
+                                       **options))
+
+
+def summary(results: List[BackupResult]) -> str:
+    """Renders a human readable summary of a batch run.
+
+    Runs across several clusters are summarized per cluster as well.
+    """
+    failed = [r for r in results if not r.succeeded]
+    skipped = [r for r in results if r.succeeded and r.skipped]
+    lines = [str(r) for r in results]
+    clusters = sorted({r.cluster for r in results})
+    if len(clusters) > 1:
+        for cluster in clusters:
+            cluster_results = [r for r in results if r.cluster == cluster]
+            succeeded = sum(r.succeeded for r in cluster_results)
+            lines.append(f"{cluster}: {succeeded}/{len(cluster_results)} "
+                         f"backups succeeded.")
+    lines.append(f"{len(results) - len(failed)}/{len(results)} backups "
+                 f"succeeded" + (f", {len(skipped)} skipped." if skipped
+                                 else "."))
+    return "\n".join(lines)
@@ -0,0 +1,57 @@
+from typing import Dict, Iterable, List
+
+from kubernetes.client import V1PersistentVolumeClaim
+
+import logger
+from k8s.executor import run_blocking
+from k8s.resource import camel_case
+from k8s.resource.affinity import get_volume_node_selector_terms, \
+    require_terms, prefer_nodes, tolerate
+from k8s.resource.deployment import get_tolerations
+from sidecar_deploy import list_sidecar_claims
+from views.persistentVolume import list_persistent_volumes
+
+__author__ = "Noah Hummel"
+log = logger.get(__name__)
+
+
+async def place_sidecars(sidecars: List[Dict], deployment: Dict,
+                         pvcs: List[V1PersistentVolumeClaim],
+                         nodes: Iterable[str]):
+    """Schedules sidecars close to the volumes they mount.
+
+    Each sidecar is restricted to the nodes the PersistentVolumes of its
+    PVCs can be used on, by their nodeAffinity or zone labels, so it isn't
+    scheduled into a zone its volumes can't be attached in. It tolerates
+    the taints the Pods of the Deployment tolerate, so it can run on the
+    same dedicated nodes, and prefers the nodes the Pods ran on, where its
+    volumes were attached last.
+
+    Args:
+        sidecars: The sidecar Jobs as Dict, modified in place.
+        deployment: The Deployment the volumes belong to, as dict.
+        pvcs: The PVCs mounted by the sidecars, PVCs which aren't bound yet
+            don't restrict the sidecars.
+        nodes: Names of the nodes the Pods of the Deployment ran on.
+    """
+    volume_names = {pvc.metadata.name: pvc.spec.volume_name for pvc in pvcs
+                    if pvc.spec.volume_name}
+    volumes = await run_blocking(list_persistent_volumes,
+                                 list(volume_names.values()))
+    tolerations = get_tolerations(deployment, convert=camel_case)
+    nodes = set(nodes)
+
+    for sidecar in sidecars:
+        pod_spec = sidecar["spec"]["template"]["spec"]
+        for claim in list_sidecar_claims(sidecar):
+            pv = volumes.get(volume_names.get(claim))
+            if pv is None:
+                continue
+            terms = get_volume_node_selector_terms(pv)
+            if terms:
+                log.debug("%s requires nodes of volume %s: %s",
+                          sidecar["metadata"]["name"], pv.metadata.name,
+                          terms)
+            require_terms(pod_spec, terms)
+        tolerate(pod_spec, tolerations)
+        prefer_nodes(pod_spec, nodes)
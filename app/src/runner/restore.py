@@ -0,0 +1,358 @@
+import asyncio
+import json
+import time
+
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+import sentry_sdk
+from kubernetes.client import V1Deployment
+
+import logger
+import metrics
+from k8s import clients, wait_for_reconciliation
+from k8s.executor import run_blocking
+from k8s.predicate import deployment_has_scale
+from k8s.resource.deployment import get_volumes
+from k8s.schedule import SCALE_WAIT, POD_TERMINATION_WAIT
+from mutations.exceptions import ReconciliationError
+from mutations.job import delete_job
+from mutations.scale import update_deployment_scale
+from runner import BackupError, BackupResult, run_backup_job, \
+    SCALE_TIMEOUT, BACKUP_TIMEOUT
+from runner.attachment import release_volumes
+from runner.placement import place_sidecars
+from runner.shared import list_shared_claims
+from sidecar_deploy import new_restore_sidecar_jobs_with_volumes, \
+    list_backup_volumes
+from views.deployment import get_deployment
+from views.job import read_job_log
+from views.persistentVolumeClaim import list_pvcs_for_deployment
+from views.pod import list_pods_for_deployment
+
+__author__ = "Noah Hummel"
+log = logger.get(__name__)
+
+
+RESTORE_TIMEOUT = BACKUP_TIMEOUT
+
+# a snapshot to restore and the volumes to restore from it, None for all
+SnapshotSpec = Tuple[str, Optional[List[str]]]
+
+
+class RestoreError(BackupError):
+    pass
+
+
+class VolumeRestore:
+    """Outcome of restoring a single volume.
+
+    Attributes:
+        volume: Name of the volume.
+        snapshot: ID of the restic snapshot restored from.
+        size: Bytes restored, None if restic didn't report them.
+        duration: Wall time of the restore in seconds.
+    """
+
+    def __init__(self, volume: str, snapshot: str, size: Optional[int],
+                 duration: float):
+        self.volume = volume
+        self.snapshot = snapshot
+        self.size = size
+        self.duration = duration
+
+    @property
+    def throughput(self) -> Optional[float]:
+        """Bytes restored per second, None if unknown."""
+        if self.size is None or self.duration <= 0:
+            return None
+        return self.size / self.duration
+
+    def __str__(self):
+        if self.size is None:
+            return f"{self.volume} from {self.snapshot} " \
+                   f"in {self.duration:.1f}s"
+        return f"{self.volume} from {self.snapshot}: " \
+               f"{self.size / 2 ** 20:.1f} MiB in {self.duration:.1f}s " \
+               f"({self.throughput / 2 ** 20:.1f} MiB/s)"
+
+
+class RestoreResult(BackupResult):
+    """Outcome of restoring a Deployment, see BackupResult.
+
+    Attributes:
+        volumes: Outcome of each volume restored successfully.
+    """
+
+    def __init__(self, namespace: str, name: str,
+                 error: Optional[Exception]=None, duration: float=0.0,
+                 cluster: str=clients.DEFAULT_CLUSTER):
+        super().__init__(namespace, name, error, duration, cluster)
+        self.volumes: List[VolumeRestore] = []
+
+
+def parse_snapshot_spec(text: str) -> SnapshotSpec:
+    """Parses "SNAPSHOT" or "SNAPSHOT:VOLUME[,VOLUME...]"."""
+    snapshot, _, volumes = text.partition(":")
+    return snapshot, volumes.split(",") if volumes else None
+
+
+def plan_restore(snapshots: List[SnapshotSpec], volumes: List[str]) \
+        -> List[Tuple[str, str]]:
+    """Assigns each volume to restore to the snapshot to restore it from.
+
+    A snapshot without volumes restores every volume, which is only allowed
+    if it's the only snapshot.
+
+    Args:
+        snapshots: The snapshots and the volumes to restore from each.
+        volumes: Names of the volumes of the Deployment.
+
+    Raises:
+        RestoreError: If a volume doesn't exist or is restored twice.
+
+    Returns:
+        (snapshot, volume) for every volume to restore.
+    """
+    plan: Dict[str, str] = dict()
+    for snapshot, snapshot_volumes in snapshots:
+        if snapshot_volumes is None:
+            if len(snapshots) > 1:
+                raise RestoreError(f"Snapshot {snapshot} must name the "
+                                   f"volumes to restore from it, e.g. "
+                                   f"{snapshot}:{','.join(volumes[:2])}")
+            snapshot_volumes = volumes
+        for volume in snapshot_volumes:
+            if volume not in volumes:
+                raise RestoreError(f"Deployment has no volume {volume}, "
+                                   f"volumes are: {', '.join(volumes)}")
+            if volume in plan:
+                raise RestoreError(f"Volume {volume} is restored from both "
+                                   f"{plan[volume]} and {snapshot}")
+            plan[volume] = snapshot
+    return [(snapshot, volume) for volume, snapshot in plan.items()]
+
+
+def restic_summary(restic_log: Optional[str]) -> Optional[Dict]:
+    """Reads the JSON summary of restic restore, None if there is none."""
+    for line in reversed((restic_log or "").splitlines()):
+        try:
+            message = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(message, dict) and \
+                message.get("message_type") == "summary":
+            return message
+    return None
+
+
+def restored_bytes(restic_log: Optional[str]) -> Optional[int]:
+    """Reads the bytes restored from the JSON summary of restic restore."""
+    summary = restic_summary(restic_log)
+    if summary is None:
+        return None
+    return summary.get("bytes_restored", summary.get("total_bytes"))
+
+
+async def _restore_volume(job: Dict, snapshot: str, volume: str,
+                          namespace: str, timeout: timedelta,
+                          fallback: Optional[Dict]=None) -> VolumeRestore:
+    """Runs the restore Job of a volume.
+
+    Args:
+        job: The restore Job as Dict.
+        snapshot: ID of the restic snapshot restored from.
+        volume: Name of the volume.
+        namespace: Namespace to run the Job in.
+        timeout: Time to wait for the Job to finish.
+        fallback: Restore Job to run instead if job failed or restored
+            nothing, e.g. one looking for the snapshot under another host.
+
+    Raises:
+        BackupError: If the Job, and the fallback, failed.
+        ReconciliationError: If a Job didn't finish within timeout.
+    """
+    try:
+        return await _run_restore(job, snapshot, volume, namespace, timeout)
+    except BackupError as e:
+        if fallback is None:
+            raise
+        log.info("Restoring volume %s from %s failed, retrying with %s: %r",
+                 volume, snapshot, fallback["metadata"]["name"], e)
+        if not isinstance(e, RestoreError):
+            # the failed Job is kept otherwise
+            await run_blocking(delete_job, job["metadata"]["name"],
+                               namespace)
+    return await _run_restore(fallback, snapshot, volume, namespace, timeout)
+
+
+async def _run_restore(job: Dict, snapshot: str, volume: str,
+                       namespace: str, timeout: timedelta) -> VolumeRestore:
+    name = job["metadata"]["name"]
+    start = time.monotonic()
+    await run_backup_job(job, namespace, timeout, phase="restore",
+                         delete=False)
+    duration = time.monotonic() - start
+    restic_log = await run_blocking(read_job_log, name, namespace)
+    await run_blocking(delete_job, name, namespace)
+
+    # restic succeeds if the includes match nothing in the snapshot, e.g. if
+    # it's a snapshot of another volume. Files skipped because they are
+    # unchanged count towards total_bytes, bytes_restored is 0 for those.
+    summary = restic_summary(restic_log)
+    if summary is not None and \
+            summary.get("total_bytes", summary.get("bytes_restored")) == 0:
+        raise RestoreError(f"Restoring volume {volume} from {snapshot} "
+                           f"restored nothing, the snapshot has no files "
+                           f"of the volume.")
+    restored = VolumeRestore(volume, snapshot, restored_bytes(restic_log),
+                             duration)
+    if restored.size is not None:
+        metrics.RESTORED_BYTES.inc(restored.size, namespace=namespace,
+                                   cluster=metrics.current_cluster())
+    return restored
+
+
+async def restore_deployment(name: str, namespace: str, store: str,
+                             snapshots: List[SnapshotSpec],
+                             concurrency: int=4,
+                             timeout: timedelta=SCALE_TIMEOUT,
+                             restore_timeout: timedelta=RESTORE_TIMEOUT,
+                             pin_to_attached_node: bool=True) \
+        -> RestoreResult:
+    """Restores the volumes of a Deployment from restic snapshots.
+
+    The Deployment is scaled to 0 and a restore Job is created for each
+    volume once all of its Pods are gone and its volumes were released, see
+    runner.attachment.release_volumes. Up to concurrency volumes are
+    restored in parallel. Once every Job finished, the Deployment is scaled
+    back to its previous replicas, even if the restore failed.
+
+    Args:
+        name: Name of the Deployment.
+        namespace: Namespace of the Deployment.
+        store: Name of the secret with information about the backup location.
+        snapshots: The snapshots and the volumes to restore from each.
+        concurrency: Maximum number of volumes restored at the same time.
+        timeout: Time to wait for each scale operation to reconcile.
+        restore_timeout: Time to wait for each restore Job to finish.
+        pin_to_attached_node:
+            Whether restore Jobs may be pinned to the node their volumes are
+            still attached to.
+
+    Returns:
+        The outcome of the restore, errors are reported instead of raised.
+    """
+    with logger.context(namespace=namespace, deployment=name):
+        return await _restore_deployment(name, namespace, store, snapshots,
+                                         concurrency, timeout,
+                                         restore_timeout,
+                                         pin_to_attached_node)
+
+
+async def _restore_deployment(name: str, namespace: str, store: str,
+                              snapshots: List[SnapshotSpec],
+                              concurrency: int, timeout: timedelta,
+                              restore_timeout: timedelta,
+                              pin_to_attached_node: bool) -> RestoreResult:
+    start = time.monotonic()
+    result = RestoreResult(namespace, name, cluster=clients.current())
+    try:
+        deployment: V1Deployment = await run_blocking(get_deployment, name,
+                                                      namespace)
+        if deployment is None:
+            raise RestoreError(f"Deployment {namespace}/{name} does not "
+                               f"exist or can't be fetched.")
+
+        source = deployment.to_dict()
+        plan = plan_restore(snapshots, list_backup_volumes(source))
+        if not plan:
+            raise RestoreError(f"Deployment {namespace}/{name} has no "
+                               f"volumes to restore.")
+        shared = await run_blocking(list_shared_claims, name, namespace)
+        jobs = new_restore_sidecar_jobs_with_volumes(
+            source, store, plan, shared_claims=shared)
+        # whether the latest snapshot of a shared PVC is found under the
+        # namespace's host depends on whether the Deployments sharing it
+        # were backed up together, it's looked up under the Deployment's own
+        # host otherwise
+        own_jobs = new_restore_sidecar_jobs_with_volumes(source, store, plan)
+        claims = dict()
+        for volume in get_volumes(source):
+            if volume.get("persistent_volume_claim"):
+                claims[volume["name"]] = \
+                    volume["persistent_volume_claim"]["claim_name"]
+        fallbacks = [own_job if snapshot == "latest" and
+                     claims.get(volume) in shared else None
+                     for own_job, (snapshot, volume) in zip(own_jobs, plan)]
+        all_jobs = jobs + [f for f in fallbacks if f]
+        pvcs = await run_blocking(list_pvcs_for_deployment, name, namespace)
+        pods = await run_blocking(list_pods_for_deployment, name, namespace)
+        await place_sidecars(all_jobs, source, pvcs or [],
+                             {pod.spec.node_name for pod in pods or []
+                              if pod.spec.node_name})
+
+        slots = asyncio.Semaphore(concurrency)
+
+        async def _restore(job: Dict, snapshot: str, volume: str,
+                           fallback: Optional[Dict]):
+            async with slots:
+                restored = await _restore_volume(job, snapshot, volume,
+                                                 namespace, restore_timeout,
+                                                 fallback)
+            result.volumes.append(restored)
+            log.info("Restored %s/%s volume %s (%d/%d)", namespace, name,
+                     restored, len(result.volumes), len(plan))
+
+        await run_blocking(update_deployment_scale, name, namespace, 0)
+        try:
+            await wait_for_reconciliation(
+                lambda xs: len(xs) == 0,
+                timeout,
+                list_pods_for_deployment,
+                name,
+                namespace,
+                schedule=POD_TERMINATION_WAIT
+            )
+            await release_volumes(all_jobs, pvcs or [], pin_to_attached_node)
+            # every Job is waited for before raising and timed out Jobs are
+            # stopped by run_backup_job, so no Job is still writing to the
+            # volumes once the Deployment is scaled back up
+            outcomes = await asyncio.gather(
+                *[_restore(job, snapshot, volume, fallback)
+                  for job, (snapshot, volume), fallback
+                  in zip(jobs, plan, fallbacks)],
+                return_exceptions=True)
+            errors = [e for e in outcomes if isinstance(e, BaseException)]
+            if errors:
+                raise errors[0]
+        finally:
+            replicas = deployment.spec.replicas
+            await run_blocking(update_deployment_scale, name, namespace,
+                               replicas)
+            await wait_for_reconciliation(
+                deployment_has_scale(replicas),
+                timeout,
+                get_deployment,
+                name,
+                namespace,
+                schedule=SCALE_WAIT
+            )
+    except (BackupError, ReconciliationError) as e:
+        log.warning(f"Restore of {namespace}/{name} failed: {e!r}")
+        result.error = e
+    except Exception as e:
+        sentry_sdk.capture_exception(e)
+        log.warning(f"Restore of {namespace}/{name} failed: {e!r}")
+        result.error = e
+
+    result.duration = time.monotonic() - start
+    return result
+
+
+def restore_deployment_blocking(name: str, namespace: str, store: str,
+                                snapshots: List[SnapshotSpec],
+                                **options) -> RestoreResult:
+    """Restores the volumes of a Deployment, see restore_deployment."""
+    return asyncio.run(restore_deployment(name, namespace, store, snapshots,
+                                          **options))
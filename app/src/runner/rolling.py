@@ -0,0 +1,75 @@
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+from kubernetes.client import V1Deployment
+
+import logger
+import metrics
+from k8s import wait_for_reconciliation
+from k8s.predicate import deployment_is_available
+from k8s.schedule import AVAILABLE_WAIT
+from views.deployment import get_deployment
+
+__author__ = "Noah Hummel"
+log = logger.get(__name__)
+
+
+# time a Deployment may take to become available again after its backup
+AVAILABLE_TIMEOUT = timedelta(minutes=10)
+
+Target = Tuple[str, str]
+
+
+def get_rolling_group(deployment: Optional[V1Deployment], namespace: str,
+                      name: str, label: str) -> Target:
+    """Returns the rolling group of a Deployment.
+
+    Deployments in the same namespace with the same value of label, e.g.
+    the shards of a database, form a group. Deployments without the label
+    form a group of their own.
+
+    Returns:
+        The namespace and label value, or name, identifying the group.
+    """
+    labels = deployment.metadata.labels if deployment else None
+    value = (labels or dict()).get(label)
+    return (namespace, f"{label}={value}") if value is not None \
+        else (namespace, name)
+
+
+def list_rolling_groups(targets: List[Target], label: str) \
+        -> Dict[Target, Target]:
+    """Maps the (namespace, name) of each target to its rolling group.
+
+    See get_rolling_group.
+    """
+    groups = dict()
+    for namespace, name in targets:
+        deployment = get_deployment(name, namespace)
+        groups[(namespace, name)] = get_rolling_group(deployment, namespace,
+                                                      name, label)
+    return groups
+
+
+async def wait_until_available(name: str, namespace: str,
+                               timeout: timedelta=AVAILABLE_TIMEOUT):
+    """Waits until all replicas of a Deployment are available.
+
+    Scaling up only waits for the Pods to exist, a rolling backup waits
+    until they are ready before taking the next Deployment of the group
+    offline.
+
+    Raises:
+        ReconciliationError:
+            If the Deployment isn't available within timeout.
+    """
+    with metrics.phase("availability", namespace):
+        await wait_for_reconciliation(
+            deployment_is_available,
+            timeout,
+            get_deployment,
+            name,
+            namespace,
+            schedule=AVAILABLE_WAIT
+        )
+    log.debug("Deployment %s/%s is available again", namespace, name)
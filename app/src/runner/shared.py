@@ -0,0 +1,96 @@
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import logger
+from views.deployment import list_deployments
+from views.volume import list_volumes_for_deployment
+
+__author__ = "Noah Hummel"
+log = logger.get(__name__)
+
+
+Target = Tuple[str, str]
+
+
+def list_claims(targets: List[Target]) -> Dict[Target, List[str]]:
+    """Maps the (namespace, name) of each target to the PVCs it mounts.
+
+    Only the Deployments are read, the PVCs themselves are resolved by each
+    backup. Deployments which can't be fetched mount no PVCs.
+    """
+    claims = dict()
+    for namespace, name in targets:
+        volumes = list_volumes_for_deployment(name, namespace) or []
+        claims[(namespace, name)] = [
+            volume.persistent_volume_claim.claim_name for volume in volumes
+            if volume.persistent_volume_claim is not None]
+    return claims
+
+
+def group_by_claims(claims: Dict[Target, List[str]]) -> List[List[Target]]:
+    """Groups Deployments which mount the same PVCs.
+
+    Deployments are nodes of a graph in which two Deployments are connected
+    if they mount the same PVC, e.g. a shared ReadWriteMany volume. Each
+    connected component is a group, which is backed up in a single scale
+    down window, so every PVC is backed up once, see runner.backup_group.
+
+    Args:
+        claims: The PVCs of each Deployment by (namespace, name).
+
+    Returns:
+        The groups of Deployments in the order of claims, each group in the
+        order of claims as well. Deployments which don't share PVCs form a
+        group of their own.
+    """
+    # union-find over the Deployments, PVCs are namespaced
+    parents: Dict[Target, Target] = {target: target for target in claims}
+
+    def _root(target: Target) -> Target:
+        while parents[target] != target:
+            parents[target] = parents[parents[target]]
+            target = parents[target]
+        return target
+
+    mounted_by: Dict[Tuple[str, str], Target] = dict()
+    for target, target_claims in claims.items():
+        for claim in target_claims:
+            key = (target[0], claim)
+            if key in mounted_by:
+                parents[_root(target)] = _root(mounted_by[key])
+            else:
+                mounted_by[key] = target
+
+    groups: Dict[Target, List[Target]] = dict()
+    for target in claims:
+        groups.setdefault(_root(target), []).append(target)
+    for group in groups.values():
+        if len(group) > 1:
+            log.info("Backing up %s together, they share PVCs",
+                     ", ".join(f"{n}/{d}" for n, d in group))
+    return list(groups.values())
+
+
+def list_claim_groups(targets: List[Target]) -> List[List[Target]]:
+    """Groups the targets by the PVCs they mount, see group_by_claims."""
+    return group_by_claims(list_claims(targets))
+
+
+def list_shared_claims(name: str, namespace: str) -> List[str]:
+    """Returns the PVCs a Deployment shares with others of its namespace.
+
+    Deployments sharing PVCs are backed up together, see group_by_claims, so
+    their snapshots of these PVCs are found under the restic host of the
+    namespace, see sidecar_deploy.get_restic_host.
+    """
+    mounts = Counter()
+    claims = []
+    for deployment in list_deployments([namespace]):
+        volumes = deployment.spec.template.spec.volumes or []
+        deployment_claims = {volume.persistent_volume_claim.claim_name
+                             for volume in volumes
+                             if volume.persistent_volume_claim is not None}
+        mounts.update(deployment_claims)
+        if deployment.metadata.name == name:
+            claims = deployment_claims
+    return sorted(claim for claim in claims if mounts[claim] > 1)
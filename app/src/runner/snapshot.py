@@ -0,0 +1,129 @@
+import asyncio
+import os
+
+from datetime import timedelta
+from typing import Collection, Dict, List
+
+from kubernetes.client import V1PersistentVolumeClaim
+
+import logger
+from k8s import wait_for_reconciliation
+from k8s.executor import run_blocking
+from k8s.predicate import volume_snapshot_is_settled
+from k8s.resource.volumeSnapshot import new_volume_snapshot, \
+    new_pvc_from_snapshot, get_error
+from k8s.schedule import SNAPSHOT_WAIT
+from mutations.persistentVolumeClaim import create_pvc, delete_pvc
+from mutations.volumeSnapshot import create_volume_snapshot, \
+    delete_volume_snapshot
+from views.volumeSnapshot import get_volume_snapshot
+
+__author__ = "Noah Hummel"
+log = logger.get(__name__)
+
+
+SNAPSHOT_TIMEOUT = timedelta(minutes=10)
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class ClaimSnapshots:
+    """CSI VolumeSnapshots of a Deployment's PVCs and their clones.
+
+    Names of the snapshots and clones are fixed up front, so the backup Jobs
+    reading from the clones can be generated before any of them exist. Each
+    clone is named like its snapshot. Everything created is tracked, so
+    delete cleans up after partial failures, too.
+
+    Args:
+        pvcs: The PVCs to snapshot.
+        namespace: Namespace of the PVCs.
+        snapshot_class: Name of the VolumeSnapshotClass to use.
+    """
+
+    def __init__(self, pvcs: List[V1PersistentVolumeClaim], namespace: str,
+                 snapshot_class: str=None):
+        self.pvcs = pvcs
+        self.namespace = namespace
+        self.snapshot_class = snapshot_class
+        suffix = os.urandom(4).hex()
+        # PVC names are DNS subdomains of at most 253 characters
+        self.names: Dict[str, str] = {
+            pvc.metadata.name: f"{pvc.metadata.name[:243]}-{suffix}"
+            for pvc in pvcs}
+        self._snapshots: List[str] = []
+        self._clones: List[str] = []
+
+    def __repr__(self):
+        return f"ClaimSnapshots({self.namespace}, {list(self.names)})"
+
+    async def _snapshot(self, pvc: V1PersistentVolumeClaim,
+                        timeout: timedelta):
+        name = self.names[pvc.metadata.name]
+        body = new_volume_snapshot(name, pvc, self.snapshot_class)
+        await run_blocking(create_volume_snapshot, body, self.namespace)
+        self._snapshots.append(name)
+        await wait_for_reconciliation(
+            volume_snapshot_is_settled,
+            timeout,
+            get_volume_snapshot,
+            name,
+            self.namespace,
+            schedule=SNAPSHOT_WAIT
+        )
+        snapshot = await run_blocking(get_volume_snapshot, name,
+                                      self.namespace)
+        error = get_error(snapshot)
+        if error:
+            raise SnapshotError(f"VolumeSnapshot {self.namespace}/{name} "
+                                f"failed: {error}")
+        log.debug("VolumeSnapshot %s/%s of PVC %s is ready",
+                  self.namespace, name, pvc.metadata.name)
+
+    async def snapshot(self, timeout: timedelta=SNAPSHOT_TIMEOUT):
+        """Snapshots all PVCs and waits until the snapshots are ready to use.
+
+        Raises:
+            SnapshotError: If any snapshot failed.
+            ReconciliationError: If any snapshot wasn't ready within timeout.
+        """
+        await _gather([self._snapshot(pvc, timeout) for pvc in self.pvcs])
+
+    async def _clone(self, pvc: V1PersistentVolumeClaim):
+        name = self.names[pvc.metadata.name]
+        body = new_pvc_from_snapshot(name, pvc, name)
+        await run_blocking(create_pvc, body, self.namespace)
+        self._clones.append(name)
+
+    async def clone(self):
+        """Creates a PVC from each snapshot.
+
+        The clones are bound once the backup Jobs mounting them are scheduled,
+        so this doesn't wait for them.
+        """
+        await _gather([self._clone(pvc) for pvc in self.pvcs])
+
+    async def delete(self, keep: Collection[str]=()):
+        """Deletes all clones and snapshots created so far.
+
+        Args:
+            keep: Names of clones to keep, e.g. those of failed Jobs.
+        """
+        await asyncio.gather(
+            *[run_blocking(delete_pvc, name, self.namespace)
+              for name in self._clones if name not in keep],
+            *[run_blocking(delete_volume_snapshot, name, self.namespace)
+              for name in self._snapshots])
+        self._clones.clear()
+        self._snapshots.clear()
+
+
+async def _gather(coroutines: list):
+    # lets every coroutine finish, so all created objects are tracked before
+    # the first error is raised
+    results = await asyncio.gather(*coroutines, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
@@ -0,0 +1,468 @@
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import sentry_sdk
+from kubernetes.client import V1Deployment
+
+import logger
+import metrics
+from k8s import clients
+from k8s.executor import run_blocking
+from k8s.informer import WATCH_TIMEOUT, RETRY_INTERVAL
+from k8s.watch import stream_events, WatchExpired
+from mutations.deployment import annotate_deployment
+from runner import backup_deployment, BackupResult
+from scheduler.cron import Schedule, ScheduleFormatError, parse_schedule, \
+    IntervalSchedule
+from views.pod import list_pods_for_deployment
+
+__author__ = "Noah Hummel"
+log = logger.get(__name__)
+
+
+ANNOTATION_PREFIX = os.environ.get("BACKUP_ANNOTATION_PREFIX",
+                                   "backup-runner")
+# cron expression, alias like "@daily" or interval like "@every 6h"
+SCHEDULE_ANNOTATION = f"{ANNOTATION_PREFIX}/schedule"
+# name of the secret with information about the backup location
+STORE_ANNOTATION = f"{ANNOTATION_PREFIX}/store"
+# due backups with higher priority are started first, defaults to 0
+PRIORITY_ANNOTATION = f"{ANNOTATION_PREFIX}/priority"
+# ISO 8601 time of the last successful backup, set by the scheduler
+LAST_BACKUP_ANNOTATION = f"{ANNOTATION_PREFIX}/last-backup"
+
+Key = Tuple[str, str]
+
+
+class BackupSpec:
+    """Backup configuration of a Deployment, read from its annotations.
+
+    Attributes:
+        namespace: Namespace of the Deployment.
+        name: Name of the Deployment.
+        schedule: When the Deployment is due for a backup.
+        store: Name of the secret with information about the backup location.
+        priority: Due backups with higher priority are started first.
+        last_backup:
+            Time of the last successful backup, None if it's unknown.
+    """
+
+    def __init__(self, namespace: str, name: str, schedule: Schedule,
+                 store: str, priority: int=0,
+                 last_backup: Optional[datetime]=None):
+        self.namespace = namespace
+        self.name = name
+        self.schedule = schedule
+        self.store = store
+        self.priority = priority
+        self.last_backup = last_backup
+
+    def __repr__(self):
+        return f"BackupSpec({self.namespace}/{self.name}, {self.schedule}, " \
+               f"store={self.store}, priority={self.priority})"
+
+    @property
+    def key(self) -> Key:
+        return self.namespace, self.name
+
+    def first_due(self, now: datetime) -> datetime:
+        """Returns when the Deployment is due once it's scheduled.
+
+        The schedule continues from the last backup, so restarts of the
+        scheduler don't postpone backups, and backups missed while it was
+        down are due right away. Interval schedules without a known last
+        backup are due right away as well, cron schedules at their next
+        time.
+        """
+        if self.last_backup is not None:
+            return self.schedule.next_after(self.last_backup)
+        if isinstance(self.schedule, IntervalSchedule):
+            return now
+        return self.schedule.next_after(now)
+
+
+def get_backup_spec(deployment: V1Deployment, default_store: str) \
+        -> Optional[BackupSpec]:
+    """Reads the backup configuration from a Deployment's annotations.
+
+    Args:
+        deployment: The Deployment.
+        default_store: Store of Deployments without a store annotation.
+
+    Raises:
+        ScheduleFormatError: If the schedule annotation is invalid.
+        ValueError: If the priority annotation isn't an integer.
+
+    Returns:
+        The configuration, None if the Deployment has no schedule annotation.
+    """
+    annotations = deployment.metadata.annotations or dict()
+    if SCHEDULE_ANNOTATION not in annotations:
+        return None
+    return BackupSpec(
+        deployment.metadata.namespace,
+        deployment.metadata.name,
+        parse_schedule(annotations[SCHEDULE_ANNOTATION]),
+        annotations.get(STORE_ANNOTATION, default_store),
+        int(annotations.get(PRIORITY_ANNOTATION, 0)),
+        _parse_time(annotations.get(LAST_BACKUP_ANNOTATION))
+    )
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _parse_time(text: Optional[str]) -> Optional[datetime]:
+    # the last backup only anchors the schedule, an unreadable one is
+    # treated like a missing one instead of unscheduling the Deployment
+    if text is None:
+        return None
+    try:
+        t = datetime.fromisoformat(text)
+    except ValueError:
+        log.warning(f"Ignoring invalid {LAST_BACKUP_ANNOTATION} {text!r}")
+        return None
+    return t if t.tzinfo else t.replace(tzinfo=timezone.utc)
+
+
+class Scheduler:
+    """Backs up annotated Deployments on their schedules.
+
+    Deployments are discovered through a watch, so changes to their
+    annotations take effect immediately. Each Deployment waits in a queue
+    ordered by due time until it's due, then in a queue ordered by priority
+    until a slot is free. A backup takes a slot globally, in its namespace
+    and on every node its Pods run on, which spreads out backups of many
+    Deployments due at the same time. After a backup, the Deployment is
+    queued again for its next due time.
+
+    Args:
+        default_store: Store of Deployments without a store annotation.
+        cluster: Name of the loaded cluster to back up Deployments in.
+        namespaces: Namespaces to back up Deployments in, None for all.
+        selector: Label selector the Deployments must match.
+        concurrency: Maximum number of backups running at the same time.
+        namespace_concurrency:
+            Maximum number of backups running at the same time in any single
+            namespace.
+        node_concurrency:
+            Maximum number of backups of Deployments with Pods on the same
+            node running at the same time.
+        **options: Keyword args for runner.backup_deployment.
+    """
+
+    def __init__(self, default_store: str,
+                 cluster: str=clients.DEFAULT_CLUSTER,
+                 namespaces: List[str]=None, selector: str=None,
+                 concurrency: int=4, namespace_concurrency: int=1,
+                 node_concurrency: int=1, **options):
+        self.default_store = default_store
+        self.cluster = cluster
+        self.namespaces = namespaces
+        self.selector = selector
+        self.concurrency = concurrency
+        self.namespace_concurrency = namespace_concurrency
+        self.node_concurrency = node_concurrency
+        self.options = options
+
+        self._specs: Dict[Key, BackupSpec] = dict()
+        # next due time of every Deployment which isn't running
+        self._due: Dict[Key, datetime] = dict()
+        self._upcoming: List[Tuple[datetime, int, Key]] = []
+        self._ready: List[Tuple[int, datetime, int, Key]] = []
+        self._running: Dict[Key, Set[str]] = dict()
+        self._running_namespaces: Counter = Counter()
+        self._running_nodes: Counter = Counter()
+        self._tasks: Set[asyncio.Task] = set()
+        self._sequence = itertools.count()
+        self._stopped = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    def __repr__(self):
+        return f"Scheduler({self.cluster}: {len(self._specs)} deployments, " \
+               f"{len(self._running)} running)"
+
+    # updates from the watch, called on the event loop
+
+    def _sync(self, namespace: Optional[str], deployments: List):
+        """Replaces all specs in namespace, or all specs if it's None."""
+        keys = {(d.metadata.namespace, d.metadata.name) for d in deployments}
+        for key in list(self._specs):
+            if (namespace is None or key[0] == namespace) and \
+                    key not in keys:
+                self._remove(key)
+        for deployment in deployments:
+            self._update(deployment)
+
+    def _update(self, deployment: V1Deployment):
+        key = (deployment.metadata.namespace, deployment.metadata.name)
+        try:
+            spec = get_backup_spec(deployment, self.default_store)
+            due = spec.first_due(_now()) if spec else None
+        except (ScheduleFormatError, ValueError) as e:
+            log.warning(f"Invalid backup annotations on {key[0]}/{key[1]}: "
+                        f"{e}")
+            spec = None
+        if spec is None:
+            self._remove(key)
+            return
+
+        previous = self._specs.get(key)
+        self._specs[key] = spec
+        if previous is None:
+            log.debug("Scheduling %s, next backup at %s", spec, due)
+        elif previous.schedule != spec.schedule:
+            log.debug("Rescheduling %s, next backup at %s", spec, due)
+        elif previous.priority != spec.priority and key in self._due:
+            due = self._due[key]  # keep its place, but with the new priority
+        else:
+            return
+        if key not in self._running:
+            self._queue(key, due)
+
+    def _remove(self, key: Key):
+        if self._specs.pop(key, None) is not None:
+            log.debug("Unscheduling %s/%s", *key)
+        self._due.pop(key, None)
+        self._wakeup()
+
+    # queues
+
+    def _queue(self, key: Key, due: datetime):
+        self._due[key] = due
+        heapq.heappush(self._upcoming, (due, next(self._sequence), key))
+        if due <= _now():
+            self._make_ready(key, due)
+        self._wakeup()
+
+    def _make_ready(self, key: Key, due: datetime):
+        priority = self._specs[key].priority
+        heapq.heappush(self._ready,
+                       (-priority, due, next(self._sequence), key))
+
+    def _is_current(self, key: Key, due: datetime, priority: int=None) \
+            -> bool:
+        # queue entries are invalidated lazily by changing a Deployment's
+        # due time or priority instead of removing them from the heaps
+        if self._due.get(key) != due or key in self._running:
+            return False
+        return priority is None or self._specs[key].priority == priority
+
+    def _promote(self, now: datetime):
+        """Moves Deployments which became due from upcoming to ready."""
+        while self._upcoming and self._upcoming[0][0] <= now:
+            due, _, key = heapq.heappop(self._upcoming)
+            if self._is_current(key, due):
+                self._make_ready(key, due)
+
+    def _ready_entries(self) -> List[Tuple[int, datetime, int, Key]]:
+        entries = []
+        while self._ready:
+            entry = heapq.heappop(self._ready)
+            if self._is_current(entry[3], entry[1], -entry[0]) and \
+                    entry[3] not in {e[3] for e in entries}:
+                entries.append(entry)
+        return entries
+
+    def _update_metrics(self, now: datetime):
+        waiting = [e for e in self._ready
+                   if self._is_current(e[3], e[1], -e[0])]
+        lag = max(((now - e[1]).total_seconds() for e in waiting),
+                  default=0.0)
+        metrics.SCHEDULER_QUEUE_DEPTH.set(len({e[3] for e in waiting}),
+                                          cluster=self.cluster)
+        metrics.SCHEDULER_RUNNING.set(len(self._running),
+                                      cluster=self.cluster)
+        metrics.SCHEDULER_MAX_LAG.set(lag, cluster=self.cluster)
+
+    # dispatching
+
+    async def _nodes(self, spec: BackupSpec) -> Set[str]:
+        pods = await run_blocking(list_pods_for_deployment, spec.name,
+                                  spec.namespace)
+        return {pod.spec.node_name for pod in pods or []
+                if pod.spec.node_name}
+
+    def _has_slot(self, key: Key, nodes: Set[str]) -> bool:
+        if self._running_namespaces[key[0]] >= self.namespace_concurrency:
+            return False
+        return all(self._running_nodes[node] < self.node_concurrency
+                   for node in nodes)
+
+    async def _dispatch(self):
+        """Starts due backups in order of priority while slots are free."""
+        deferred = []
+        for entry in self._ready_entries():
+            _, due, _, key = entry
+            if self._stopped or len(self._running) >= self.concurrency:
+                deferred.append(entry)
+                continue
+            if self._running_namespaces[key[0]] >= \
+                    self.namespace_concurrency:
+                deferred.append(entry)
+                continue
+
+            nodes = await self._nodes(self._specs[key])
+            if not self._is_current(key, due) or \
+                    not self._has_slot(key, nodes):
+                deferred.append(entry)
+                continue
+            self._start(self._specs[key], due, nodes)
+
+        for entry in deferred:
+            heapq.heappush(self._ready, entry)
+
+    def _start(self, spec: BackupSpec, due: datetime, nodes: Set[str]):
+        key = spec.key
+        del self._due[key]
+        self._running[key] = nodes
+        self._running_namespaces[key[0]] += 1
+        self._running_nodes.update(nodes)
+        lag = (_now() - due).total_seconds()
+        metrics.SCHEDULER_LAG.observe(lag, namespace=spec.namespace,
+                                      cluster=self.cluster)
+        log.info("Starting backup of %s/%s, %.0fs after it was due",
+                 spec.namespace, spec.name, lag)
+
+        task = asyncio.ensure_future(self._backup(spec))
+        self._tasks.add(task)
+        task.add_done_callback(lambda t: self._finished(key, t))
+
+    async def _backup(self, spec: BackupSpec) -> BackupResult:
+        result = await backup_deployment(spec.name, spec.namespace,
+                                         spec.store, **self.options)
+        if result.succeeded:
+            # the schedule continues from here after a restart, see
+            # BackupSpec.first_due
+            await run_blocking(annotate_deployment, spec.name,
+                               spec.namespace,
+                               {LAST_BACKUP_ANNOTATION: _now().isoformat()})
+        return result
+
+    def _finished(self, key: Key, task: asyncio.Task):
+        self._tasks.discard(task)
+        nodes = self._running.pop(key)
+        self._running_namespaces[key[0]] -= 1
+        self._running_nodes.subtract(nodes)
+        if task.cancelled():
+            log.warning(f"Backup of {key[0]}/{key[1]} was cancelled")
+        else:
+            result: BackupResult = task.result()
+            log.info("Finished backup %s", result)
+
+        spec = self._specs.get(key)
+        if spec is not None:
+            due = spec.schedule.next_after(_now())
+            log.debug("Next backup of %s/%s at %s", key[0], key[1], due)
+            self._queue(key, due)
+        self._wakeup()
+
+    # watching
+
+    def _wakeup(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    def _call_soon(self, fn: Callable, *args):
+        self._loop.call_soon_threadsafe(fn, *args)
+
+    def _watch(self, namespace: Optional[str]):
+        """Feeds Deployment changes to the event loop, runs in a thread."""
+        api = clients.apps(self.cluster)
+        if namespace is None:
+            list_fn, args = api.list_deployment_for_all_namespaces, ()
+        else:
+            list_fn, args = api.list_namespaced_deployment, (namespace,)
+        kwargs = {"label_selector": self.selector} if self.selector else {}
+
+        resource_version = None
+        while not self._stopped:
+            try:
+                if resource_version is None:
+                    result = list_fn(*args, **kwargs)
+                    resource_version = result.metadata.resource_version
+                    self._call_soon(self._sync, namespace, result.items)
+
+                for event_type, obj in stream_events(
+                        list_fn, args, kwargs, resource_version,
+                        WATCH_TIMEOUT):
+                    resource_version = obj.metadata.resource_version
+                    if event_type == "DELETED":
+                        self._call_soon(self._remove, (obj.metadata.namespace,
+                                                       obj.metadata.name))
+                    else:
+                        self._call_soon(self._update, obj)
+            except WatchExpired:
+                log.debug("Deployment watch of %s expired, relisting.",
+                          self)
+                resource_version = None
+            except Exception as e:
+                sentry_sdk.capture_exception(e)
+                log.warning(f"Deployment watch of {self} failed, relisting "
+                            f"in {RETRY_INTERVAL}s: {e!r}")
+                resource_version = None
+                time.sleep(RETRY_INTERVAL)
+
+    def stop(self):
+        """Stops starting backups, run returns once running ones finished."""
+        log.info("Stopping %s", self)
+        self._stopped = True
+        self._wakeup()
+
+    async def run(self):
+        """Runs the scheduler until stop is called."""
+        with clients.use(self.cluster):
+            await self._run()
+
+    async def _run(self):
+        self._loop = asyncio.get_event_loop()
+        self._wake = asyncio.Event()
+        for namespace in self.namespaces or [None]:
+            threading.Thread(target=self._watch, args=(namespace,),
+                             name=f"scheduler-watch-{namespace}",
+                             daemon=True).start()
+
+        while not (self._stopped and not self._running):
+            self._wake.clear()
+            now = _now()
+            self._promote(now)
+            await self._dispatch()
+            self._update_metrics(now)
+
+            timeout = None
+            if self._upcoming:
+                timeout = max(0.0, (self._upcoming[0][0] - _now())
+                              .total_seconds())
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        log.info("Stopped %s", self)
+
+
+def run_daemon(schedulers: List[Scheduler], stop_signals: List[int]=()):
+    """Runs Schedulers, e.g. one per cluster, at the same time.
+
+    All of them are stopped gracefully on any of stop_signals.
+    """
+    def _stop():
+        for scheduler in schedulers:
+            scheduler.stop()
+
+    async def _run():
+        loop = asyncio.get_event_loop()
+        for signal in stop_signals:
+            loop.add_signal_handler(signal, _stop)
+        await asyncio.gather(*[scheduler.run() for scheduler in schedulers])
+    asyncio.run(_run())
@@ -0,0 +1,150 @@
+import re
+
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Set
+
+__author__ = "Noah Hummel"
+
+
+class ScheduleFormatError(Exception):
+    pass
+
+
+_ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+
+_DURATION = re.compile(r"^(?:(\d+)d)?(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?$")
+
+# days searched for a matching date, covers Feb 29 in the next leap year
+_HORIZON = 366 * 8
+
+
+class Schedule(ABC):
+    """When a Deployment is due for a backup."""
+
+    @abstractmethod
+    def next_after(self, t: datetime) -> datetime:
+        """Returns the first time the schedule fires after t."""
+
+
+class IntervalSchedule(Schedule):
+    """Fires at a fixed interval, e.g. "@every 6h"."""
+
+    def __init__(self, interval: timedelta):
+        self.interval = interval
+
+    def __repr__(self):
+        return f"IntervalSchedule({self.interval})"
+
+    def __eq__(self, other):
+        return isinstance(other, IntervalSchedule) and \
+            self.interval == other.interval
+
+    def next_after(self, t: datetime) -> datetime:
+        return t + self.interval
+
+
+def _parse_field(field: str, low: int, high: int) -> Set[int]:
+    values = set()
+    for part in field.split(","):
+        match = re.match(r"^(\*|\d+)(?:-(\d+))?(?:/(\d+))?$", part)
+        if not match:
+            raise ScheduleFormatError(f"Invalid cron field {field!r}")
+        start, end, step = match.groups()
+        if start == "*":
+            start, end = low, high
+        else:
+            start = int(start)
+            end = int(end) if end is not None else \
+                (high if step is not None else start)
+        step = int(step) if step is not None else 1
+        if not low <= start <= end <= high or step < 1:
+            raise ScheduleFormatError(f"Invalid cron field {field!r}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule(Schedule):
+    """Fires like a cron job, e.g. "30 2 * * *" for 02:30 every day.
+
+    Supports the five standard fields (minute, hour, day of month, month,
+    day of week) with lists, ranges and steps. Like cron, a day matches if
+    either the day of month or the day of week matches when both are
+    restricted.
+
+    Raises:
+        ScheduleFormatError: If expression isn't a valid cron expression.
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ScheduleFormatError(
+                f"Expected 5 fields in cron expression {expression!r}")
+        minute, hour, day, month, weekday = fields
+        self.minutes = sorted(_parse_field(minute, 0, 59))
+        self.hours = sorted(_parse_field(hour, 0, 23))
+        self.days = _parse_field(day, 1, 31)
+        self.months = _parse_field(month, 1, 12)
+        # 0 and 7 are both Sunday
+        self.weekdays = {d % 7 for d in _parse_field(weekday, 0, 7)}
+        self._any_day = day == "*"
+        self._any_weekday = weekday == "*"
+
+    def __repr__(self):
+        return f"CronSchedule({self.expression!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, CronSchedule) and \
+            self.expression == other.expression
+
+    def _day_matches(self, t: datetime) -> bool:
+        if t.month not in self.months:
+            return False
+        day = t.day in self.days
+        weekday = (t.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, t: datetime) -> datetime:
+        t = t.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = t.replace(hour=0, minute=0)
+        for _ in range(_HORIZON):
+            if self._day_matches(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate >= t:
+                            return candidate
+            day += timedelta(days=1)
+        raise ScheduleFormatError(f"{self.expression!r} never fires")
+
+
+def parse_schedule(text: str) -> Schedule:
+    """Parses a cron expression, an alias like "@daily" or "@every 6h".
+
+    Raises:
+        ScheduleFormatError: If text isn't a valid schedule.
+    """
+    text = text.strip()
+    if text.startswith("@every"):
+        match = _DURATION.match(text[len("@every"):].strip())
+        if not match or not any(match.groups()):
+            raise ScheduleFormatError(f"Invalid interval {text!r}")
+        days, hours, minutes, seconds = (int(g or 0) for g in match.groups())
+        interval = timedelta(days=days, hours=hours, minutes=minutes,
+                             seconds=seconds)
+        if interval < timedelta(minutes=1):
+            raise ScheduleFormatError(f"Interval {text!r} is below 1m")
+        return IntervalSchedule(interval)
+    return CronSchedule(_ALIASES.get(text, text))
@@ -1,17 +1,31 @@
+import logging
 import os
+import re
 
-import yaml
-from typing import List, Dict
+from typing import Callable, Collection, List, Dict, Tuple
 
 import logger
-from algorithm import new_volume_mounts_with_canonical_mount_path
-from k8s.resource import to_camel_case
-from k8s.resource.deployment import get_volumes, copy_volumes
+from algorithm import new_volume_mounts_with_canonical_mount_path, \
+    get_canonical_mount_path, shard_by_size
+from k8s.resource import camel_case
+from k8s.resource.deployment import get_volumes
+from sidecar_deploy.cache import add_cache
+from sidecar_deploy.template import load_template
 
 __author__ = "Noah Hummel"
 log = logger.get(__name__)
 
 
+# settings in the environment of the runner which every sidecar gets, e.g.
+# RESTIC_COMPRESSION=max, the RESTIC_ ones need restic>=0.14
+RESTIC_SETTINGS = (
+    "RESTIC_PACK_SIZE",  # target size of pack files in MiB
+    "RESTIC_COMPRESSION",  # auto, off or max
+    "RESTIC_READ_CONCURRENCY",  # files read at the same time by backup
+    "SFTP_CONNECTIONS",  # connections to the SFTP server, sftp.connections
+)
+
+
 def _from_secret(variable_name: str, secret_name: str, secret_key: str) -> dict:
     return {
         "name": variable_name,
@@ -24,34 +38,47 @@ def _from_secret(variable_name: str, secret_name: str, secret_key: str) -> dict:
     }
 
 
-def new_backup_sidecar_deployment(backup_paths: List[str],
-                                  store_secret_name: str) -> Dict:
-    """Generates a k8s Deployment for the restic-backup-sidecar container.
+def get_restic_host(namespace: str, name: str=None) -> str:
+    """Returns the stable hostname of the sidecars backing up a Deployment.
+
+    restic tags every snapshot with the hostname and only uses an earlier
+    snapshot with the same host and paths as parent, whose unchanged files
+    are skipped without being read. Pods are named randomly, so sidecars get
+    a hostname derived from what they back up instead.
 
     Args:
-        backup_paths:
-            List of paths to back up.
-        store_secret_name:
-            Name of k8s secret with configuration of backup location.
+        namespace: Namespace of the volumes.
+        name: Name of the Deployment, None for the PVCs shared by several
+            Deployments of the namespace, see runner.shared.
 
     Returns:
-        A k8s Deployment for the restic-backup-sidecar container as Dict
+        The hostname, a DNS label.
     """
-    with open("/app/src/sidecar_deploy/backup.yml") as f:
-        deployment: Dict = yaml.safe_load(f)
-
-    # backup sidecar configuration
-    deployment_name = deployment["metadata"]["name"] + f"-{os.urandom(16).hex()}"
-    deployment["metadata"]["name"] = deployment_name
-    deployment["metadata"]["labels"]["app"] = deployment_name
-    deployment["spec"]["selector"]["matchLabels"]["app"] = deployment_name
-    deployment["spec"]["template"]["metadata"]["labels"]["app"] = \
-        deployment_name
-    deployment["spec"]["template"]["spec"]["volumes"][0]["secret"]\
+    host = f"{namespace}-{name}" if name else namespace
+    # hostnames are DNS labels of at most 63 characters, without dots
+    return re.sub(r"[^a-z0-9-]", "-", host.lower())[:63].strip("-")
+
+
+def _configure_sidecar(manifest: Dict, backup_paths: List[str],
+                       store_secret_name: str, host: str=None) -> str:
+    """Names a sidecar manifest uniquely and configures its backup.
+
+    The sidecar gets the RESTIC_SETTINGS set for the runner and mounts the
+    restic cache, if one is configured. If host is given, it is used as
+    hostname of the Pod, which restic tags snapshots with, and passed to
+    restic>=0.16 as RESTIC_HOST, see get_restic_host.
+
+    Returns:
+        The name of the sidecar.
+    """
+    name = manifest["metadata"]["name"] + f"-{os.urandom(16).hex()}"
+    manifest["metadata"]["name"] = name
+    manifest["metadata"]["labels"]["app"] = name
+    manifest["spec"]["template"]["metadata"]["labels"]["app"] = name
+    manifest["spec"]["template"]["spec"]["volumes"][0]["secret"]\
         ["secretName"] = store_secret_name
-    deployment["spec"]["template"]["spec"]["containers"][0]["name"] = \
-        deployment_name
-    deployment["spec"]["template"]["spec"]["containers"][0]["env"] = [
+    manifest["spec"]["template"]["spec"]["containers"][0]["name"] = name
+    manifest["spec"]["template"]["spec"]["containers"][0]["env"] = [
         _from_secret("SFTP_PATH", store_secret_name, "path"),
         _from_secret("SFTP_USER", store_secret_name, "user"),
         _from_secret("SFTP_HOST", store_secret_name, "host"),
@@ -61,23 +88,239 @@ def new_backup_sidecar_deployment(backup_paths: List[str],
             "name": "BACKUP_PATHS",
             "value": ",".join(backup_paths)
         }
-    ]
+    ] + [{"name": setting, "value": os.environ[setting]}
+         for setting in RESTIC_SETTINGS if os.environ.get(setting)]
+    if host:
+        manifest["spec"]["template"]["spec"]["hostname"] = host
+        manifest["spec"]["template"]["spec"]["containers"][0]["env"]\
+            .append({"name": "RESTIC_HOST", "value": host})
+    add_cache(manifest)
+    return name
+
+
+def new_backup_sidecar_job(backup_paths: List[str], store_secret_name: str,
+                           template: str="backup-job",
+                           host: str=None) -> Dict:
+    """Generates a k8s Job running the restic-backup-sidecar container once.
+
+    Unlike a Deployment, the Job's Pod isn't restarted after the backup
+    finished, and its completion can be waited for.
+
+    Args:
+        backup_paths:
+            List of paths to back up.
+        store_secret_name:
+            Name of k8s secret with configuration of backup location.
+        template:
+            Name of the Job template, see load_template.
+        host:
+            Hostname restic tags the snapshot with, see get_restic_host.
 
-    return deployment
+    Returns:
+        A k8s Job for the restic-backup-sidecar container as Dict
+    """
+    job: Dict = load_template(template)
+    _configure_sidecar(job, backup_paths, store_secret_name, host)
+    return job
 
 
-def new_backup_sidecar_deployment_with_volumes(deployment: Dict,
-                                               store_secret_name: str) -> Dict:
-    volumes = get_volumes(deployment, exclude_secrets=True)
+def _mount_volumes(sidecar: Callable[[List[str]], Dict],
+                   volumes: List[Dict]) -> Dict:
+    """Creates a sidecar mounting the given volumes.
+
+    Args:
+        sidecar: Function creating the sidecar for a list of backup paths.
+        volumes: camelCase volumes to back up.
+
+    Returns:
+        The sidecar as Dict.
+    """
     volume_mounts = new_volume_mounts_with_canonical_mount_path(volumes)
     backup_paths = [vm["mountPath"] for vm in volume_mounts]
-    sidecar_deployment = new_backup_sidecar_deployment(backup_paths,
-                                                       store_secret_name)
-    sidecar_deployment = copy_volumes(deployment, sidecar_deployment)
-    sidecar_deployment["spec"]["template"]["spec"]["containers"][0]\
+    manifest = sidecar(backup_paths)
+    manifest["spec"]["template"]["spec"]["volumes"].extend(volumes)
+    manifest["spec"]["template"]["spec"]["containers"][0]\
         ["volumeMounts"].extend(volume_mounts)
 
-    mounting_table = [f"{vm['name']} -> {vm['mountPath']}" for vm in
-                      volume_mounts]
-    log.debug(f"Created mounting table: {mounting_table}")
-    return to_camel_case(sidecar_deployment)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Created mounting table: %s",
+                  [f"{vm['name']} -> {vm['mountPath']}"
+                   for vm in volume_mounts])
+    return manifest
+
+
+def _backup_volumes(deployment: Dict) -> List[Dict]:
+    # the sidecar template is already camelCase, only the volumes copied from
+    # the deployment need to be normalized
+    return get_volumes(deployment, exclude_secrets=True, convert=camel_case)
+
+
+def new_restore_sidecar_job(restore_paths: List[str], snapshot: str,
+                            store_secret_name: str,
+                            template: str="restore-job", host: str=None,
+                            snapshot_paths: List[str]=()) -> Dict:
+    """Generates a k8s Job restoring paths from a restic snapshot once.
+
+    Args:
+        restore_paths:
+            List of paths to restore, files in the snapshot outside of them
+            are skipped.
+        snapshot:
+            ID of the restic snapshot to restore from, or "latest".
+        store_secret_name:
+            Name of k8s secret with configuration of backup location.
+        template:
+            Name of the Job template, see load_template.
+        host:
+            With "latest", only snapshots restic tagged with this hostname
+            are considered, see get_restic_host.
+        snapshot_paths:
+            With "latest", only snapshots of all of these paths are
+            considered.
+
+    Returns:
+        A k8s Job for the restore sidecar container as Dict
+    """
+    job: Dict = load_template(template)
+    _configure_sidecar(job, restore_paths, store_secret_name)
+    container = job["spec"]["template"]["spec"]["containers"][0]
+    if os.environ.get("SFTP_CONNECTIONS"):
+        # expanded by kubernetes like the other $(VAR) of the template
+        command = container["args"].index("restore")
+        container["args"][command:command] = [
+            "-o", "sftp.connections=$(SFTP_CONNECTIONS)"]
+    container["args"].extend([snapshot, "--target", "/"])
+    if snapshot == "latest":
+        # the latest snapshot of any Deployment otherwise, e.g. of another
+        # one whose volumes have the same names
+        if host:
+            container["args"].extend(["--host", host])
+        for path in snapshot_paths:
+            container["args"].extend(["--path", path])
+    for path in restore_paths:
+        container["args"].extend(["--include", path])
+    return job
+
+
+def new_backup_sidecar_jobs_with_volumes(deployment: Dict,
+                                         store_secret_name: str,
+                                         claim_sizes: Dict[str, int],
+                                         shards: int,
+                                         template: str="backup-job",
+                                         host: str=None) -> List[Dict]:
+    """Splits the volumes of a Deployment across parallel backup Jobs.
+
+    Volumes are balanced across the Jobs by the size of their PVCs, so each
+    Job backs up about the same amount of data. Volumes without a PVC, or
+    whose PVC size is unknown, count as empty.
+
+    Args:
+        deployment: Deployment whose volumes to back up, as dict.
+        store_secret_name:
+            Name of k8s secret with configuration of backup location.
+        claim_sizes: Dict mapping PVC names to their capacity in bytes.
+        shards: Maximum number of Jobs.
+        template: Name of the Job template, see load_template.
+        host: Hostname restic tags the snapshots with, see get_restic_host.
+
+    Returns:
+        List of backup Jobs as Dict, at most one per volume.
+    """
+    # volumes of the same PVC stay in one Job, a ReadWriteOnce volume can't
+    # be attached to the nodes of two Jobs at once
+    groups: Dict[str, List[Dict]] = dict()
+    sizes = dict()
+    for volume in _backup_volumes(deployment):
+        claim = volume.get("persistentVolumeClaim")
+        key = f"pvc/{claim['claimName']}" if claim else volume["name"]
+        groups.setdefault(key, []).append(volume)
+        sizes[key] = claim_sizes.get(claim["claimName"], 0) if claim else 0
+
+    jobs = []
+    for shard in shard_by_size(sizes, shards):
+        jobs.append(_mount_volumes(
+            lambda paths: new_backup_sidecar_job(paths, store_secret_name,
+                                                 template, host),
+            [volume for key in shard for volume in groups[key]]))
+        log.debug("Shard %s backs up %d bytes: %s",
+                  jobs[-1]["metadata"]["name"],
+                  sum(sizes[key] for key in shard), shard)
+    return jobs
+
+
+def new_restore_sidecar_jobs_with_volumes(deployment: Dict,
+                                          store_secret_name: str,
+                                          plan: List[Tuple[str, str]],
+                                          template: str="restore-job",
+                                          shared_claims: Collection[str]=()) \
+        -> List[Dict]:
+    """Generates a restore Job for each volume of a Deployment to restore.
+
+    Volumes are mounted at their canonical mountPath, which is the path
+    they were backed up from, so restic restores each volume in place.
+    PVCs shared with other Deployments are backed up from the canonical
+    mountPath of the PVC instead, see runner.shared, so PVC volumes are
+    mounted and restored at that path as well.
+
+    The "latest" snapshot of a volume is the latest one of the Deployment's
+    restic host and the volume's path, or of the namespace's host and the
+    PVC's path if the PVC is shared.
+
+    Args:
+        deployment: Deployment whose volumes to restore, as dict.
+        store_secret_name:
+            Name of k8s secret with configuration of backup location.
+        plan: (snapshot, volume name) for every volume to restore.
+        template: Name of the Job template, see load_template.
+        shared_claims:
+            Names of the PVCs shared with other Deployments, see
+            runner.shared.list_shared_claims.
+
+    Returns:
+        List of restore Jobs as Dict, in the order of plan.
+    """
+    namespace = deployment["metadata"]["namespace"]
+    volumes = {v["name"]: v for v in _backup_volumes(deployment)}
+    jobs = []
+    for snapshot, volume in plan:
+        claim = volumes[volume].get("persistentVolumeClaim")
+        claim_paths = _list_claim_paths(volumes[volume])
+        if claim and claim["claimName"] in shared_claims:
+            host = get_restic_host(namespace)
+            snapshot_paths = [get_canonical_mount_path(
+                {"name": claim["claimName"]})]
+        else:
+            host = get_restic_host(namespace, deployment["metadata"]["name"])
+            snapshot_paths = [get_canonical_mount_path(volumes[volume])]
+        job = _mount_volumes(
+            lambda paths: new_restore_sidecar_job(
+                paths + claim_paths, snapshot, store_secret_name, template,
+                host, snapshot_paths),
+            [volumes[volume]])
+        job["spec"]["template"]["spec"]["containers"][0]["volumeMounts"]\
+            .extend({"name": volume, "mountPath": path}
+                    for path in claim_paths)
+        jobs.append(job)
+    return jobs
+
+
+def _list_claim_paths(volume: Dict) -> List[str]:
+    # the path a PVC shared by several Deployments is backed up from, unless
+    # the volume is mounted there anyway
+    claim = volume.get("persistentVolumeClaim")
+    if not claim:
+        return []
+    path = get_canonical_mount_path({"name": claim["claimName"]})
+    return [] if path == get_canonical_mount_path(volume) else [path]
+
+
+def list_backup_volumes(deployment: Dict) -> List[str]:
+    """Returns the names of the volumes of a Deployment which are backed up."""
+    return [v["name"] for v in _backup_volumes(deployment)]
+
+
+def list_sidecar_claims(sidecar: Dict) -> List[str]:
+    """Returns the names of the PVCs mounted by a sidecar."""
+    volumes = sidecar["spec"]["template"]["spec"]["volumes"]
+    return [v["persistentVolumeClaim"]["claimName"] for v in volumes
+            if v.get("persistentVolumeClaim")]
@@ -0,0 +1,44 @@
+import os
+
+from typing import Dict
+
+import logger
+
+__author__ = "Noah Hummel"
+log = logger.get(__name__)
+
+
+# where restic's local cache of the repository index is kept between runs:
+# "node" in a hostPath on each node, anything else starts every sidecar with
+# an empty cache
+CACHE = os.environ.get("SIDECAR_CACHE", "").lower()
+CACHE_HOST_PATH = os.environ.get("SIDECAR_CACHE_HOST_PATH",
+                                 "/var/cache/backup-runner")
+
+CACHE_VOLUME = "backup-runner-restic-cache"
+# mountPath of the cache in the sidecar, passed to restic as RESTIC_CACHE_DIR
+CACHE_DIR = "/var/cache/restic"
+
+
+def add_cache(manifest: Dict):
+    """Mounts the restic cache configured by SIDECAR_CACHE into a sidecar.
+
+    Does nothing if the cache is disabled. Jobs run on any node, so the
+    cache is kept on every node rather than in a PVC, which only some nodes
+    could attach at a time.
+
+    Args:
+        manifest: The sidecar Job as Dict.
+    """
+    if CACHE != "node":
+        return
+
+    pod_spec = manifest["spec"]["template"]["spec"]
+    pod_spec["volumes"].append({
+        "name": CACHE_VOLUME,
+        "hostPath": {"path": CACHE_HOST_PATH, "type": "DirectoryOrCreate"}})
+    container = pod_spec["containers"][0]
+    container["volumeMounts"].append({"name": CACHE_VOLUME,
+                                      "mountPath": CACHE_DIR})
+    container["env"].append({"name": "RESTIC_CACHE_DIR",
+                             "value": CACHE_DIR})
@@ -0,0 +1,53 @@
+import os
+import pkgutil
+
+from functools import lru_cache
+from typing import Dict
+
+import yaml
+
+import logger
+from k8s.resource import copy_resource
+
+try:  # LibYAML is much faster, but optional
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+__author__ = "Noah Hummel"
+log = logger.get(__name__)
+
+
+# None reads the templates bundled with this package, which also works when
+# the runner is run from a zipapp
+TEMPLATE_DIR = os.environ.get("SIDECAR_TEMPLATE_DIR")
+
+
+@lru_cache(maxsize=None)
+def _parse(template_dir: str, name: str) -> Dict:
+    log.debug("Parsing template %s from %s using %s", name,
+              template_dir or "package", SafeLoader.__name__)
+    if template_dir:
+        with open(os.path.join(template_dir, f"{name}.yml"), "rb") as f:
+            data = f.read()
+    else:
+        data = pkgutil.get_data(__package__, f"{name}.yml")
+    return yaml.load(data, Loader=SafeLoader)
+
+
+def load_template(name: str, template_dir: str=None) -> Dict:
+    """Returns a fresh copy of a named manifest template.
+
+    Each template file is parsed only once per process, every call returns
+    a structural copy of the parsed prototype which can be modified freely.
+
+    Args:
+        name: Name of the template, e.g. "backup-job" for backup-job.yml.
+        template_dir:
+            Directory containing the template, defaults to the
+            SIDECAR_TEMPLATE_DIR environment variable or this package.
+
+    Returns:
+        The template as Dict.
+    """
+    return copy_resource(_parse(template_dir or TEMPLATE_DIR, name))
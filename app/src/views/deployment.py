@@ -0,0 +1,63 @@
+import sentry_sdk
+from typing import List
+
+from kubernetes.client import V1Deployment
+from kubernetes.client.rest import ApiException
+
+from k8s import clients, informer
+from k8s.watch import watchable, WatchSource, first_or_none
+
+__author__ = "Noah Hummel"
+
+
+def _watch_deployment(name: str, namespace: str) -> WatchSource:
+    api = clients.apps()
+    return WatchSource(api.list_namespaced_deployment, namespace,
+                       field_selector=f"metadata.name={name}",
+                       project=first_or_none)
+
+
+@informer.cached
+@watchable(_watch_deployment)
+def get_deployment(name: str, namespace: str) -> V1Deployment:
+    deployments = informer.get("deployment", namespace)
+    if deployments is not None:
+        return deployments.get(name)
+
+    try:
+        api = clients.apps()
+        return api.read_namespaced_deployment(name, namespace)
+    except ApiException as e:
+        sentry_sdk.capture_exception(e)
+
+
+def list_deployments(namespaces: List[str]=None, selector: str=None) \
+        -> List[V1Deployment]:
+    """Lists Deployments matching a label selector.
+
+    Args:
+        namespaces:
+            Namespaces to list Deployments in. If None, Deployments in all
+            namespaces are listed.
+        selector: Label selector, e.g. "app=web,tier!=cache".
+
+    Returns:
+        Matching Deployments, ordered by namespace and name.
+    """
+    api = clients.apps()
+    kwargs = {"label_selector": selector} if selector else {}
+    try:
+        if namespaces is None:
+            deployments = api.list_deployment_for_all_namespaces(
+                **kwargs).items
+        else:
+            deployments = []
+            for namespace in namespaces:
+                deployments.extend(
+                    api.list_namespaced_deployment(namespace, **kwargs).items)
+    except ApiException as e:
+        sentry_sdk.capture_exception(e)
+        return []
+
+    return sorted(deployments, key=lambda d: (d.metadata.namespace,
+                                              d.metadata.name))
@@ -0,0 +1,48 @@
+import sentry_sdk
+from kubernetes.client import V1Job
+from kubernetes.client.rest import ApiException
+
+from typing import Optional
+
+from k8s import clients
+from k8s.watch import watchable, WatchSource, first_or_none
+
+__author__ = "Noah Hummel"
+
+
+def _watch_job(name: str, namespace: str) -> WatchSource:
+    api = clients.batch()
+    return WatchSource(api.list_namespaced_job, namespace,
+                       field_selector=f"metadata.name={name}",
+                       project=first_or_none)
+
+
+@watchable(_watch_job)
+def get_job(name: str, namespace: str) -> V1Job:
+    try:
+        api = clients.batch()
+        return api.read_namespaced_job(name, namespace)
+    except ApiException as e:
+        sentry_sdk.capture_exception(e)
+
+
+def read_job_log(name: str, namespace: str, tail_lines: int=20) \
+        -> Optional[str]:
+    """Reads the end of the log of a Job's last successful Pod.
+
+    Returns:
+        The last tail_lines lines of the log, None if the Job has no Pods or
+        the log can't be read.
+    """
+    try:
+        core = clients.core()
+        pods = core.list_namespaced_pod(
+            namespace, label_selector=f"job-name={name}").items
+        if not pods:
+            return None
+        succeeded = [p for p in pods if p.status.phase == "Succeeded"]
+        pod = (succeeded or pods)[-1]
+        return core.read_namespaced_pod_log(pod.metadata.name, namespace,
+                                            tail_lines=tail_lines)
+    except ApiException as e:
+        sentry_sdk.capture_exception(e)
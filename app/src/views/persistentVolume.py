@@ -0,0 +1,41 @@
+import sentry_sdk
+from kubernetes.client import V1PersistentVolume
+from kubernetes.client.rest import ApiException
+
+from typing import Dict, List
+
+from k8s import clients
+
+__author__ = "Noah Hummel"
+
+
+def list_persistent_volumes(volume_names: List[str]) \
+        -> Dict[str, V1PersistentVolume]:
+    """Fetches PersistentVolumes by name with at most one request.
+
+    A single volume is fetched directly and multiple volumes with one list.
+    Volumes which don't exist or can't be fetched are left out.
+
+    Args:
+        volume_names: Names of the PersistentVolumes.
+
+    Returns:
+        Dict mapping the names to the PersistentVolumes.
+    """
+    if not volume_names:
+        return dict()
+
+    api = clients.core()
+    try:
+        if len(volume_names) == 1:
+            volumes = [api.read_persistent_volume(volume_names[0])]
+        else:
+            volumes = api.list_persistent_volume().items
+    except ApiException as e:
+        if e.status != 404:
+            sentry_sdk.capture_exception(e)
+        return dict()
+
+    names = set(volume_names)
+    return {pv.metadata.name: pv for pv in volumes
+            if pv.metadata.name in names}
@@ -1,9 +1,10 @@
 
 import sentry_sdk
-from typing import List
-from kubernetes import client
-from kubernetes.client import V1PersistentVolumeClaim
+from typing import List, Dict, Tuple, Optional
+from kubernetes.client import V1PersistentVolumeClaim, V1Volume
 from kubernetes.client.rest import ApiException
+
+from k8s import clients, informer
 from views.volume import list_volumes_for_deployment
 import logger
 
@@ -12,31 +13,95 @@ log = logger.get(__name__)
 __author__ = "Noah Hummel"
 
 
+def _claims_by_name(claim_names: List[str], namespace: str) \
+        -> Dict[str, V1PersistentVolumeClaim]:
+    """Fetches PVCs by name with at most one request.
+
+    Reads from the PVC informer if informers are enabled. Otherwise a single
+    claim is fetched directly and multiple claims with one namespaced list.
+    PVCs which don't exist or can't be fetched are left out.
+    """
+    claims = informer.get("persistentvolumeclaim", namespace)
+    if claims is not None:
+        pvcs = [claims.get(claim_name) for claim_name in claim_names]
+        return {pvc.metadata.name: pvc for pvc in pvcs if pvc is not None}
+
+    api = clients.core()
+    try:
+        if len(claim_names) == 1:
+            pvcs = [api.read_namespaced_persistent_volume_claim(
+                claim_names[0], namespace)]
+        else:
+            pvcs = api.list_namespaced_persistent_volume_claim(
+                namespace).items
+    except ApiException as e:
+        if e.status != 404:
+            sentry_sdk.capture_exception(e)
+        return dict()
+
+    return {pvc.metadata.name: pvc for pvc in pvcs}
+
+
+def list_claims_for_volumes(volumes: List[V1Volume], namespace: str) \
+        -> List[Tuple[V1Volume, Optional[V1PersistentVolumeClaim]]]:
+    """Joins PVC-backed volumes with their PVCs.
+
+    Args:
+        volumes: Volumes of a pod spec, volumes without a PVC are skipped.
+        namespace: Namespace of the pod spec.
+
+    Returns:
+        (volume, PVC) for every PVC-backed volume in the order of volumes.
+        The PVC is None if it doesn't exist or can't be fetched.
+    """
+    claimed = []
+    for volume in volumes:
+        if volume.persistent_volume_claim is None:
+            log.debug("Volume %s was not dynamically provided, skipping.",
+                      volume.name)
+            continue
+        log.debug("Volume %s was dynamically provided for PVC %s",
+                  volume.name, volume.persistent_volume_claim.claim_name)
+        claimed.append(volume)
+
+    if not claimed:
+        return []
+
+    claim_names = list(dict.fromkeys(
+        v.persistent_volume_claim.claim_name for v in claimed))
+    pvcs = _claims_by_name(claim_names, namespace)
+    return [(v, pvcs.get(v.persistent_volume_claim.claim_name))
+            for v in claimed]
+
+
 def list_pvcs_for_deployment(name: str, namespace: str) \
         -> List[V1PersistentVolumeClaim]:
-    try:
-        volumes = list_volumes_for_deployment(name, namespace)
-        if not volumes:
-            log.debug("Deployment has no volumes")
-            return []
+    """Lists the PVCs mounted by a Deployment in the order of its volumes.
 
-        api = client.CoreV1Api()
-        pvcs = []
-        for volume in volumes:
-            log.debug(f"Deployment {name} has volume {volume.name}")
+    Claims which don't exist or can't be fetched are reported and left out.
 
-            if volume.persistent_volume_claim is None:
-                log.debug(f"Volume {volume.name} was not dynamically provided, "
-                          f"skipping.")
-                continue
+    Args:
+        name: Name of the Deployment.
+        namespace: Namespace of the Deployment.
 
-            claim = volume.persistent_volume_claim
-            log.debug(f"Volume {volume.name} was dynamically provided for PVC "
-                      f"{claim.claim_name}")
-            pvcs.append(api.read_namespaced_persistent_volume_claim(
-                claim.claim_name, namespace))
+    Returns:
+        The PVCs of the Deployment, each PVC only once.
+    """
+    volumes = list_volumes_for_deployment(name, namespace)
+    if not volumes:
+        log.debug("Deployment has no volumes")
+        return []
 
-        return pvcs
+    pvcs = dict()
+    missing = []
+    for volume, pvc in list_claims_for_volumes(volumes, namespace):
+        if pvc is None:
+            missing.append(volume.persistent_volume_claim.claim_name)
+        else:
+            pvcs[pvc.metadata.name] = pvc
 
-    except ApiException as e:
-        sentry_sdk.capture_exception(e)
+    if missing:
+        log.warning(f"Deployment {namespace}/{name} mounts PVCs which don't "
+                    f"exist or can't be fetched: {', '.join(missing)}")
+
+    return list(pvcs.values())
@@ -1,20 +1,41 @@
 import sentry_sdk
-from kubernetes import client
 from kubernetes.client import V1Pod, V1Deployment
 from kubernetes.client.rest import ApiException
 from typing import List
 
 import logger
-from k8s.label import label_selector
+from k8s import clients, informer
+from k8s.label import label_selector, label_keys
+from k8s.watch import watchable, WatchSource
+from views.deployment import get_deployment
 
 __author__ = "Noah Hummel"
 log = logger.get(__name__)
 
 
+def _watch_pods_for_deployment(name: str, namespace: str) -> WatchSource:
+    apps = clients.apps()
+    core = clients.core()
+    deployment: V1Deployment = apps.read_namespaced_deployment(name, namespace)
+    selector = label_selector(deployment.spec.selector.match_labels)
+    return WatchSource(core.list_namespaced_pod, namespace,
+                       label_selector=selector)
+
+
+@informer.cached
+@watchable(_watch_pods_for_deployment)
 def list_pods_for_deployment(name: str, namespace: str) -> List[V1Pod]:
+    pods = informer.get("pod", namespace)
+    if pods is not None:
+        deployment = get_deployment(name, namespace)
+        if deployment is None:
+            return None
+        labels = deployment.spec.selector.match_labels
+        return pods.by_index("label", *label_keys(labels))
+
     try:
-        apps = client.AppsV1Api()
-        core = client.CoreV1Api()
+        apps = clients.apps()
+        core = clients.core()
         deployment: V1Deployment = apps.read_namespaced_deployment(name,
                                                                    namespace)
         labels = deployment.spec.selector.match_labels
@@ -23,3 +44,20 @@ def list_pods_for_deployment(name: str, namespace: str) -> List[V1Pod]:
         return pod_list.items
     except ApiException as e:
         sentry_sdk.capture_exception(e)
+
+
+def _watch_pods_for_job(name: str, namespace: str) -> WatchSource:
+    core = clients.core()
+    return WatchSource(core.list_namespaced_pod, namespace,
+                       label_selector=f"job-name={name}")
+
+
+@watchable(_watch_pods_for_job)
+def list_pods_for_job(name: str, namespace: str) -> List[V1Pod]:
+    """Lists the Pods of a Job, including Pods which are being deleted."""
+    try:
+        core = clients.core()
+        return core.list_namespaced_pod(
+            namespace, label_selector=f"job-name={name}").items
+    except ApiException as e:
+        sentry_sdk.capture_exception(e)
@@ -1,13 +1,14 @@
 import sentry_sdk
-from kubernetes import client
 from kubernetes.client.rest import ApiException
 
+from k8s import clients
+
 __author__ = "Noah Hummel"
 
 
 def get_scale_for_deployment(name: str, namespace: str) -> int:
     try:
-        v1 = client.AppsV1Api()
+        v1 = clients.apps()
         scale = v1.read_namespaced_deployment_scale(name, namespace)
         return scale.status.replicas
     except ApiException as e:
@@ -1,20 +1,18 @@
-import sentry_sdk
 from typing import List
 
-from kubernetes import client
 from kubernetes.client import V1Volume, V1Deployment
-from kubernetes.client.rest import ApiException
+
+from k8s import informer
+from views.deployment import get_deployment
 
 __author__ = "Noah Hummel"
 
 
+@informer.cached
 def list_volumes_for_deployment(name: str, namespace: str) \
         -> List[V1Volume]:
-    try:
-        api = client.AppsV1Api()
-        deployment: V1Deployment = api.read_namespaced_deployment(name,
-                                                                  namespace)
-        volumes = deployment.spec.template.spec.volumes
-        return volumes if volumes else []
-    except ApiException as e:
-        sentry_sdk.capture_exception(e)
+    deployment: V1Deployment = get_deployment(name, namespace)
+    if deployment is None:
+        return None
+    volumes = deployment.spec.template.spec.volumes
+    return volumes if volumes else []
@@ -0,0 +1,39 @@
+import sentry_sdk
+from kubernetes.client.rest import ApiException
+
+from typing import Dict, List
+
+from k8s import clients, informer
+from k8s.resource.volumeAttachment import GROUP, VERSION, PLURAL, \
+    get_persistent_volume_name
+
+__author__ = "Noah Hummel"
+
+
+@informer.cached
+def list_volume_attachments(volume_names: List[str]) -> List[Dict]:
+    """Lists the VolumeAttachments of PersistentVolumes.
+
+    There is no selector for the PersistentVolume of a VolumeAttachment, so
+    without informers every VolumeAttachment of the cluster is listed.
+
+    Args:
+        volume_names: Names of the PersistentVolumes.
+
+    Returns:
+        The VolumeAttachments as Dict, None if they can't be listed.
+    """
+    attachments = informer.get("volumeattachment", None)
+    if attachments is not None:
+        return [attachment for name in sorted(set(volume_names))
+                for attachment in attachments.by_index("volume", name)]
+
+    try:
+        api = clients.custom()
+        attachments = api.list_cluster_custom_object(GROUP, VERSION,
+                                                     PLURAL)["items"]
+    except ApiException as e:
+        sentry_sdk.capture_exception(e)
+        return None
+    names = set(volume_names)
+    return [a for a in attachments if get_persistent_volume_name(a) in names]
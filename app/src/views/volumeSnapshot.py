@@ -0,0 +1,18 @@
+import sentry_sdk
+from kubernetes.client.rest import ApiException
+
+from typing import Dict
+
+from k8s import clients
+from k8s.resource.volumeSnapshot import GROUP, VERSION, PLURAL
+
+__author__ = "Noah Hummel"
+
+
+def get_volume_snapshot(name: str, namespace: str) -> Dict:
+    try:
+        api = clients.custom()
+        return api.get_namespaced_custom_object(GROUP, VERSION, namespace,
+                                                PLURAL, name)
+    except ApiException as e:
+        sentry_sdk.capture_exception(e)